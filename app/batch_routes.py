@@ -0,0 +1,186 @@
+"""
+Пакетное построение маршрутов без Telegram: наборы для QA, "маршруты дня",
+регрессионные проверки после обновления данных.
+
+Вход - JSONL, по строке на маршрут:
+    {"id": "q1", "query": "Хочу пешком 2 часа по паркам", "lat": 56.32, "lon": 44.0}
+    {"id": "q2", "params": {"duration_minutes": 90, "travel_mode": "пеший", ...}, "lat": 56.3, "lon": 43.98}
+("params" - уже разобранный JSON в формате LLM; если его нет, разбирается "query").
+
+Запуск (в контейнере приложения, БД должна быть доступна):
+    python batch_routes.py --input queries.jsonl --output routes.jsonl --workers 4 \\
+        --cache /app/cache/travel_times.sqlite3
+
+Маршруты строятся в пуле процессов: prepare_query_params -> отбор кандидатов -> build_route.
+Время в пути между объектами кэшируется в общем SQLite-файле (--cache), поэтому процессы
+не запрашивают у OSRM одни и те же пары. Результаты пишутся в --output в порядке входа.
+"""
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+import main as bot
+from main import (OSRM_CACHE_PATH, OSRM_CACHE_SIZE, OSRM_CACHE_TTL, OSRM_URL, POI_MATRIX_STORE,
+                  YANDEX_TRANSPORT_MAPPING, OSRMClient, build_route, clean_llm_output, create_yandex_client,
+                  encode_query, fetch_all_objects, find_suitable_objects, generate_yandex_route_url, logger)
+from route_solver import SOLVERS
+from travel_cache import SqliteTravelTimeStore, TravelTimeCache
+
+# Состояние процесса-исполнителя (заполняется в _init_worker)
+_WORKER: Dict[str, Any] = {}
+
+
+# --- Процесс-исполнитель ---
+
+def _init_worker(objects: List[Dict[str, Any]], osrm_url: str, cache_path: str, use_llm: bool,
+                 solver: Optional[str], budget_ms: Optional[float]) -> None:
+    # Индекс объектов строится из уже загруженного родителем списка, без обращения к БД
+    bot.POI_INDEX.reload(objects)
+    if solver:
+        bot.ROUTE_SOLVER = solver
+    if budget_ms is not None:
+        bot.SOLVER_TIME_BUDGET_MS = budget_ms
+
+    store = SqliteTravelTimeStore(cache_path, OSRM_CACHE_TTL) if cache_path else None
+    cache = TravelTimeCache(maxsize=OSRM_CACHE_SIZE, ttl_s=OSRM_CACHE_TTL, store=store)
+    _WORKER["osrm_client"] = OSRMClient(base_url=osrm_url, cache=cache, matrix_store=POI_MATRIX_STORE)
+    _WORKER["use_llm"] = use_llm
+    _WORKER["llm_client"] = None
+
+
+def _parse_query(query: str) -> str:
+    """Кэш и локальный разбор, затем LLM (если разрешён). Возвращает очищенный JSON."""
+    parsed = bot.QUERY_PARSER.lookup(query)
+    if parsed is not None:
+        return parsed
+    if not _WORKER["use_llm"]:
+        raise ValueError("запрос не разобран локально, а LLM отключён (--no-llm)")
+    if _WORKER["llm_client"] is None:
+        _WORKER["llm_client"] = create_yandex_client()
+    response = encode_query(_WORKER["llm_client"], query)
+    cleaned = clean_llm_output(response.output[0].content[0].text)
+    json.loads(cleaned)
+    bot.QUERY_PARSER.store(query, cleaned)
+    return cleaned
+
+
+def plan_one(line: str) -> Dict[str, Any]:
+    """Строит маршрут для одной строки входа. Ошибки возвращаются в поле error, а не бросаются."""
+    started = time.perf_counter()
+    result: Dict[str, Any] = {}
+    try:
+        record = json.loads(line)
+        result["id"] = record.get("id")
+        lat, lon = float(record["lat"]), float(record["lon"])
+
+        if record.get("params") is not None:
+            params_json = json.dumps(record["params"], ensure_ascii=False)
+        else:
+            params_json = _parse_query(record["query"])
+        llm_params = json.loads(params_json)
+        result["params"] = llm_params
+
+        candidates = find_suitable_objects(params_json, lat, lon)
+        result["candidates"] = len(candidates)
+        if not candidates:
+            result.update(success=False, message="Нет подходящих объектов в радиусе поиска")
+        else:
+            route = build_route((lat, lon), candidates, llm_params, _WORKER["osrm_client"])
+            result.update(route)
+            if "pois" in route:
+                result["pois"] = [poi.as_dict() for poi in route["pois"]]
+            if route.get("success"):
+                points = [(lat, lon)] + [(poi["lat"], poi["lon"]) for poi in route["pois"]] + [(lat, lon)]
+                transport = YANDEX_TRANSPORT_MAPPING.get(llm_params.get("travel_mode", "пеший"), "pedestrian")
+                result["yandex_maps_url"] = generate_yandex_route_url(points, transport)
+    except Exception as e:
+        result.update(success=False, error=f"{type(e).__name__}: {e}")
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+# --- Родительский процесс ---
+
+def _read_lines(path: str) -> Iterator[str]:
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _count_lines(path: str) -> Optional[int]:
+    if path == "-":
+        return None
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пакетное построение маршрутов из JSONL")
+    parser.add_argument("--input", required=True, help="JSONL с запросами ('-' - stdin)")
+    parser.add_argument("--output", required=True, help="JSONL с результатами")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--cache", default=OSRM_CACHE_PATH,
+                        help="SQLite-файл общего кэша времени в пути (по умолчанию OSRM_CACHE_PATH)")
+    parser.add_argument("--osrm-url", default=OSRM_URL)
+    parser.add_argument("--no-llm", action="store_true", help="Только локальный разбор запросов, без LLM")
+    parser.add_argument("--solver", choices=sorted(SOLVERS), help="Решатель (по умолчанию ROUTE_SOLVER)")
+    parser.add_argument("--budget-ms", type=float, help="Бюджет времени ILS на маршрут, мс")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="Интервал отчёта о прогрессе, сек")
+    args = parser.parse_args()
+
+    if not args.cache:
+        logger.warning("Общий кэш не задан (--cache / OSRM_CACHE_PATH): у каждого процесса будет свой кэш в памяти")
+
+    objects = [dict(obj) for obj in fetch_all_objects()]
+    logger.info(f"Объектов: {len(objects)}, процессов: {args.workers}")
+    total = _count_lines(args.input)
+
+    # spawn: процессы не наследуют соединения с БД и SQLite родителя
+    context = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    last_report = started
+    done = succeeded = failed = 0
+    latencies: List[float] = []
+
+    with context.Pool(args.workers, initializer=_init_worker,
+                      initargs=(objects, args.osrm_url, args.cache, not args.no_llm, args.solver, args.budget_ms)) as pool, \
+            open(args.output, "w", encoding="utf-8") as out:
+        for result in pool.imap(plan_one, _read_lines(args.input), chunksize=4):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            done += 1
+            if result.get("success"):
+                succeeded += 1
+            if "error" in result:
+                failed += 1
+            latencies.append(result["elapsed_ms"])
+
+            now = time.perf_counter()
+            if now - last_report >= args.progress_every:
+                last_report = now
+                rate = done / (now - started)
+                eta = f", осталось ~{(total - done) / rate:.0f} с" if total else ""
+                logger.info(f"Готово {done}{'/' + str(total) if total else ''}: {rate:.1f} маршр./с{eta}")
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "routes": done,
+        "success": succeeded,
+        "no_route": done - succeeded - failed,
+        "errors": failed,
+        "elapsed_s": round(elapsed, 1),
+        "routes_per_s": round(done / elapsed, 2) if elapsed else 0.0,
+    }
+    if latencies:
+        summary["p50_ms"] = round(float(np.percentile(latencies, 50)), 1)
+        summary["p95_ms"] = round(float(np.percentile(latencies, 95)), 1)
+    logger.info(f"Итог: {json.dumps(summary, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Микро-бенчмарки отбора кандидатов и построения маршрута. Работают офлайн:
+без БД, OSRM и LLM - на синтетических объектах и матрицах.
+
+    python benchmark.py                         # вывести таблицу результатов
+    python benchmark.py --quick                 # меньше размеров и повторов
+    python benchmark.py --save-baseline FILE    # сохранить результаты как эталон
+    python benchmark.py --check FILE            # сравнить с эталоном, код выхода 1 при регрессии
+    python benchmark.py --solver-pool 4         # масштабирование пула процессов решателя (1..4 процесса)
+
+Для каждого сценария: пропускная способность (оп/с), p50/p99 задержки и пик памяти (tracemalloc).
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from main import VISIT_TIME_MINUTES, _format_result, _to_route_pois, prepare_query_params
+from poi_index import PoiIndex
+from route_solver import SOLVERS, prepare_matrix, solve
+from solver_pool import SolverPool
+from travel_cache import TravelTimeCache, fill_block, matrix_from_cache
+
+CENTER_LAT, CENTER_LON = 56.3269, 44.0059  # Нижний Новгород
+CITY_SPREAD_DEG = 0.08
+
+QUERY_JSON = json.dumps({
+    "start_location": None,
+    "distance_km": None,
+    "duration_minutes": 120,
+    "travel_mode": "пеший",
+    "interests": "историческая достопримечательность, парки и природа",
+}, ensure_ascii=False)
+
+
+# --- Синтетические данные ---
+
+def synthetic_objects(n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    return [{
+        "id": i + 1,
+        "title": f"Объект {i + 1}",
+        "description": "",
+        "category_id": rng.randint(1, 6),
+        "address": f"Адрес {i + 1}",
+        "latitude": CENTER_LAT + rng.uniform(-CITY_SPREAD_DEG, CITY_SPREAD_DEG) / 2,
+        "longitude": CENTER_LON + rng.uniform(-CITY_SPREAD_DEG, CITY_SPREAD_DEG),
+        "distance_m": 0.0,
+    } for i in range(n)]
+
+
+def synthetic_matrix(n: int, seed: int = 0) -> List[List[float]]:
+    """Асимметричная матрица времени (сек) для n точек: расстояние по прямой с шумом."""
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0, 6000, size=(n, 2))
+    distance = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+    durations = distance / 8.3 * rng.uniform(1.1, 1.5, size=(n, n))  # ~30 км/ч с извилистостью
+    np.fill_diagonal(durations, 0.0)
+    return durations.tolist()
+
+
+# --- Измерения ---
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 2) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples_ms = np.array(samples) * 1000
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "ops_per_s": round(repeat / max(sum(samples), 1e-12), 1),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 4),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def bench_candidate_filtering(sizes: List[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for n in sizes:
+        objects = synthetic_objects(n)
+        index = PoiIndex(lambda: objects)
+        index.reload()
+        rng = random.Random(1)
+
+        def run():
+            lat = CENTER_LAT + rng.uniform(-0.02, 0.02)
+            lon = CENTER_LON + rng.uniform(-0.04, 0.04)
+            user_lon, user_lat, category_ids, max_distance_m = prepare_query_params(QUERY_JSON, lat, lon)
+            index.query(user_lat, user_lon, category_ids, max_distance_m, limit=20)
+
+        results[f"candidate_filter[n={n}]"] = measure(run, repeat)
+    return results
+
+
+def bench_index_build(sizes: List[int]) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for n in sizes:
+        objects = synthetic_objects(n)
+        results[f"index_build[n={n}]"] = measure(lambda: PoiIndex(lambda: objects).reload(), repeat=3, warmup=1)
+    return results
+
+
+def bench_matrix_assembly(sizes: List[int], repeat: int) -> Dict[str, Dict[str, float]]:
+    """Матрица из кэша POI-POI + строка/столбец старта "от OSRM" + перевод в NumPy."""
+    results = {}
+    for n in sizes:
+        raw = synthetic_matrix(n + 1)
+        ids = [None] + list(range(1, n + 1))
+        cache = TravelTimeCache(maxsize=(n + 1) ** 2)
+        cache.put_many("foot", {(i, j): raw[i][j] for i in range(1, n + 1) for j in range(1, n + 1) if i != j})
+        start_row = [raw[0]]
+        start_col = [[raw[i][0]] for i in range(n + 1)]
+
+        def run():
+            matrix, missing = matrix_from_cache(cache, "foot", ids)
+            fill_block(matrix, [0], None, start_row)
+            fill_block(matrix, None, [0], start_col)
+            prepare_matrix(matrix, coefficient=7.5)
+
+        results[f"matrix_assembly[n={n}]"] = measure(run, repeat)
+    return results
+
+
+def bench_solvers(sizes: List[int], repeat: int, ils_budget_ms: float) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    visit_time_s = VISIT_TIME_MINUTES * 60
+    max_time_s = 180 * 60
+    for n in sizes:
+        matrix = prepare_matrix(synthetic_matrix(n + 1), coefficient=7.5)
+        for name in SOLVERS:
+            route_holder = {}
+
+            def run():
+                route_holder["route"], route_holder["travel"] = solve(
+                    matrix, visit_time_s, max_time_s, solver=name, time_budget_s=ils_budget_ms / 1000)
+
+            stats = measure(run, repeat if name != "ils" else max(3, repeat // 10))
+            route = route_holder["route"]
+            total_min = (route_holder["travel"] + len(route) * visit_time_s) / 60
+            # Качество маршрута: число точек и точек в минуту
+            stats["visited_pois"] = len(route)
+            stats["pois_per_min"] = round(len(route) / total_min, 4) if total_min else 0.0
+            results[f"solve_{name}[n={n}]"] = stats
+    return results
+
+
+def bench_format_result(repeat: int) -> Dict[str, Dict[str, float]]:
+    pois = _to_route_pois(synthetic_objects(12))
+    return {"format_result": measure(lambda: _format_result(pois, 3600.0, VISIT_TIME_MINUTES * 60), repeat)}
+
+
+def bench_solver_pool(max_processes: int, jobs: int, n: int = 100) -> Dict[str, Dict[str, float]]:
+    """
+    Пропускная способность SolverPool (задач/с) при 1, 2, 4, ... max_processes процессах.
+    Решатель "insertion" - фиксированный объём работы на задачу, в отличие от ILS с бюджетом времени.
+    Зависит от числа ядер, поэтому в эталон не входит.
+    """
+    matrix = prepare_matrix(synthetic_matrix(n + 1), coefficient=7.5)
+    visit_time_s, max_time_s = VISIT_TIME_MINUTES * 60, 180 * 60
+    counts = sorted({1, max_processes} | {2 ** k for k in range(1, max_processes.bit_length()) if 2 ** k < max_processes})
+
+    async def run_jobs(pool: SolverPool) -> None:
+        await asyncio.gather(*[pool.solve(matrix, visit_time_s, max_time_s, solver="insertion", deadline_s=600)
+                               for _ in range(jobs)])
+
+    results: Dict[str, Dict[str, float]] = {}
+    single = None
+    for processes in counts:
+        pool = SolverPool(processes)
+        pool.start()
+        started = time.perf_counter()
+        asyncio.run(run_jobs(pool))
+        elapsed = time.perf_counter() - started
+        pool.close()
+        rate = jobs / elapsed
+        single = single or rate
+        results[f"solver_pool[processes={processes}]"] = {"jobs_per_s": round(rate, 1),
+                                                          "speedup": round(rate / single, 2)}
+    return results
+
+
+def run_all(quick: bool, ils_budget_ms: float) -> Dict[str, Dict[str, Any]]:
+    repeat = 50 if quick else 300
+    index_sizes = [20, 660, 10_000] if quick else [20, 660, 10_000, 100_000]
+    matrix_sizes = [20, 100] if quick else [20, 100, 300]
+
+    results: Dict[str, Dict[str, Any]] = {}
+    results.update(bench_candidate_filtering(index_sizes, repeat))
+    results.update(bench_index_build(index_sizes))
+    results.update(bench_matrix_assembly(matrix_sizes, max(5, repeat // 10)))
+    results.update(bench_solvers(matrix_sizes, max(5, repeat // 10), ils_budget_ms))
+    results.update(bench_format_result(repeat))
+    return results
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'сценарий':<34} {'оп/с':>10} {'p50, мс':>10} {'p99, мс':>10} {'пик, КБ':>10}  качество")
+    for name, stats in results.items():
+        quality = f"{stats['visited_pois']} точек, {stats['pois_per_min']} т/мин" if "visited_pois" in stats else ""
+        print(f"{name:<34} {stats['ops_per_s']:>10} {stats['p50_ms']:>10} {stats['p99_ms']:>10} "
+              f"{stats['peak_kb']:>10}  {quality}")
+
+
+def check_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                      tolerance: float, min_delta_ms: float) -> List[str]:
+    """
+    Сценарии, где p50 вырос больше чем на tolerance (и хотя бы на min_delta_ms - отсекаем шум)
+    или решатель стал посещать меньше точек. Время ILS задаётся бюджетом и не проверяется.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        slower = current["p50_ms"] - base["p50_ms"]
+        if (current["p50_ms"] > base["p50_ms"] * (1 + tolerance) and slower > min_delta_ms
+                and not name.startswith("solve_ils")):
+            regressions.append(f"{name}: p50 {base['p50_ms']} -> {current['p50_ms']} мс")
+        if "visited_pois" in base and current["visited_pois"] < base["visited_pois"]:
+            regressions.append(f"{name}: точек {base['visited_pois']} -> {current['visited_pois']}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Офлайн микро-бенчмарки маршрутизации")
+    parser.add_argument("--quick", action="store_true", help="Меньше размеров и повторов (для CI)")
+    parser.add_argument("--ils-budget-ms", type=float, default=20.0)
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--check", metavar="FILE", help="Эталон для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Допустимый рост p50 (доля)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05, help="Меньший рост p50 считается шумом")
+    parser.add_argument("--solver-pool", type=int, metavar="N",
+                        help="Только масштабирование пула процессов решателя до N процессов")
+    parser.add_argument("--pool-jobs", type=int, default=200, help="Задач на каждый размер пула")
+    args = parser.parse_args()
+
+    if args.solver_pool:
+        print(f"{'пул решателя':<34} {'задач/с':>10} {'ускорение':>10}")
+        for name, stats in bench_solver_pool(args.solver_pool, args.pool_jobs).items():
+            print(f"{name:<34} {stats['jobs_per_s']:>10} {stats['speedup']:>10}")
+        return
+
+    results = run_all(args.quick, args.ils_budget_ms)
+    print_table(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Эталон сохранён в {args.save_baseline}")
+
+    if args.check:
+        with open(args.check, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = check_regressions(results, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("Обнаружены регрессии:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("Регрессий нет.")
+
+
+if __name__ == "__main__":
+    main()
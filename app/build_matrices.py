@@ -0,0 +1,68 @@
+"""
+Офлайн-построение матриц времени POI-POI для всех профилей OSRM.
+
+Запуск (в контейнере приложения, БД должна быть доступна):
+    python build_matrices.py --out /app/matrices
+
+Затем указать MATRIX_STORE_DIR=/app/matrices - бот откроет матрицы через memory-map
+и будет запрашивать у OSRM только строку и столбец точки старта.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from main import OSRM_PROFILE_MAP, OSRM_URL, OSRMClient, fetch_all_objects, logger
+from matrix_store import save_matrices
+
+
+def build_profile_matrix(client: OSRMClient, profile: str, coordinates, chunk: int, pause_s: float) -> np.ndarray:
+    """Собирает матрицу NxN блоками chunk x chunk (ограничение OSRM на число точек в запросе)."""
+    n = len(coordinates)
+    matrix = np.full((n, n), np.nan, dtype=np.float32)
+    blocks = [(a, b) for a in range(0, n, chunk) for b in range(0, n, chunk)]
+    started = time.perf_counter()
+
+    for number, (a, b) in enumerate(blocks, start=1):
+        src = coordinates[a:a + chunk]
+        dst = coordinates[b:b + chunk]
+        sources = list(range(len(src)))
+        destinations = list(range(len(src), len(src) + len(dst)))
+        durations = client.fetch_table(src + dst, profile, sources, destinations)
+        if durations is None:
+            logger.error(f"[{profile}] блок {a}:{b} не получен, ячейки останутся пустыми (NaN)")
+        else:
+            block = np.array([[np.nan if v is None else v for v in row] for row in durations], dtype=np.float32)
+            matrix[a:a + len(src), b:b + len(dst)] = block
+        if number % 10 == 0 or number == len(blocks):
+            logger.info(f"[{profile}] блоков {number}/{len(blocks)}, {time.perf_counter() - started:.0f} с")
+        if pause_s:
+            time.sleep(pause_s)
+
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Предрасчёт матриц времени POI-POI для OSRM-профилей")
+    parser.add_argument("--out", required=True, help="Каталог для ids.npy и <profile>.npy")
+    parser.add_argument("--osrm-url", default=OSRM_URL)
+    parser.add_argument("--chunk", type=int, default=50, help="Размер блока (точек на источник/назначение)")
+    parser.add_argument("--pause", type=float, default=0.2, help="Пауза между запросами к OSRM, сек")
+    parser.add_argument("--profiles", nargs="*", default=sorted(set(OSRM_PROFILE_MAP.values())))
+    args = parser.parse_args()
+
+    objects = fetch_all_objects()
+    ids = [obj["id"] for obj in objects]
+    coordinates = [(obj["latitude"], obj["longitude"]) for obj in objects]
+    logger.info(f"Объектов: {len(objects)}, профили: {args.profiles}")
+
+    client = OSRMClient(base_url=args.osrm_url, timeout=60)
+    matrices = {profile: build_profile_matrix(client, profile, coordinates, args.chunk, args.pause)
+                for profile in args.profiles}
+    save_matrices(args.out, ids, matrices)
+    logger.info(f"Матрицы сохранены в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Пул соединений с PostgreSQL/PostGIS.
+
+Ограниченный пул (не больше maxconn соединений), проверка "здоровья"
+соединений перед выдачей, переподключение при обрывах и серверные
+подготовленные запросы (PREPARE/EXECUTE) на каждом соединении.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence
+
+import psycopg2
+import psycopg2.extras
+
+logger = logging.getLogger("AI_Travel")
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "last_used", "prepared")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.prepared = set()  # Имена запросов, уже подготовленных на этом соединении
+
+
+class DatabasePool:
+    def __init__(self, minconn: int = 1, maxconn: int = 10, acquire_timeout: float = 5.0,
+                 health_check_interval: float = 30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._connect_kwargs = connect_kwargs
+
+        self._idle: deque = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._statements: Dict[str, str] = {}
+
+        # Метрики для подбора размера пула
+        self._metrics = {
+            "acquired": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "health_check_failures": 0,
+            "in_use": 0,
+            "peak_in_use": 0,
+            "wait_time_total_s": 0.0,
+            "wait_time_max_s": 0.0,
+        }
+
+    # --- Управление соединениями ---
+
+    def _connect(self) -> _PooledConnection:
+        conn = psycopg2.connect(**self._connect_kwargs)
+        conn.autocommit = True
+        with self._lock:
+            self._metrics["connects"] += 1
+        return _PooledConnection(conn)
+
+    def warm_up(self) -> int:
+        """
+        Заранее открывает minconn соединений (параллельно) и сразу готовит на них
+        зарегистрированные запросы. Возвращает число открытых соединений.
+        """
+        def open_one() -> _PooledConnection:
+            pooled = self._connect()
+            for name, sql in self._statements.items():
+                try:
+                    with pooled.conn.cursor() as cursor:
+                        cursor.execute(sql)
+                    pooled.prepared.add(name)
+                except psycopg2.Error as e:
+                    logger.warning(f"Не удалось подготовить запрос {name} при прогреве пула: {e}")
+            return pooled
+
+        opened = []
+        with ThreadPoolExecutor(max_workers=max(1, self.minconn), thread_name_prefix="db-warmup") as executor:
+            futures = [executor.submit(open_one) for _ in range(self.minconn)]
+        for future in futures:
+            try:
+                opened.append(future.result())
+            except psycopg2.Error as e:
+                logger.error(f"Ошибка подключения к БД при прогреве пула: {e}")
+        with self._lock:
+            self._idle.extend(opened)
+        return len(opened)
+
+    def _is_healthy(self, pooled: _PooledConnection) -> bool:
+        if pooled.conn.closed:
+            return False
+        if time.monotonic() - pooled.last_used < self.health_check_interval:
+            return True
+        try:
+            with pooled.conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _discard(pooled: _PooledConnection) -> None:
+        try:
+            pooled.conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _checkout(self) -> _PooledConnection:
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._metrics["timeouts"] += 1
+            raise PoolTimeout(f"Пул соединений исчерпан ({self.maxconn}), ожидание > {self.acquire_timeout} с")
+        waited = time.monotonic() - started
+
+        try:
+            pooled = None
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    pooled = self._connect()
+                    break
+                if self._is_healthy(pooled):
+                    break
+                with self._lock:
+                    self._metrics["health_check_failures"] += 1
+                self._discard(pooled)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            m = self._metrics
+            m["acquired"] += 1
+            m["in_use"] += 1
+            m["peak_in_use"] = max(m["peak_in_use"], m["in_use"])
+            m["wait_time_total_s"] += waited
+            m["wait_time_max_s"] = max(m["wait_time_max_s"], waited)
+        return pooled
+
+    def _checkin(self, pooled: _PooledConnection, broken: bool = False) -> None:
+        if broken or pooled.conn.closed:
+            self._discard(pooled)
+        else:
+            pooled.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(pooled)
+        with self._lock:
+            self._metrics["in_use"] -= 1
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Выдаёт соединение из пула и возвращает его обратно после использования."""
+        pooled = self._checkout()
+        broken = False
+        try:
+            yield pooled.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(pooled, broken)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for pooled in idle:
+            self._discard(pooled)
+
+    # --- Подготовленные запросы ---
+
+    def register_statement(self, name: str, sql: str) -> None:
+        """
+        Регистрирует серверный подготовленный запрос.
+        sql - текст для PREPARE, например "PREPARE name (int[]) AS SELECT ... WHERE id = ANY($1)".
+        """
+        self._statements[name] = sql
+
+    def execute_prepared(self, name: str, params: Sequence[Any]) -> List[Dict[str, Any]]:
+        """
+        Выполняет EXECUTE для ранее зарегистрированного запроса и возвращает строки как словари.
+        При обрыве соединения один раз переподключается и повторяет запрос.
+        """
+        placeholders = ", ".join(["%s"] * len(params))
+        execute_sql = f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}"
+
+        for attempt in (1, 2):
+            pooled = self._checkout()
+            broken = False
+            try:
+                if name not in pooled.prepared:
+                    with pooled.conn.cursor() as cursor:
+                        cursor.execute(self._statements[name])
+                    pooled.prepared.add(name)
+                with pooled.conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                    cursor.execute(execute_sql, tuple(params))
+                    return [dict(row) for row in cursor.fetchall()]
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                broken = True
+                if attempt == 2:
+                    raise
+                logger.warning(f"Соединение с БД потеряно ({e}), переподключаемся")
+                with self._lock:
+                    self._metrics["reconnects"] += 1
+            finally:
+                self._checkin(pooled, broken)
+        return []
+
+    # --- Метрики ---
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = dict(self._metrics)
+            result["idle"] = len(self._idle)
+        result["maxconn"] = self.maxconn
+        result["wait_time_avg_s"] = result["wait_time_total_s"] / result["acquired"] if result["acquired"] else 0.0
+        return result
@@ -0,0 +1,179 @@
+"""
+Общий слой исходящих HTTP-запросов (OSRM, LLM).
+
+- create_http_client - долгоживущий httpx.AsyncClient с пулом keep-alive соединений и таймаутами;
+- retry_async        - повтор временных ошибок с экспоненциальной задержкой и случайным разбросом
+                       (full jitter), чтобы повторы разных запросов не приходили к сервису одновременно;
+- CircuitBreaker     - после серии ошибок перестаёт обращаться к сервису на reset_timeout_s
+                       и быстро отдаёт ошибку, затем пропускает один пробный запрос;
+- SingleFlight       - одинаковые одновременные запросы выполняются одним обращением к сервису;
+- pool_stats         - состояние пула соединений для метрик.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Type
+
+import httpx
+
+logger = logging.getLogger("AI_Travel")
+
+
+class CircuitOpenError(Exception):
+    """Сервис отключён предохранителем после серии ошибок."""
+
+
+def create_http_client(timeout_s: float, connect_timeout_s: float, max_connections: int,
+                       max_keepalive: int, keepalive_expiry_s: float) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout_s, connect=connect_timeout_s),
+        limits=httpx.Limits(max_connections=max_connections,
+                            max_keepalive_connections=max_keepalive,
+                            keepalive_expiry=keepalive_expiry_s),
+    )
+
+
+def pool_stats(client: Optional[httpx.AsyncClient]) -> Dict[str, int]:
+    """Открытые и свободные соединения пула (внутренности httpcore; при их изменении - пустой словарь)."""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {}
+    return {
+        "connections": len(connections),
+        "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+    }
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_progress = False
+        self.rejected = 0
+        self.opened_total = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout_s:
+            return "half_open"
+        return "open"
+
+    def check(self) -> None:
+        """Бросает CircuitOpenError, если запрос сейчас выполнять нельзя."""
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self.trial_in_progress:
+            # Пропускаем один пробный запрос; остальные ждут его результата
+            self.trial_in_progress = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name}: сервис временно отключён после {self.failures} ошибок подряд")
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"{self.name}: сервис снова доступен")
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def release_trial(self) -> None:
+        """Пробный запрос прерван (отмена) - результат не учитывается, следующий запрос станет пробным."""
+        self.trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_progress = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.opened_total += 1
+                logger.warning(f"{self.name}: {self.failures} ошибок подряд, запросы приостановлены "
+                               f"на {self.reset_timeout_s:.0f} с")
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "open": int(self.state != "closed"),
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+            "opened_total": self.opened_total,
+        }
+
+
+async def retry_async(call: Callable[[], Awaitable[Any]], attempts: int, base_delay_s: float,
+                      max_delay_s: float, retry_on: Tuple[Type[BaseException], ...],
+                      breaker: Optional[CircuitBreaker] = None, name: str = "") -> Any:
+    """
+    Выполняет call до attempts раз. Повторяются только исключения из retry_on;
+    задержка перед повтором k - случайная в [0, min(max_delay, base * 2^k)].
+    Каждая попытка учитывается предохранителем: исключения из retry_on - как ошибка сервиса,
+    прочие исключения (например, 4xx или ошибка разбора ответа) - как успешный ответ сервиса,
+    отмена не учитывается, но освобождает место пробного запроса.
+    """
+    for attempt in range(attempts):
+        if breaker is not None:
+            breaker.check()
+        recorded = False
+        try:
+            result = await call()
+        except retry_on as e:
+            if breaker is not None:
+                breaker.record_failure()
+                recorded = True
+            if attempt + 1 >= attempts:
+                raise
+            delay = random.uniform(0, min(max_delay_s, base_delay_s * 2 ** attempt))
+            logger.warning(f"{name}: попытка {attempt + 1}/{attempts} не удалась ({e!r}), повтор через {delay:.2f} с")
+            await asyncio.sleep(delay)
+        except Exception:
+            # Сервис ответил, но запрос не годится - повтор не поможет, а сервис доступен
+            if breaker is not None:
+                breaker.record_success()
+                recorded = True
+            raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+                recorded = True
+            return result
+        finally:
+            if breaker is not None and not recorded:
+                breaker.release_trial()
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом: выполняется первый, остальные ждут его результат."""
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield: отмена одного ожидающего не должна отменять общий запрос
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(call())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        self._in_flight.pop(key, None)
+        # Забираем исключение, чтобы asyncio не ругался, если все ожидающие были отменены
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._in_flight), "calls": self.calls, "coalesced": self.coalesced}
@@ -2,30 +2,69 @@
 CREATE EXTENSION IF NOT EXISTS postgis;
 
 -- ШАГ 1: Создание таблицы
+-- geog - хранимая копия geom в GEOGRAPHY: поиск по радиусу (ST_DWithin в метрах) идёт
+-- по её GIST-индексу. Приведение geom::geography прямо в запросе индекс на geom не использует.
 CREATE TABLE IF NOT EXISTS cultural_objects (
     id INTEGER PRIMARY KEY,
     address VARCHAR(255),
-    coordinate_text VARCHAR(255),
     description TEXT,
     title VARCHAR(255),
     category_id INTEGER,
     category_url VARCHAR(255),
-    geom GEOMETRY(Point, 4326)
+    geom GEOMETRY(Point, 4326),
+    geog GEOGRAPHY(Point, 4326) GENERATED ALWAYS AS (geom::geography) STORED
 );
 
--- ШАГ 2: Импорт данных из CSV
+-- Для баз, созданных прежней версией скрипта
+ALTER TABLE cultural_objects DROP COLUMN IF EXISTS coordinate_text;
+ALTER TABLE cultural_objects
+ADD COLUMN IF NOT EXISTS geog GEOGRAPHY(Point, 4326) GENERATED ALWAYS AS (geom::geography) STORED;
+
+-- ШАГ 2: Импорт данных из CSV во временную таблицу
 -- Путь теперь абсолютный внутри контейнера, куда мы его смонтировали
-\copy cultural_objects(id, address, coordinate_text, description, title, category_id, category_url) FROM '/data/cultural_objects_mnn.csv' DELIMITER ';' CSV HEADER QUOTE '"';
+CREATE TEMP TABLE cultural_objects_staging (
+    id INTEGER,
+    address VARCHAR(255),
+    coordinate_text VARCHAR(255),
+    description TEXT,
+    title VARCHAR(255),
+    category_id INTEGER,
+    category_url VARCHAR(255)
+);
+\copy cultural_objects_staging(id, address, coordinate_text, description, title, category_id, category_url) FROM '/data/cultural_objects_mnn.csv' DELIMITER ';' CSV HEADER QUOTE '"';
+
+-- ШАГ 3: Перенос с преобразованием координат одним INSERT ... SELECT (upsert по id).
+-- Повторные загрузки (python load_objects.py) меняют только изменившиеся строки.
+INSERT INTO cultural_objects (id, address, description, title, category_id, category_url, geom)
+SELECT id, address, description, title, category_id, category_url,
+       CASE WHEN coordinate_text IS NOT NULL THEN ST_GeomFromText(coordinate_text, 4326) END
+FROM cultural_objects_staging
+ON CONFLICT (id) DO UPDATE SET
+    address = EXCLUDED.address,
+    description = EXCLUDED.description,
+    title = EXCLUDED.title,
+    category_id = EXCLUDED.category_id,
+    category_url = EXCLUDED.category_url,
+    geom = EXCLUDED.geom
+WHERE (cultural_objects.address, cultural_objects.description, cultural_objects.title,
+       cultural_objects.category_id, cultural_objects.category_url, cultural_objects.geom)
+      IS DISTINCT FROM
+      (EXCLUDED.address, EXCLUDED.description, EXCLUDED.title,
+       EXCLUDED.category_id, EXCLUDED.category_url, EXCLUDED.geom);
 
--- ШАГ 3: Преобразование координат
-UPDATE cultural_objects
-SET geom = ST_GeomFromText(coordinate_text, 4326)
-WHERE coordinate_text IS NOT NULL;
+DROP TABLE cultural_objects_staging;
 
--- ШАГ 4: Создание пространственного индекса
-CREATE INDEX IF NOT EXISTS cultural_objects_geom_idx 
+-- ШАГ 4: Создание индексов
+-- geom - для запросов в координатах (ST_X/ST_Y, геометрические фильтры)
+CREATE INDEX IF NOT EXISTS cultural_objects_geom_idx
 ON cultural_objects USING GIST (geom);
 
--- ШАГ 5: Удаление временного столбца
-ALTER TABLE cultural_objects 
-DROP COLUMN coordinate_text;
\ No newline at end of file
+-- geog - для ST_DWithin/ST_Distance в метрах (find_suitable_objects)
+CREATE INDEX IF NOT EXISTS cultural_objects_geog_idx
+ON cultural_objects USING GIST (geog);
+
+-- category_id - фильтр по интересам; планировщик объединяет его с geog-индексом (BitmapAnd)
+CREATE INDEX IF NOT EXISTS cultural_objects_category_idx
+ON cultural_objects (category_id);
+
+ANALYZE cultural_objects;
@@ -0,0 +1,165 @@
+"""
+Пакетный разбор запросов через LLM (micro-batching).
+
+Под нагрузкой много разборов идут одновременно, и каждый отправляет в LLM весь длинный
+prompt с правилами и примерами. LLMBatcher собирает запросы, пришедшие в пределах окна
+window_s (несколько мс), и отправляет их одним обращением: общая часть prompt одна на пакет,
+а LLM отвечает JSON-массивом объектов с полем id. Результаты раздаются ожидающим.
+
+- Одиночный запрос в окне идёт обычным путём (call_single) - пакет из одного не нужен.
+- Элементы, которых нет в ответе или которые не прошли проверку (validate), а также все
+  элементы при ошибке пакетного запроса повторяются по одному через call_single.
+- Одинаковые запросы в одном окне разбираются один раз.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("AI_Travel")
+
+
+def parse_batch_output(text: str) -> Dict[int, Dict[str, Any]]:
+    """
+    Разбирает ответ LLM на пакет: JSON-массив объектов с полем id (допускается обёртка
+    Markdown или текст вокруг массива). Возвращает {id: объект без поля id}; при
+    невалидном ответе - пустой словарь.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    result: Dict[int, Dict[str, Any]] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            item_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        result.setdefault(item_id, {key: value for key, value in item.items() if key != "id"})
+    return result
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Если все ожидающие были отменены, исключение никто не заберёт - asyncio не должен об этом ругаться
+    if not future.cancelled():
+        future.exception()
+
+
+class LLMBatcher:
+    """
+    call_batch([(id, запрос), ...]) - текст ответа LLM на пакет; call_single(запрос) - текст
+    ответа на один запрос; validate(объект) - подходит ли разобранный элемент пакета.
+    """
+
+    def __init__(self, call_batch: Callable[[List[Tuple[int, str]]], Awaitable[str]],
+                 call_single: Callable[[str], Awaitable[str]], validate: Callable[[Any], bool],
+                 window_s: float = 0.005, max_batch: int = 16):
+        self._call_batch = call_batch
+        self._call_single = call_single
+        self._validate = validate
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+        self.items = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.single_requests = 0
+        self.retried_items = 0
+        self.batch_failures = 0
+
+    async def submit(self, query: str) -> str:
+        """Текст ответа LLM для запроса (JSON-объект параметров, как у одиночного разбора)."""
+        future = self._pending.get(query)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self.items += 1
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            future.add_done_callback(_consume_exception)
+            self._pending[query] = future
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window_s, self._flush)
+        # shield: отмена одного ожидающего не должна отменять разбор для остальных
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[str, asyncio.Future]) -> None:
+        queries = list(batch)
+        if len(queries) == 1:
+            await self._single(queries[0], batch[queries[0]])
+            return
+
+        self.batches += 1
+        self.batched_items += len(queries)
+        try:
+            parsed = parse_batch_output(await self._call_batch(list(enumerate(queries, 1))))
+        except Exception as e:
+            self.batch_failures += 1
+            logger.warning(f"Пакетный разбор {len(queries)} запросов не удался ({e!r}), разбираем по одному")
+            parsed = {}
+
+        retry = []
+        for item_id, query in enumerate(queries, 1):
+            item = parsed.get(item_id)
+            if item is not None and self._validate(item):
+                if not batch[query].done():
+                    batch[query].set_result(json.dumps(item, ensure_ascii=False))
+            else:
+                retry.append(query)
+        if retry:
+            self.retried_items += len(retry)
+            if parsed:
+                logger.info(f"Пакетный разбор: {len(retry)} из {len(queries)} элементов без валидного ответа, "
+                            f"разбираем по одному")
+            await asyncio.gather(*[self._single(query, batch[query]) for query in retry])
+
+    async def _single(self, query: str, future: asyncio.Future) -> None:
+        self.single_requests += 1
+        try:
+            result = await self._call_single(query)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, float]:
+        upstream = self.batches + self.single_requests
+        return {
+            "window_ms": self.window_s * 1000,
+            "pending": len(self._pending),
+            "items": self.items,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "mean_batch_size": round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+            "single_requests": self.single_requests,
+            "retried_items": self.retried_items,
+            "batch_failures": self.batch_failures,
+            "upstream_requests": upstream,
+            "requests_per_item": round(upstream / self.items, 3) if self.items else 0.0,
+        }
@@ -0,0 +1,181 @@
+"""
+Инкрементальная загрузка cultural_objects из CSV без пересоздания таблицы.
+
+CSV копируется (COPY) во временную таблицу, затем одним INSERT ... ON CONFLICT
+переносится в cultural_objects: новые объекты добавляются, изменившиеся обновляются,
+неизменные строки не трогаются (индексы и статистика не перестраиваются зря).
+
+    python load_objects.py --csv /app/data/cultural_objects_mnn.csv
+    python load_objects.py --csv ... --delete-missing   # удалить объекты, которых нет в CSV
+    python load_objects.py --check-plan                 # только проверить план find_suitable_objects
+
+После загрузки боту нужно перечитать объекты: kill -HUP <pid бота>.
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List, Set
+
+import psycopg2
+
+from main import (DB_HOST, DB_NAME, DB_PASSWORD, DB_USER, FIND_SUITABLE_OBJECTS_PARAM_TYPES,
+                  FIND_SUITABLE_OBJECTS_SQL, logger)
+
+# Схема и индексы (то же, что в init_bd.sql; идемпотентно - приводит старую базу к новой схеме)
+SCHEMA_SQL = """
+    CREATE EXTENSION IF NOT EXISTS postgis;
+    CREATE TABLE IF NOT EXISTS cultural_objects (
+        id INTEGER PRIMARY KEY,
+        address VARCHAR(255),
+        description TEXT,
+        title VARCHAR(255),
+        category_id INTEGER,
+        category_url VARCHAR(255),
+        geom GEOMETRY(Point, 4326),
+        geog GEOGRAPHY(Point, 4326) GENERATED ALWAYS AS (geom::geography) STORED
+    );
+    ALTER TABLE cultural_objects DROP COLUMN IF EXISTS coordinate_text;
+    ALTER TABLE cultural_objects
+    ADD COLUMN IF NOT EXISTS geog GEOGRAPHY(Point, 4326) GENERATED ALWAYS AS (geom::geography) STORED;
+    CREATE INDEX IF NOT EXISTS cultural_objects_geom_idx ON cultural_objects USING GIST (geom);
+    CREATE INDEX IF NOT EXISTS cultural_objects_geog_idx ON cultural_objects USING GIST (geog);
+    CREATE INDEX IF NOT EXISTS cultural_objects_category_idx ON cultural_objects (category_id);
+"""
+
+STAGING_SQL = """
+    CREATE TEMP TABLE cultural_objects_staging (
+        id INTEGER,
+        address VARCHAR(255),
+        coordinate_text VARCHAR(255),
+        description TEXT,
+        title VARCHAR(255),
+        category_id INTEGER,
+        category_url VARCHAR(255)
+    ) ON COMMIT DROP
+"""
+
+COPY_SQL = """
+    COPY cultural_objects_staging (id, address, coordinate_text, description, title, category_id, category_url)
+    FROM STDIN WITH (FORMAT csv, DELIMITER ';', HEADER true, QUOTE '"')
+"""
+
+# (xmax = 0) - строка вставлена, иначе обновлена; неизменные строки WHERE отсекает и не возвращает
+UPSERT_SQL = """
+    INSERT INTO cultural_objects (id, address, description, title, category_id, category_url, geom)
+    SELECT DISTINCT ON (id) id, address, description, title, category_id, category_url,
+           CASE WHEN coordinate_text IS NOT NULL THEN ST_GeomFromText(coordinate_text, 4326) END
+    FROM cultural_objects_staging
+    WHERE id IS NOT NULL
+    ORDER BY id
+    ON CONFLICT (id) DO UPDATE SET
+        address = EXCLUDED.address,
+        description = EXCLUDED.description,
+        title = EXCLUDED.title,
+        category_id = EXCLUDED.category_id,
+        category_url = EXCLUDED.category_url,
+        geom = EXCLUDED.geom
+    WHERE (cultural_objects.address, cultural_objects.description, cultural_objects.title,
+           cultural_objects.category_id, cultural_objects.category_url, cultural_objects.geom)
+          IS DISTINCT FROM
+          (EXCLUDED.address, EXCLUDED.description, EXCLUDED.title,
+           EXCLUDED.category_id, EXCLUDED.category_url, EXCLUDED.geom)
+    RETURNING (xmax = 0) AS inserted
+"""
+
+DELETE_MISSING_SQL = """
+    DELETE FROM cultural_objects o
+    WHERE NOT EXISTS (SELECT 1 FROM cultural_objects_staging s WHERE s.id = o.id)
+"""
+
+REQUIRED_INDEXES = {"cultural_objects_geog_idx"}
+CATEGORY_INDEX = "cultural_objects_category_idx"
+
+
+def load_csv(conn, csv_path: str, delete_missing: bool) -> Dict[str, int]:
+    """Загружает CSV в одной транзакции. Возвращает число добавленных, обновлённых и удалённых строк."""
+    with conn, conn.cursor() as cursor:
+        cursor.execute(SCHEMA_SQL)
+        cursor.execute(STAGING_SQL)
+        # utf-8-sig: в выгрузке есть BOM перед заголовком
+        with open(csv_path, encoding="utf-8-sig") as f:
+            cursor.copy_expert(COPY_SQL, f)
+        cursor.execute("SELECT count(*) FROM cultural_objects_staging")
+        staged = cursor.fetchone()[0]
+
+        cursor.execute(UPSERT_SQL)
+        flags = [row[0] for row in cursor.fetchall()]
+        deleted = 0
+        if delete_missing:
+            cursor.execute(DELETE_MISSING_SQL)
+            deleted = cursor.rowcount
+    with conn, conn.cursor() as cursor:
+        cursor.execute("ANALYZE cultural_objects")
+
+    inserted = sum(1 for flag in flags if flag)
+    return {"staged": staged, "inserted": inserted, "updated": len(flags) - inserted,
+            "unchanged": staged - len(flags), "deleted": deleted}
+
+
+def _plan_indexes(plan: Dict[str, Any]) -> Set[str]:
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= _plan_indexes(child)
+    return names
+
+
+def check_plan(conn) -> bool:
+    """
+    Проверяет, что find_suitable_objects идёт по индексу geog при настройках планировщика
+    по умолчанию и свежей статистике (ANALYZE перед EXPLAIN). Участие индекса по category_id
+    (BitmapAnd с geog) только сообщается: на маленькой выборке планировщику выгоднее
+    отфильтровать категории после поиска по geog.
+    """
+    params: List[Any] = [44.0059, 56.3269, [1, 2, 3, 4, 5, 6], 3000.0, 20]
+    with conn, conn.cursor() as cursor:
+        cursor.execute("ANALYZE cultural_objects")
+        cursor.execute(f"PREPARE check_find_suitable_objects ({FIND_SUITABLE_OBJECTS_PARAM_TYPES}) AS "
+                       f"{FIND_SUITABLE_OBJECTS_SQL}")
+        cursor.execute("EXPLAIN (FORMAT JSON) EXECUTE check_find_suitable_objects (%s, %s, %s, %s, %s)", params)
+        plan = cursor.fetchone()[0]
+        cursor.execute("DEALLOCATE check_find_suitable_objects")
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    used = _plan_indexes(plan[0]["Plan"])
+    missing = REQUIRED_INDEXES - used
+    if missing:
+        logger.error(f"План find_suitable_objects не использует индексы {sorted(missing)}; использованы: {sorted(used)}")
+        return False
+    logger.info(f"План find_suitable_objects использует индексы: {sorted(used)}")
+    if CATEGORY_INDEX in used:
+        logger.info(f"Индекс {CATEGORY_INDEX} участвует в плане вместе с geog")
+    else:
+        logger.info(f"Индекс {CATEGORY_INDEX} в плане не используется: категории фильтруются после поиска по geog")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Инкрементальная загрузка cultural_objects из CSV")
+    parser.add_argument("--csv", help="CSV-выгрузка объектов (формат как у /data/cultural_objects_mnn.csv)")
+    parser.add_argument("--delete-missing", action="store_true", help="Удалить объекты, которых нет в CSV")
+    parser.add_argument("--check-plan", action="store_true", help="Проверить, что запрос поиска использует индексы")
+    args = parser.parse_args()
+    if not args.csv and not args.check_plan:
+        parser.error("укажите --csv и/или --check-plan")
+
+    conn = psycopg2.connect(host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+    try:
+        if args.csv:
+            started = time.perf_counter()
+            stats = load_csv(conn, args.csv, args.delete_missing)
+            logger.info(f"Загрузка завершена за {time.perf_counter() - started:.1f} с: {stats}")
+            if stats["inserted"] or stats["updated"] or stats["deleted"]:
+                logger.info("Объекты изменились: перечитайте их в боте (kill -HUP <pid бота>)")
+        if args.check_plan and not check_plan(conn):
+            sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
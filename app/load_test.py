@@ -0,0 +1,589 @@
+"""
+Нагрузочный тест: воспроизведение записанных трасс (TRACE_RECORD_PATH, см. trace_recorder.py)
+через настоящие обработчики handle_text_query / handle_location - без Telegram, Yandex Cloud
+и публичного OSRM.
+
+Локальные заглушки - HTTP-серверы в потоках этого же процесса:
+- Telegram Bot API (getMe, sendMessage, editMessageText): бот отправляет ответы настоящими
+  запросами python-telegram-bot, заглушка возвращает отправленное сообщение;
+- LLM (Responses API): записанный разбор запроса, для незаписанных - локальный разбор
+  query_parser или запрос по умолчанию; понимает и пакетные запросы (LLM_BATCH_WINDOW_MS);
+- OSRM Table: записанные ответы, для остальных точек - оценка по расстоянию (время автомобиля
+  для всех профилей, как у публичного OSRM).
+У каждой заглушки настраиваются задержка, разброс задержки и доля ошибок (ответ 503).
+Объекты - из PostGIS по DB_* (локальная БД из docker-compose) или --synthetic-pois N случайных
+объектов вокруг точек трассы (без БД).
+
+    python load_test.py --trace trace.jsonl --rate 5 --sessions 200 --json before.json
+    python load_test.py --trace trace.jsonl --rate 5 --sessions 200 --compare before.json
+    python load_test.py --trace trace.jsonl --llm-latency-ms 800 --osrm-error-rate 0.05 --synthetic-pois 500
+
+Каждая сессия - текст запроса, пауза --think-ms и геолокация от нового пользователя (лимиты
+на пользователя не мешают воспроизведению). Сессии запускаются с частотой --rate в секунду
+(--rate 0 - с интервалами из трассы, ускоренными в --speed раз). Отчёт: пропускная способность,
+итоги запросов и p50/p95/p99 по этапам (обработчики Telegram, очередь, разбор, поиск объектов,
+OSRM, решатель, ответ, весь запрос).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from poi_index import haversine_m
+from query_parser import parse_query_locally
+from trace_recorder import round_coordinates
+
+# Запрос по умолчанию - для запросов, которых нет в трассе и которые не разобрать локально
+DEFAULT_PARAMS = {
+    "start_location": None,
+    "distance_km": None,
+    "duration_minutes": 90,
+    "travel_mode": "пеший",
+    "interests": "историческая достопримечательность",
+}
+# Заглушка OSRM без записанного ответа: ~30 км/ч с коэффициентом извилистости (как публичный OSRM - автомобиль)
+STUB_SPEED_M_S = 500 / 60
+STUB_DETOUR_FACTOR = 1.3
+BOT_TOKEN = "123456:LOAD-TEST"
+# Этапы отчёта в порядке обработки (поля RequestTrace и время обработчиков)
+STAGES = ("handle_text_query", "handle_location", "queue_wait", "llm_parse", "find_objects", "osrm_table",
+          "solver", "first_route", "reply", "total")
+
+_SINGLE_QUERY_RE = re.compile(r"<query>\n(.*?)\n\s*</query>", re.S)
+_BATCH_QUERY_RE = re.compile(r'<query id="(\d+)">\n(.*?)\n\s*</query>', re.S)
+
+
+# --- Трасса ---
+
+class Session:
+    __slots__ = ("t", "query", "lat", "lon")
+
+    def __init__(self, t: float, query: Optional[str], lat: Optional[float] = None, lon: Optional[float] = None):
+        self.t = t
+        self.query = query
+        self.lat = lat
+        self.lon = lon
+
+
+class Trace:
+    """Сессии пользователей (текст и геолокация), записанные разборы и ответы OSRM."""
+
+    def __init__(self):
+        self.sessions: List[Session] = []
+        self.parses: Dict[str, Dict[str, Any]] = {}
+        self.osrm: Dict[tuple, List[List[Optional[float]]]] = {}
+
+
+def osrm_key(profile: str, coordinates: List[List[float]], sources: Optional[List[int]],
+             destinations: Optional[List[int]]) -> tuple:
+    return (profile, tuple(map(tuple, coordinates)),
+            tuple(sources) if sources is not None else None,
+            tuple(destinations) if destinations is not None else None)
+
+
+def load_trace(path: str) -> Trace:
+    trace = Trace()
+    open_sessions: Dict[str, Session] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            kind = event.get("type")
+            if kind == "text":
+                # Новый текст без геолокации - сессия только с текстом
+                previous = open_sessions.pop(event["user"], None)
+                if previous is not None:
+                    trace.sessions.append(previous)
+                open_sessions[event["user"]] = Session(event["t"], event["query"])
+            elif kind == "location":
+                session = open_sessions.pop(event["user"], None) or Session(event["t"], None)
+                session.lat, session.lon = event["lat"], event["lon"]
+                trace.sessions.append(session)
+            elif kind == "parse":
+                trace.parses[event["query"]] = event["params"]
+            elif kind == "osrm":
+                key = osrm_key(event["profile"], event["coordinates"], event["sources"], event["destinations"])
+                trace.osrm[key] = event["durations"]
+    trace.sessions.extend(open_sessions.values())
+    trace.sessions.sort(key=lambda s: s.t)
+    return trace
+
+
+# --- Заглушки внешних сервисов ---
+
+class StubServer:
+    """
+    HTTP-заглушка в отдельном потоке. handler(method, path, body) -> (статус, JSON);
+    перед ответом - задержка latency_ms ± jitter_ms, с вероятностью error_rate - ответ 503.
+    """
+
+    def __init__(self, name: str, handler: Callable[[str, str, bytes], Tuple[int, Any]], latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.name = name
+        self.handler = handler
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.requests = 0
+        self.injected_errors = 0
+
+    def start(self) -> str:
+        """Запускает сервер на свободном порту и возвращает его адрес."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, как у настоящих сервисов: пулы соединений бота переиспользуют соединения
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub._serve(self, "GET")
+
+            def do_POST(self):
+                stub._serve(self, "POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"stub-{self.name}", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def _serve(self, request: BaseHTTPRequestHandler, method: str) -> None:
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+        with self._lock:
+            self.requests += 1
+            failed = self._rng.random() < self.error_rate
+            delay_ms = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms))
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        if failed:
+            with self._lock:
+                self.injected_errors += 1
+            status, payload = 503, {"ok": False, "error": "injected by load test"}
+        else:
+            try:
+                status, payload = self.handler(method, request.path, body)
+            except Exception as e:
+                status, payload = 500, {"ok": False, "error": repr(e)}
+
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json; charset=utf-8")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "injected_errors": self.injected_errors}
+
+
+def _request_params(body: bytes) -> Dict[str, Any]:
+    """Параметры запроса к Bot API: JSON или форма (значения-не строки python-telegram-bot кодирует в JSON)."""
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {key: values[-1] for key, values in urllib.parse.parse_qs(body.decode("utf-8")).items()}
+
+
+class TelegramStub:
+    """Bot API: getMe, sendMessage, editMessageText. Считает отправленные и отредактированные сообщения."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_message_id = 1
+        self.sent = 0
+        self.edited = 0
+
+    def __call__(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        api_method = path.rstrip("/").rsplit("/", 1)[-1]
+        if api_method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "LoadTest",
+                                                "username": "load_test_bot"}}
+        params = _request_params(body)
+        with self._lock:
+            if api_method == "sendMessage":
+                message_id = self._next_message_id
+                self._next_message_id += 1
+                self.sent += 1
+            elif api_method == "editMessageText":
+                message_id = int(params.get("message_id", 0))
+                self.edited += 1
+            else:
+                return 200, {"ok": True, "result": True}
+        return 200, {"ok": True, "result": {
+            "message_id": message_id, "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text": params.get("text", ""),
+        }}
+
+
+class LLMStub:
+    """Responses API: разбор из трассы, иначе локальный разбор или DEFAULT_PARAMS; одиночный и пакетный prompt."""
+
+    def __init__(self, parses: Dict[str, Dict[str, Any]]):
+        self.parses = parses
+        self.recorded = 0
+        self.fallbacks = 0
+
+    def _params(self, query: str) -> Dict[str, Any]:
+        params = self.parses.get(query)
+        if params is not None:
+            self.recorded += 1
+            return params
+        self.fallbacks += 1
+        return parse_query_locally(query) or DEFAULT_PARAMS
+
+    def __call__(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        prompt = json.loads(body).get("input", "")
+        batch = _BATCH_QUERY_RE.findall(prompt)
+        if batch:
+            text = json.dumps([{"id": int(item_id), **self._params(query.strip())} for item_id, query in batch],
+                              ensure_ascii=False)
+        else:
+            match = _SINGLE_QUERY_RE.search(prompt)
+            text = json.dumps(self._params(match.group(1).strip() if match else ""), ensure_ascii=False)
+        # Грубая оценка токенов (~4 символа на токен) - чтобы метрики токенов бота были не нулевыми
+        input_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+        return 200, {
+            "id": "resp_load_test", "object": "response", "created_at": int(time.time()),
+            "model": "load-test", "status": "completed", "parallel_tool_calls": False,
+            "tool_choice": "auto", "tools": [],
+            "output": [{"type": "message", "id": "msg_load_test", "status": "completed", "role": "assistant",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens,
+                      "input_tokens_details": {"cached_tokens": 0},
+                      "output_tokens_details": {"reasoning_tokens": 0}},
+        }
+
+
+class OSRMStub:
+    """Table API: записанный ответ (по округлённым координатам), иначе оценка по расстоянию."""
+
+    def __init__(self, responses: Dict[tuple, List[List[Optional[float]]]], precision: int):
+        self.responses = responses
+        self.precision = precision
+        self.recorded = 0
+        self.estimated = 0
+
+    def __call__(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        parsed = urllib.parse.urlsplit(path)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) != 4 or parts[0] != "table":
+            return 400, {"code": "InvalidUrl"}
+        profile = parts[2]
+        coordinates = [(float(lat), float(lon)) for lon, lat in
+                       (pair.split(",") for pair in urllib.parse.unquote(parts[3]).split(";"))]
+        query = urllib.parse.parse_qs(parsed.query)
+        sources = [int(i) for i in query["sources"][0].split(";")] if "sources" in query else None
+        destinations = [int(i) for i in query["destinations"][0].split(";")] if "destinations" in query else None
+
+        key = osrm_key(profile, round_coordinates(coordinates, self.precision), sources, destinations)
+        durations = self.responses.get(key)
+        if durations is not None:
+            self.recorded += 1
+            return 200, {"code": "Ok", "durations": durations}
+
+        self.estimated += 1
+        lats = np.array([lat for lat, _ in coordinates])
+        lons = np.array([lon for _, lon in coordinates])
+        rows = sources if sources is not None else range(len(coordinates))
+        columns = np.array(destinations if destinations is not None else range(len(coordinates)))
+        pace = STUB_DETOUR_FACTOR / STUB_SPEED_M_S
+        durations = [np.round(haversine_m(lats[i], lons[i], lats[columns], lons[columns]) * pace, 1).tolist()
+                     for i in rows]
+        return 200, {"code": "Ok", "durations": durations}
+
+
+def synthetic_pois(sessions: List[Session], count: int, spread_deg: float = 0.03,
+                   seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Случайные объекты вокруг точек трассы (категории 1-6), в формате строк fetch_all_objects."""
+    rng = random.Random(seed)
+    points = [(s.lat, s.lon) for s in sessions if s.lat is not None] or [(56.3269, 44.0059)]
+    rows = []
+    for i in range(count):
+        lat, lon = rng.choice(points)
+        rows.append({"id": i + 1, "title": f"Объект {i + 1}", "category_id": rng.randint(1, 6), "address": "",
+                     "latitude": lat + rng.uniform(-spread_deg, spread_deg),
+                     "longitude": lon + rng.uniform(-spread_deg, spread_deg)})
+    return rows
+
+
+# --- Воспроизведение ---
+
+class Collector:
+    """Замеры по этапам (мс) и итоги запросов; RequestTrace бота попадают сюда через TRACE_LISTENERS."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.results: Dict[str, int] = {}
+        self.users: set = set()
+        self.finished = 0
+        self.handler_errors = 0
+        self.done = asyncio.Event()
+        self.expected: Optional[int] = None
+
+    def observe(self, stage: str, ms: float) -> None:
+        self.samples.setdefault(stage, []).append(ms)
+
+    def on_trace(self, trace) -> None:
+        if trace.user_id not in self.users:
+            return
+        self.finished += 1
+        self.results[trace.result] = self.results.get(trace.result, 0) + 1
+        for stage, ms in trace.stages_ms.items():
+            self.observe(stage, ms)
+        for field, stage in (("queue_wait_ms", "queue_wait"), ("first_route_ms", "first_route")):
+            if field in trace.fields:
+                self.observe(stage, trace.fields[field])
+        self.observe("total", trace.total_ms)
+        if self.expected is not None and self.finished >= self.expected:
+            self.done.set()
+
+
+def make_update(bot, update_id: int, user_id: int, text: Optional[str] = None,
+                location: Optional[Tuple[float, float]] = None):
+    """Обновление Telegram, как его получил бы обработчик: ответы уходят через bot в заглушку Bot API."""
+    from telegram import Chat, Location, Message, Update, User
+
+    message = Message(
+        message_id=update_id, date=datetime.now(timezone.utc), chat=Chat(user_id, Chat.PRIVATE),
+        from_user=User(user_id, "load-test", is_bot=False), text=text,
+        location=Location(longitude=location[1], latitude=location[0]) if location else None)
+    message.set_bot(bot)
+    return Update(update_id, message=message)
+
+
+async def run_session(bot_module, bot, number: int, session: Session, think_s: float,
+                      collector: Collector) -> None:
+    user_id = 10_000_000 + number
+    collector.users.add(user_id)
+    try:
+        if session.query is not None:
+            started = time.perf_counter()
+            await bot_module.handle_text_query(make_update(bot, 2 * number, user_id, text=session.query), None)
+            collector.observe("handle_text_query", (time.perf_counter() - started) * 1000)
+            if session.lat is not None:
+                await asyncio.sleep(think_s)
+        if session.lat is not None:
+            update = make_update(bot, 2 * number + 1, user_id, location=(session.lat, session.lon))
+            started = time.perf_counter()
+            await bot_module.handle_location(update, None)
+            collector.observe("handle_location", (time.perf_counter() - started) * 1000)
+    except Exception as e:
+        collector.handler_errors += 1
+        bot_module.logger.warning(f"Нагрузочный тест: обработчик сессии {number} завершился ошибкой: {e!r}")
+
+
+def _intervals(sessions: List[Session], count: int, rate: float, speed: float, poisson: bool,
+               rng: random.Random) -> List[float]:
+    """Паузы перед запуском каждой сессии: 1/rate (или экспоненциальные) либо интервалы трассы / speed."""
+    if rate > 0:
+        return [rng.expovariate(rate) if poisson else 1 / rate for _ in range(count)]
+    gaps = [0.0] + [max(0.0, b.t - a.t) for a, b in zip(sessions, sessions[1:])]
+    return [gaps[i % len(gaps)] / speed for i in range(count)]
+
+
+async def replay(bot_module, trace: Trace, args, collector: Collector) -> float:
+    """Запускает сессии по расписанию и ждёт завершения маршрутов. Возвращает длительность (сек)."""
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    bot = Bot(BOT_TOKEN, base_url=f"{args.telegram_url}/bot",
+              request=HTTPXRequest(connection_pool_size=args.telegram_connections))
+    await bot.initialize()
+    rng = random.Random(args.seed)
+    intervals = _intervals(trace.sessions, args.sessions, args.rate, args.speed, args.poisson, rng)
+    collector.expected = sum(1 for i in range(args.sessions) if trace.sessions[i % len(trace.sessions)].lat is not None)
+
+    started = time.perf_counter()
+    tasks = []
+    for number, pause in enumerate(intervals):
+        await asyncio.sleep(pause)
+        session = trace.sessions[number % len(trace.sessions)]
+        tasks.append(asyncio.create_task(run_session(bot_module, bot, number, session, args.think_ms / 1000,
+                                                     collector)))
+    await asyncio.gather(*tasks)
+    if collector.finished < collector.expected:
+        try:
+            await asyncio.wait_for(collector.done.wait(), args.drain_s)
+        except asyncio.TimeoutError:
+            bot_module.logger.warning(f"Нагрузочный тест: за {args.drain_s:.0f} с не завершено "
+                                      f"{collector.expected - collector.finished} маршрутов")
+    elapsed = time.perf_counter() - started
+    await bot.shutdown()
+    return elapsed
+
+
+# --- Отчёт ---
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    array = np.asarray(values, dtype=np.float64)
+    p50, p95, p99 = np.percentile(array, [50, 95, 99])
+    return {"count": len(values), "p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1),
+            "p99_ms": round(float(p99), 1), "max_ms": round(float(array.max()), 1)}
+
+
+def build_report(collector: Collector, elapsed_s: float, stubs: Dict[str, Dict[str, Any]],
+                 args) -> Dict[str, Any]:
+    stages = {stage: percentiles(values) for stage, values in collector.samples.items() if values}
+    return {
+        "sessions": args.sessions,
+        "routes_finished": collector.finished,
+        "duration_s": round(elapsed_s, 2),
+        "throughput_per_s": round(collector.finished / elapsed_s, 2) if elapsed_s > 0 else 0.0,
+        "results": collector.results,
+        "handler_errors": collector.handler_errors,
+        "stages": stages,
+        "stubs": stubs,
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    print(f"Сессий: {report['sessions']}, маршрутов завершено: {report['routes_finished']} "
+          f"за {report['duration_s']} с - {report['throughput_per_s']} маршрутов/с")
+    if baseline is not None:
+        print(f"  до изменений: {baseline['throughput_per_s']} маршрутов/с")
+    print(f"Итоги: {report['results']}, ошибок обработчиков: {report['handler_errors']}")
+    print(f"Заглушки: {report['stubs']}")
+
+    header = f"{'этап':<18} {'n':>6} {'p50, мс':>10} {'p95, мс':>10} {'p99, мс':>10} {'max, мс':>10}"
+    print(header + ("  p95 до, мс   изменение" if baseline is not None else ""))
+    ordered = [s for s in STAGES if s in report["stages"]] + sorted(set(report["stages"]) - set(STAGES))
+    for stage in ordered:
+        stats = report["stages"][stage]
+        line = (f"{stage:<18} {stats['count']:>6} {stats['p50_ms']:>10} {stats['p95_ms']:>10} "
+                f"{stats['p99_ms']:>10} {stats['max_ms']:>10}")
+        before = (baseline or {}).get("stages", {}).get(stage)
+        if before and before.get("count"):
+            change = (f"{(stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100:+.1f}%"
+                      if before["p95_ms"] else "-")
+            line += f"  {before['p95_ms']:>10}   {change}"
+        print(line)
+
+
+# --- Запуск ---
+
+def configure_environment(args, urls: Dict[str, str]) -> None:
+    """Переменные окружения бота - до импорта main: адреса заглушек, без записи трасс и сервера метрик."""
+    os.environ["OSRM_URL"] = urls["osrm"]
+    os.environ["LLM_BASE_URL"] = f"{urls['llm']}/v1"
+    os.environ.setdefault("LLM_API_KEY", "load-test")
+    os.environ.setdefault("LLM_FOLDER_ID", "load-test")
+    os.environ["TRACE_RECORD_PATH"] = ""
+    os.environ.setdefault("METRICS_PORT", "0")
+    if args.synthetic_pois:
+        os.environ["POI_INDEX_ENABLED"] = "1"
+        os.environ["ROUTE_SHOW_DESCRIPTIONS"] = "0"
+        os.environ["DB_POOL_MIN"] = "0"
+
+
+async def run(args, trace: Trace) -> Dict[str, Any]:
+    telegram = TelegramStub()
+    llm = LLMStub(trace.parses)
+    osrm = OSRMStub(trace.osrm, args.precision)
+    servers = {
+        "telegram": StubServer("telegram", telegram, args.telegram_latency_ms, args.jitter_ms,
+                               args.telegram_error_rate, args.seed),
+        "llm": StubServer("llm", llm, args.llm_latency_ms, args.jitter_ms, args.llm_error_rate, args.seed),
+        "osrm": StubServer("osrm", osrm, args.osrm_latency_ms, args.jitter_ms, args.osrm_error_rate, args.seed),
+    }
+    urls = {name: server.start() for name, server in servers.items()}
+    args.telegram_url = urls["telegram"]
+    configure_environment(args, urls)
+
+    # main читает настройки из окружения при импорте, поэтому импортируется только здесь
+    import main as bot_module
+    from metrics import TRACE_LISTENERS
+
+    if args.synthetic_pois:
+        bot_module.POI_INDEX.reload(synthetic_pois(trace.sessions, args.synthetic_pois, seed=args.seed))
+    elif bot_module.POI_INDEX_ENABLED:
+        await asyncio.to_thread(bot_module.load_poi_data)
+    if bot_module.SOLVER_POOL is not None:
+        await asyncio.to_thread(bot_module.SOLVER_POOL.start)
+
+    collector = Collector()
+    TRACE_LISTENERS.append(collector.on_trace)
+    try:
+        elapsed = await replay(bot_module, trace, args, collector)
+    finally:
+        TRACE_LISTENERS.remove(collector.on_trace)
+        await bot_module.shutdown_services()
+        for server in servers.values():
+            server.stop()
+
+    stubs = {name: server.stats() for name, server in servers.items()}
+    stubs["telegram"].update(sent=telegram.sent, edited=telegram.edited)
+    stubs["llm"].update(recorded=llm.recorded, fallbacks=llm.fallbacks)
+    stubs["osrm"].update(recorded=osrm.recorded, estimated=osrm.estimated)
+    return build_report(collector, elapsed, stubs, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: воспроизведение трасс с заглушками сервисов")
+    parser.add_argument("--trace", required=True, help="JSONL-трасса (TRACE_RECORD_PATH)")
+    parser.add_argument("--sessions", type=int, help="Сколько сессий воспроизвести (по умолчанию - все из трассы, "
+                                                     "больше - трасса повторяется по кругу)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Сессий в секунду (0 - интервалы из трассы)")
+    parser.add_argument("--poisson", action="store_true", help="Случайные (экспоненциальные) интервалы при --rate")
+    parser.add_argument("--speed", type=float, default=1.0, help="Ускорение интервалов трассы при --rate 0")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="Пауза между текстом и геолокацией")
+    parser.add_argument("--drain-s", type=float, default=120.0, help="Сколько ждать незавершённые маршруты")
+    parser.add_argument("--precision", type=int, default=3, help="Округление координат в трассе (TraceRecorder)")
+    parser.add_argument("--synthetic-pois", type=int, default=0, metavar="N",
+                        help="N случайных объектов вокруг точек трассы вместо PostGIS")
+    for name, latency in (("telegram", 50.0), ("llm", 500.0), ("osrm", 100.0)):
+        parser.add_argument(f"--{name}-latency-ms", type=float, default=latency, help=f"Задержка заглушки {name}")
+        parser.add_argument(f"--{name}-error-rate", type=float, default=0.0, help=f"Доля ответов 503 от {name}")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Случайный разброс задержек заглушек (±)")
+    parser.add_argument("--telegram-connections", type=int, default=256, help="Пул соединений бота с Bot API")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", metavar="FILE", help="Сохранить отчёт в JSON (для сравнения до/после)")
+    parser.add_argument("--compare", metavar="FILE", help="Сравнить с сохранённым отчётом")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace)
+    if not trace.sessions:
+        raise SystemExit(f"В трассе {args.trace} нет сессий")
+    if args.sessions is None:
+        args.sessions = len(trace.sessions)
+    report = asyncio.run(run(args, trace))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт сохранён в {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
-import openai
+# Время импорта модулей (пишется в лог при старте)
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
+import asyncio
 # БД
 import psycopg2
 import psycopg2.extras  # Для получения результатов в виде словарей
@@ -8,16 +12,78 @@ import json
 # OSRM
 import math
 import logging
+import signal
+import threading
 import requests
-from typing import List, Dict, Any, Tuple, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import numpy as np
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple, Optional, Callable, Awaitable
 
 # Для маршрута яндекс карты
 import urllib.parse
+# Описания объектов в ответе (HTML -> текст)
+import html
+import re
+from contextlib import nullcontext
+
+# SDK LLM импортируется долго (сотни мс), поэтому он загружается в фоне при прогреве (import_llm_sdk),
+# а не при импорте модуля
+if TYPE_CHECKING:
+    import openai
 
 #бот
 from telegram import KeyboardButton, ReplyKeyboardMarkup
+from telegram.helpers import escape_markdown
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
+# Параллельная обработка обновлений с порядком внутри пользователя
+from update_processor import PerUserUpdateProcessor
+
+# In-memory индекс объектов
+from poi_index import PoiIndex
+# Компактные записи объектов и ленивая загрузка описаний
+from poi_record import DescriptionCache, PoiRecord, to_poi_records
+# Пул соединений с БД
+from db_pool import DatabasePool
+# Кэш времени в пути между объектами
+# Предрассчитанные матрицы POI-POI
+from matrix_store import MatrixStore
+# Хранилище сессий пользователей
+from session_store import create_session_store
+# Общий HTTP-слой: пулы соединений, повторы, предохранитель, объединение одинаковых запросов
+from http_clients import (CircuitBreaker, CircuitOpenError, SingleFlight, create_http_client, pool_stats,
+                          retry_async)
+# Метрики и замеры времени по этапам
+from metrics import HEALTH, REGISTRY, Counter, RequestTrace, start_metrics_server
+# Прогрев процесса перед приёмом обновлений
+import warmup
+# Кэш и локальный разбор текстовых запросов
+from query_parser import QueryParser, is_valid_params
+# Пакетный разбор одновременных запросов одним обращением к LLM
+from llm_batcher import LLMBatcher
+# Фоновый разбор запроса до прихода геолокации
+from speculative import SpeculativeTasks
+# Кэш готовых маршрутов для похожих запросов
+from route_cache import RouteResultCache, route_cache_key
+# Очередь построения маршрутов с лимитами на пользователя
+from route_scheduler import DUPLICATE, RATE_LIMITED, Admission, RouteScheduler
+# Решатели задачи ориентирования
+from route_solver import prepare_matrix, solve as solve_route, solve_greedy, tour_cost
+# Пул процессов для решателя (матрицы - через shared memory)
+from solver_pool import SolverError, SolverPool
+# Сообщение с маршрутом, которое редактируется по мере улучшения
+from progress_message import ProgressMessage
+from travel_cache import (TravelTimeCache, SqliteTravelTimeStore, matrix_from_cache, plan_table_requests,
+                          fill_block, store_matrix, table_query_string)
+# Разреженная матрица (k ближайших соседей) для больших наборов кандидатов
+from sparse_matrix import (TableRequest, collect_block, estimate_start_edges, known_edges, nearest_neighbours,
+                           plan_sparse_requests, sparse_pairs, sparse_to_matrix, store_edges)
+# Локальная оценка времени в пути, калибруемая по ответам OSRM
+from travel_model import HaversineTravelModel, TravelTimeModels, calibrate_from_matrix_store
+# Обезличенные трассы запросов для нагрузочного теста
+from trace_recorder import TraceRecorder
 
 # --- ОБЩЕЕ ЛОГИРОВАНИЕ (ОСТАВЛЯЕМ ТОЛЬКО ЭТО) ---
 logging.basicConfig(
@@ -26,7 +92,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger("AI_Travel")
 
-USER_QUERY_CACHE = {}# Кэш для хранения текстовых запросов пользователей по user_id
 VISIT_TIME_MINUTES = 15  # Время на посещение каждого объекта в минутах
 
 
@@ -35,12 +100,166 @@ TOKEN = os.environ.get("TG_BOT_TOKEN", "") #
 API_KEY = os.environ.get("LLM_API_KEY", "")
 FOLDER_ID = os.environ.get("LLM_FOLDER_ID", "") #
 YANDEX_CLOUD_MODEL = "yandexgpt-lite"
+# Адрес API LLM (переопределяется, например, заглушкой нагрузочного теста load_test.py)
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL", "https://rest-assistant.api.cloud.yandex.net/v1")
 
 DB_HOST = os.environ.get("DB_HOST", "localhost") #
 DB_NAME = os.environ.get("DB_NAME", "") # 
 DB_USER = os.environ.get("DB_USER", "") # 
 DB_PASSWORD = os.environ.get("DB_PASSWORD", "") #""
 
+# Кэш времени в пути POI-POI: размер (пар), TTL (сек) и файл SQLite (пусто - только в памяти)
+OSRM_CACHE_SIZE = int(os.environ.get("OSRM_CACHE_SIZE", "200000"))
+OSRM_CACHE_TTL = float(os.environ.get("OSRM_CACHE_TTL", str(7 * 24 * 3600)))
+OSRM_CACHE_PATH = os.environ.get("OSRM_CACHE_PATH", "")
+
+# Каталог с предрассчитанными матрицами POI-POI (build_matrices.py); пусто - не используются.
+# Если OSRM недоступен, время от старта оценивается по прямой с коэффициентом извилистости.
+MATRIX_STORE_DIR = os.environ.get("MATRIX_STORE_DIR", "")
+OSRM_OFFLINE_FALLBACK = os.environ.get("OSRM_OFFLINE_FALLBACK", "1") == "1"
+OFFLINE_DETOUR_FACTOR = 1.3
+
+# Кэш разобранных запросов: размер, TTL (сек) и локальный разбор без LLM ("1" - включён)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", str(24 * 3600)))
+LOCAL_QUERY_PARSER_ENABLED = os.environ.get("LOCAL_QUERY_PARSER_ENABLED", "1") == "1"
+
+# Пакетный разбор через LLM: сколько мс собирать одновременные запросы в один (0 - выключен)
+# и наибольший размер пакета
+LLM_BATCH_WINDOW_MS = float(os.environ.get("LLM_BATCH_WINDOW_MS", "0"))
+LLM_BATCH_MAX = int(os.environ.get("LLM_BATCH_MAX", "16"))
+
+# Разбор запроса в фоне сразу после получения текста ("1" - включён) и сколько хранить результат (сек)
+SPECULATIVE_PARSE_ENABLED = os.environ.get("SPECULATIVE_PARSE_ENABLED", "1") == "1"
+SPECULATIVE_PARSE_TTL = float(os.environ.get("SPECULATIVE_PARSE_TTL", "600"))
+
+# Решатель маршрута: "greedy", "insertion" или "ils"; бюджет времени ILS на запрос (мс);
+# учитывать ли дорогу обратно к точке старта в общем времени маршрута
+ROUTE_SOLVER = os.environ.get("ROUTE_SOLVER", "ils")
+SOLVER_TIME_BUDGET_MS = float(os.environ.get("SOLVER_TIME_BUDGET_MS", "50"))
+ROUTE_INCLUDE_RETURN = os.environ.get("ROUTE_INCLUDE_RETURN", "1") == "1"
+
+# Решатель в пуле процессов: число процессов (0 - решатель работает в потоке процесса бота)
+# и запас к бюджету решателя (мс), после которого задача снимается, а процесс перезапускается
+SOLVER_PROCESSES = int(os.environ.get("SOLVER_PROCESSES", "0"))
+SOLVER_DEADLINE_GRACE_MS = float(os.environ.get("SOLVER_DEADLINE_GRACE_MS", "1000"))
+
+# Anytime-режим: первый допустимый маршрут отправляется сразу, затем сообщение редактируется,
+# пока решатель находит лучшие маршруты в пределах ANYTIME_DEADLINE_MS (мс);
+# редактирование - не чаще раза в ANYTIME_EDIT_INTERVAL_S (сек)
+# Выключен по умолчанию: решатель с таким бюджетом занимает CPU бота, пока не перестанет улучшать маршрут
+ANYTIME_ROUTING = os.environ.get("ANYTIME_ROUTING", "0") == "1"
+ANYTIME_DEADLINE_MS = float(os.environ.get("ANYTIME_DEADLINE_MS", "1000"))
+ANYTIME_EDIT_INTERVAL_S = float(os.environ.get("ANYTIME_EDIT_INTERVAL_S", "1.5"))
+
+# Кэш готовых маршрутов: число маршрутов (0 - выключен), точность geohash ячейки старта
+# (7 - около 150 м) и ширина корзины длительности (мин)
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", "5000"))
+ROUTE_CACHE_PRECISION = int(os.environ.get("ROUTE_CACHE_PRECISION", "7"))
+ROUTE_CACHE_BUCKET_MIN = int(os.environ.get("ROUTE_CACHE_BUCKET_MIN", "15"))
+
+# Описания объектов (HTML из CSV) читаются из БД только для ответа: "1" - добавлять
+# в сообщение с маршрутом начало описания (до POI_DESCRIPTION_CHARS символов);
+# число описаний в LRU-кэше процесса
+ROUTE_SHOW_DESCRIPTIONS = os.environ.get("ROUTE_SHOW_DESCRIPTIONS", "0") == "1"
+POI_DESCRIPTION_CHARS = int(os.environ.get("POI_DESCRIPTION_CHARS", "160"))
+POI_DESCRIPTION_CACHE_SIZE = int(os.environ.get("POI_DESCRIPTION_CACHE_SIZE", "1000"))
+
+# Хранилище сессий (текстовый запрос ждёт геолокацию): "memory://" или "redis://host:6379/0",
+# время жизни сессии (сек) и максимум сессий в памяти процесса
+SESSION_STORE_URL = os.environ.get("SESSION_STORE_URL", "memory://")
+SESSION_TTL = float(os.environ.get("SESSION_TTL", "3600"))
+SESSION_MAX_SIZE = int(os.environ.get("SESSION_MAX_SIZE", "100000"))
+
+# HTTP-эндпоинт метрик Prometheus (/metrics); METRICS_PORT=0 - выключен
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+
+# Ограничения параллелизма для внешних сервисов (сколько запросов одновременно выполняется из бота)
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "8"))
+OSRM_CONCURRENCY = int(os.environ.get("OSRM_CONCURRENCY", "8"))
+DB_CONCURRENCY = int(os.environ.get("DB_CONCURRENCY", "8"))
+# Сколько обновлений Telegram обрабатывается одновременно и сколько может ждать в очереди
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "64"))
+UPDATE_MAX_PENDING = int(os.environ.get("UPDATE_MAX_PENDING", "1024"))
+
+# Планировщик построения маршрутов: сколько маршрутов строится одновременно, длина очереди,
+# лимит на пользователя (запросов в минуту и всплеск) и радиус (м), в котором повторная
+# геолокация того же пользователя считается повтором уже принятого запроса
+ROUTE_WORKERS = int(os.environ.get("ROUTE_WORKERS", "8"))
+ROUTE_QUEUE_SIZE = int(os.environ.get("ROUTE_QUEUE_SIZE", "100"))
+USER_RATE_PER_MIN = float(os.environ.get("USER_RATE_PER_MIN", "3"))
+USER_BURST = int(os.environ.get("USER_BURST", "3"))
+DUPLICATE_RADIUS_M = float(os.environ.get("DUPLICATE_RADIUS_M", "100"))
+
+# Прогрев при старте: сколько ждать шагов прогрева (сек), прежде чем начать принимать обновления без них;
+# открывать ли заранее соединения с OSRM и LLM; сколько свежих пар из SQLite-кэша времени в пути
+# загрузить в память (0 - не загружать)
+WARMUP_TIMEOUT_S = float(os.environ.get("WARMUP_TIMEOUT_S", "30"))
+WARMUP_HTTP = os.environ.get("WARMUP_HTTP", "1") == "1"
+TRAVEL_CACHE_PRELOAD = int(os.environ.get("TRAVEL_CACHE_PRELOAD", "50000"))
+
+# Запись обезличенных трасс для нагрузочного теста (load_test.py): файл JSONL (пусто - не писать)
+# и доля пользователей, попадающих в трассу
+TRACE_RECORD_PATH = os.environ.get("TRACE_RECORD_PATH", "")
+TRACE_RECORD_SAMPLE = float(os.environ.get("TRACE_RECORD_SAMPLE", "1"))
+
+# Способ получения обновлений: "polling" или "webhook" (нужен python-telegram-bot[webhooks]).
+# WEBHOOK_URL - публичный адрес, который Telegram будет вызывать (https://host/path);
+# локальный сервер слушает WEBHOOK_LISTEN:WEBHOOK_PORT/WEBHOOK_PATH, при заданных
+# WEBHOOK_CERT/WEBHOOK_KEY - по HTTPS, иначе по HTTP (TLS на обратном прокси)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_CERT = os.environ.get("WEBHOOK_CERT", "")
+WEBHOOK_KEY = os.environ.get("WEBHOOK_KEY", "")
+
+# Боту нужны только сообщения (текст, команды и геолокация)
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Исходящие HTTP-запросы (OSRM и LLM): долгоживущие клиенты с пулом keep-alive соединений.
+# Таймауты (сек), размер пула, время жизни простаивающего соединения (сек),
+# число попыток и базовая задержка повтора (сек), порог и пауза предохранителя (сек)
+OSRM_URL = os.environ.get("OSRM_URL", "http://router.project-osrm.org")
+OSRM_TIMEOUT = float(os.environ.get("OSRM_TIMEOUT", "10"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_RETRY_ATTEMPTS = int(os.environ.get("HTTP_RETRY_ATTEMPTS", "3"))
+HTTP_RETRY_BASE_DELAY = float(os.environ.get("HTTP_RETRY_BASE_DELAY", "0.2"))
+HTTP_RETRY_MAX_DELAY = 2.0
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.environ.get("BREAKER_RESET_S", "30"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Семафоры ограничивают число одновременных обращений к внешним сервисам
+LLM_SEMAPHORE = asyncio.Semaphore(LLM_CONCURRENCY)
+OSRM_SEMAPHORE = asyncio.Semaphore(OSRM_CONCURRENCY)
+DB_SEMAPHORE = asyncio.Semaphore(DB_CONCURRENCY)
+
+# In-memory индекс объектов: "1" - кандидаты ищутся в памяти, "0" - всегда запрос в PostGIS
+POI_INDEX_ENABLED = os.environ.get("POI_INDEX_ENABLED", "1") == "1"
+CANDIDATES_LIMIT = int(os.environ.get("CANDIDATES_LIMIT", "20"))  # Сколько ближайших объектов отдавать в построение маршрута
+
+# Разреженная матрица для больших наборов кандидатов: если кандидатов больше SPARSE_MATRIX_MIN_POINTS,
+# у OSRM запрашивается время только до SPARSE_MATRIX_K ближайших соседей каждого POI
+# (плюс строка и столбец старта), блоками не больше OSRM_TABLE_MAX_POINTS точек (max-table-size OSRM)
+SPARSE_MATRIX_K = int(os.environ.get("SPARSE_MATRIX_K", "10"))
+SPARSE_MATRIX_MIN_POINTS = int(os.environ.get("SPARSE_MATRIX_MIN_POINTS", "40"))
+OSRM_TABLE_MAX_POINTS = int(os.environ.get("OSRM_TABLE_MAX_POINTS", "100"))
+
+# Модель времени в пути по расстоянию (калибруется по ответам OSRM): "1" - отсеивать кандидатов,
+# недостижимых даже по оптимистичной оценке, до запроса к OSRM; сколько пар нужно для калибровки
+# (до этого - скорость из SPEED_MAPPINGS и OFFLINE_DETOUR_FACTOR) и размер окна калибровки (пар)
+TRAVEL_MODEL_PRUNE = os.environ.get("TRAVEL_MODEL_PRUNE", "1") == "1"
+TRAVEL_MODEL_MIN_SAMPLES = int(os.environ.get("TRAVEL_MODEL_MIN_SAMPLES", "100"))
+TRAVEL_MODEL_WINDOW = int(os.environ.get("TRAVEL_MODEL_WINDOW", "5000"))
+
 # TEST_START_LAT = 56.299251
 # TEST_START_LON = 43.985146
 
@@ -71,18 +290,114 @@ YANDEX_TRANSPORT_MAPPING = {
     "электросамокат": "scooter"
 }
 
+# Профили OSRM для способов передвижения
+OSRM_PROFILE_MAP = {
+    "пеший": "foot",
+    "велосипед": "bike",
+    "автомобиль": "driving",
+    "электросамокат": "bike"
+}
+
+# Модели времени в пути по профилям OSRM. Публичный OSRM считает время для автомобиля,
+# поэтому до калибровки все профили оцениваются со скоростью автомобиля и коэффициентом извилистости
+TRAVEL_MODELS = TravelTimeModels(lambda profile: HaversineTravelModel(
+    SPEED_MAPPINGS["автомобиль"] / 60, OFFLINE_DETOUR_FACTOR,
+    window=TRAVEL_MODEL_WINDOW, min_samples=TRAVEL_MODEL_MIN_SAMPLES))
+CANDIDATES_PRUNED = REGISTRY.register(Counter(
+    "ai_travel_candidates_pruned_total", "Кандидаты, отсеянные моделью времени в пути до запроса к OSRM",
+    ["profile"]))
+
+
+def _mode_coefficient(mode: str) -> float:
+    """Множитель времени OSRM (автомобиль) под скорость выбранного способа передвижения."""
+    return SPEED_MAPPINGS["автомобиль"] / SPEED_MAPPINGS.get(mode, SPEED_MAPPINGS["пеший"])
+
+
+def _start_estimates(coordinates: List[Tuple[float, float]], profile: str) -> np.ndarray:
+    """Оценка моделью времени от точки старта (индекс 0) до каждой точки."""
+    lats = np.array([lat for lat, _ in coordinates])
+    lons = np.array([lon for _, lon in coordinates])
+    return TRAVEL_MODELS.get(profile).estimate(lats[0], lons[0], lats, lons)
+
+
 # --- КЛИЕНТ ДЛЯ OSRM (ОБНОВЛЕН ДЛЯ ИСПОЛЬЗОВАНИЯ ПОЛНОЙ МАТРИЦЫ) ---
+def _estimate_missing_cells(matrix: List[List[Optional[float]]], coordinates: List[Tuple[float, float]],
+                            profile: str) -> Optional[List[List[Optional[float]]]]:
+    """
+    Запасной вариант, когда OSRM недоступен: если неизвестны только строка и столбец
+    точки старта (остальное есть в предрассчитанных матрицах), оцениваем их по
+    расстоянию по прямой моделью профиля (TRAVEL_MODELS).
+    """
+    n = len(matrix)
+    only_start_missing = all(matrix[i][j] is not None for i in range(1, n) for j in range(1, n))
+    if not OSRM_OFFLINE_FALLBACK or not only_start_missing:
+        return None
+
+    seconds = _start_estimates(coordinates, profile)
+    for j in range(1, n):
+        if matrix[0][j] is None:
+            matrix[0][j] = float(seconds[j])
+        if matrix[j][0] is None:
+            matrix[j][0] = float(seconds[j])
+    logger.warning("OSRM недоступен: время от точки старта оценено по расстоянию, остальное - из предрассчитанных матриц.")
+    return matrix
+
+
+def use_sparse_matrix(n_pois: int) -> bool:
+    return SPARSE_MATRIX_K > 0 and n_pois > SPARSE_MATRIX_MIN_POINTS
+
+
+def _plan_sparse_matrix(coordinates: List[Tuple[float, float]], profile: str, ids: Optional[List[Optional[int]]],
+                        k: int, cache: Optional[TravelTimeCache],
+                        matrix_store: Optional[MatrixStore]) -> Tuple[Dict[Tuple[int, int], float], List[TableRequest]]:
+    """Известные рёбра k-NN графа (кэш, предрассчитанные матрицы) и запросы к OSRM за остальными."""
+    pairs = sparse_pairs(nearest_neighbours(coordinates, k))
+    edges = known_edges(profile, ids, pairs, cache, matrix_store) if ids is not None else {}
+    missing = {pair for pair in pairs if pair not in edges}
+    logger.info(f"Разреженная матрица: {len(coordinates)} точек, k={k}, рёбер POI-POI {len(pairs)}, "
+                f"из кэша {len(edges)}")
+    # Группа из ~2k источников: их соседи в основном общие, лишних пар в ответе немного
+    return edges, plan_sparse_requests(coordinates, missing, OSRM_TABLE_MAX_POINTS, max_sources=2 * k)
+
+
+def _finish_sparse_matrix(edges: Dict[Tuple[int, int], float], coordinates: List[Tuple[float, float]],
+                          profile: str, failed: List[TableRequest]) -> Optional[np.ndarray]:
+    """
+    Без части рёбер POI-POI граф просто беднее, а без строки/столбца старта маршрут не построить:
+    их при недоступном OSRM оцениваем по расстоянию (как _estimate_missing_cells).
+    """
+    if any(not request.start_only for request in failed):
+        if not any(i and j for i, j in edges):
+            logger.error("OSRM недоступен, а рёбер между объектами нет ни в кэше, ни в предрассчитанных матрицах.")
+            return None
+        logger.warning(f"OSRM не вернул часть рёбер разреженной матрицы: {len(failed)} блоков")
+    if any(request.start_only for request in failed):
+        if not OSRM_OFFLINE_FALLBACK:
+            return None
+        estimate_start_edges(edges, _start_estimates(coordinates, profile))
+        logger.warning("OSRM недоступен: время от точки старта оценено по расстоянию.")
+    return sparse_to_matrix(len(coordinates), edges)
+
+
+
 class OSRMClient:
-    def __init__(self, base_url: str = "http://router.project-osrm.org", timeout: int = 10):
+    def __init__(self, base_url: str = OSRM_URL, timeout: float = OSRM_TIMEOUT,
+                 cache: Optional[TravelTimeCache] = None, matrix_store: Optional[MatrixStore] = None):
         self.base_url = base_url.rstrip("/")
         self.session = requests.Session()
+        # Пул keep-alive соединений и повтор временных ошибок с задержкой и случайным разбросом
+        adapter = HTTPAdapter(
+            pool_maxsize=HTTP_MAX_CONNECTIONS,
+            max_retries=Retry(total=HTTP_RETRY_ATTEMPTS - 1, backoff_factor=HTTP_RETRY_BASE_DELAY,
+                              backoff_max=HTTP_RETRY_MAX_DELAY, backoff_jitter=HTTP_RETRY_BASE_DELAY,
+                              status_forcelist=RETRY_STATUSES, allowed_methods=["GET"])
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.timeout = timeout
-        self.profile_map = {
-            "пеший": "foot",
-            "велосипед": "bike",
-            "автомобиль": "driving",
-            "электросамокат": "bike"
-        }
+        self.cache = cache
+        self.matrix_store = matrix_store
+        self.profile_map = OSRM_PROFILE_MAP
 
     def get_route_duration(self, start: Tuple[float, float], end: Tuple[float, float], mode: str) -> Optional[float]:
         """Оставлено для совместимости или отладки, но не используется в новом алгоритме TSP."""
@@ -107,20 +422,71 @@ class OSRMClient:
             logger.error(f"Ошибка при запросе к OSRM Route: {e}")
             return None
 
-    def get_full_travel_time_matrix(self, coordinates: List[Tuple[float, float]], mode: str) -> Optional[
-        List[List[Optional[float]]]]:
+    def get_full_travel_time_matrix(self, coordinates: List[Tuple[float, float]], mode: str,
+                                    ids: Optional[List[Optional[int]]] = None) -> Optional[List[List[Optional[float]]]]:
+        """
+        [ОПТИМИЗАЦИЯ] Возвращает полную матрицу времени поездки между всеми точками.
+        Координаты: (широта, долгота). ids - id объектов (None для точки старта): если они
+        переданы и у клиента есть кэш или предрассчитанные матрицы, у OSRM запрашиваются
+        только недостающие строки и столбцы. Если OSRM недоступен, а почти вся матрица
+        известна, недостающие ячейки оцениваются по расстоянию.
+        """
+        profile = self.profile_map.get(mode, "foot")
+        if (self.cache is None and self.matrix_store is None) or ids is None:
+            return self._fetch_table(coordinates, profile)
+
+        matrix, missing = matrix_from_cache(self.cache, profile, ids, self.matrix_store)
+        for sources, destinations in plan_table_requests(len(coordinates), missing):
+            durations = self._fetch_table(coordinates, profile, sources, destinations)
+            if durations is None:
+                return _estimate_missing_cells(matrix, coordinates, profile)
+            fill_block(matrix, sources, destinations, durations)
+        if self.cache is not None:
+            store_matrix(self.cache, profile, ids, matrix, missing)
+        return matrix
+
+    def get_sparse_travel_time_matrix(self, coordinates: List[Tuple[float, float]], mode: str,
+                                      ids: Optional[List[Optional[int]]] = None,
+                                      k: int = SPARSE_MATRIX_K) -> Optional[np.ndarray]:
         """
-        [ОПТИМИЗАЦИЯ] Запрашивает полную матрицу времени поездки между всеми точками (один запрос).
-        Координаты: (широта, долгота).
+        Разреженная матрица (NumPy, inf - нет ребра): время до k ближайших соседей каждого POI
+        и полные строка и столбец старта (индекс 0). Запросов к OSRM - O(N * k), а не O(N^2).
         """
         profile = self.profile_map.get(mode, "foot")
+        edges, table_requests = _plan_sparse_matrix(coordinates, profile, ids, k, self.cache, self.matrix_store)
+        failed: List[TableRequest] = []
+        fetched = set()
+        for request in table_requests:
+            durations = self._fetch_table([coordinates[p] for p in request.points], profile,
+                                          request.sources, request.destinations)
+            if durations is None:
+                failed.append(request)
+                continue
+            fetched.update(collect_block(edges, request, durations))
+        if self.cache is not None and ids is not None:
+            store_edges(self.cache, profile, ids, edges, fetched)
+        return _finish_sparse_matrix(edges, coordinates, profile, failed)
+
+    def fetch_table(self, coordinates: List[Tuple[float, float]], profile: str,
+                    sources: Optional[List[int]] = None,
+                    destinations: Optional[List[int]] = None) -> Optional[List[List[Optional[float]]]]:
+        """
+        Блок матрицы напрямую из OSRM, без кэша и предрассчитанных матриц (для офлайн-построения):
+        строки - точки sources, столбцы - destinations (индексы в coordinates); None - ошибка OSRM.
+        """
+        return self._fetch_table(coordinates, profile, sources, destinations)
+
+    def _fetch_table(self, coordinates: List[Tuple[float, float]], profile: str,
+                     sources: Optional[List[int]] = None,
+                     destinations: Optional[List[int]] = None) -> Optional[List[List[Optional[float]]]]:
+        """Один запрос к OSRM Table. Без sources/destinations OSRM возвращает полную матрицу."""
         # Координаты для OSRM (долгота, широта)
         coords_str = ";".join([f"{lon},{lat}" for lat, lon in coordinates])
+        url = f"{self.base_url}/table/v1/{profile}/{coords_str}{table_query_string(sources, destinations)}"
 
-        # Без параметров sources/destinations OSRM возвращает полную матрицу.
-        url = f"{self.base_url}/table/v1/{profile}/{coords_str}"
-
-        logger.info(f"OSRM Table запрос (ПОЛНАЯ МАТРИЦА): {profile} для {len(coordinates)} точек.")
+        logger.info(f"OSRM Table запрос: {profile} для {len(coordinates)} точек, "
+                    f"sources={len(sources) if sources is not None else 'все'}, "
+                    f"destinations={len(destinations) if destinations is not None else 'все'}.")
 
         try:
             response = self.session.get(url, timeout=self.timeout)
@@ -129,45 +495,410 @@ class OSRMClient:
 
             if data.get("durations"):
                 logger.info(
-                    f"OSRM Table ответ: получена полная матрица {len(data['durations'])}x{len(data['durations'][0])}")
+                    f"OSRM Table ответ: получена матрица {len(data['durations'])}x{len(data['durations'][0])}")
                 return data["durations"]
 
-            logger.warning("OSRM Table не вернул данных для полной матрицы.")
+            logger.warning("OSRM Table не вернул данных для матрицы.")
             return None
         except requests.RequestException as e:
-            logger.error(f"Ошибка при запросе полной матрицы к OSRM Table: {e}")
+            logger.error(f"Ошибка при запросе матрицы к OSRM Table: {e}")
             return None
 
 
+class AsyncOSRMClient:
+    """
+    Асинхронный вариант OSRMClient для обработчиков бота: не блокирует event loop.
+    Один клиент на процесс (get_osrm_client): соединения переиспользуются, одинаковые
+    одновременные запросы объединяются, временные ошибки повторяются, а после серии
+    ошибок предохранитель сразу отдаёт None (дальше - офлайн-оценка).
+    """
+
+    def __init__(self, base_url: str = OSRM_URL, timeout: float = OSRM_TIMEOUT,
+                 cache: Optional[TravelTimeCache] = None, matrix_store: Optional[MatrixStore] = None,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.base_url = base_url.rstrip("/")
+        self._owns_client = client is None
+        self.client = client or create_http_client(timeout, HTTP_CONNECT_TIMEOUT, HTTP_MAX_CONNECTIONS,
+                                                   HTTP_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY)
+        self.cache = cache
+        self.matrix_store = matrix_store
+        self.profile_map = OSRM_PROFILE_MAP
+        self.breaker = CircuitBreaker("OSRM", BREAKER_FAILURES, BREAKER_RESET_S)
+        self.single_flight = SingleFlight()
+
+    async def close(self) -> None:
+        if self._owns_client:
+            await self.client.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return {**pool_stats(self.client), **self.breaker.stats(), **self.single_flight.stats()}
+
+    async def get_full_travel_time_matrix(self, coordinates: List[Tuple[float, float]], mode: str,
+                                          ids: Optional[List[Optional[int]]] = None) -> Optional[
+        List[List[Optional[float]]]]:
+        """Полная матрица времени поездки между всеми точками (см. OSRMClient.get_full_travel_time_matrix)."""
+        profile = self.profile_map.get(mode, "foot")
+        if (self.cache is None and self.matrix_store is None) or ids is None:
+            return await self._fetch_table(coordinates, profile)
+
+        matrix, missing = matrix_from_cache(self.cache, profile, ids, self.matrix_store)
+        for sources, destinations in plan_table_requests(len(coordinates), missing):
+            durations = await self._fetch_table(coordinates, profile, sources, destinations)
+            if durations is None:
+                return _estimate_missing_cells(matrix, coordinates, profile)
+            fill_block(matrix, sources, destinations, durations)
+        if self.cache is not None:
+            store_matrix(self.cache, profile, ids, matrix, missing)
+        return matrix
+
+    async def get_sparse_travel_time_matrix(self, coordinates: List[Tuple[float, float]], mode: str,
+                                            ids: Optional[List[Optional[int]]] = None,
+                                            k: int = SPARSE_MATRIX_K) -> Optional[np.ndarray]:
+        """Разреженная матрица (см. OSRMClient.get_sparse_travel_time_matrix); блоки запрашиваются параллельно."""
+        profile = self.profile_map.get(mode, "foot")
+        edges, table_requests = _plan_sparse_matrix(coordinates, profile, ids, k, self.cache, self.matrix_store)
+        responses = await asyncio.gather(*[
+            self._fetch_table([coordinates[p] for p in request.points], profile, request.sources, request.destinations)
+            for request in table_requests])
+        failed: List[TableRequest] = []
+        fetched = set()
+        for request, durations in zip(table_requests, responses):
+            if durations is None:
+                failed.append(request)
+                continue
+            fetched.update(collect_block(edges, request, durations))
+        if self.cache is not None and ids is not None:
+            store_edges(self.cache, profile, ids, edges, fetched)
+        return _finish_sparse_matrix(edges, coordinates, profile, failed)
+
+    async def _fetch_table(self, coordinates: List[Tuple[float, float]], profile: str,
+                           sources: Optional[List[int]] = None,
+                           destinations: Optional[List[int]] = None) -> Optional[List[List[Optional[float]]]]:
+        coords_str = ";".join([f"{lon},{lat}" for lat, lon in coordinates])
+        url = f"{self.base_url}/table/v1/{profile}/{coords_str}{table_query_string(sources, destinations)}"
+
+        logger.info(f"OSRM Table запрос (async): {profile} для {len(coordinates)} точек, "
+                    f"sources={len(sources) if sources is not None else 'все'}, "
+                    f"destinations={len(destinations) if destinations is not None else 'все'}.")
+
+        try:
+            data = await self.single_flight.do(url, lambda: self._get_json(url))
+        except CircuitOpenError as e:
+            logger.warning(f"OSRM Table пропущен: {e}")
+            return None
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Ошибка при запросе матрицы к OSRM Table: {e}")
+            return None
+
+        if data.get("durations"):
+            logger.info(
+                f"OSRM Table ответ: получена матрица {len(data['durations'])}x{len(data['durations'][0])}")
+            if TRACE_RECORDER is not None:
+                TRACE_RECORDER.record_osrm(profile, coordinates, sources, destinations, data["durations"])
+            return data["durations"]
+
+        logger.warning("OSRM Table не вернул данных для матрицы.")
+        return None
+
+    async def _get_json(self, url: str) -> Dict[str, Any]:
+        """GET с повторами: повторяются сетевые ошибки и ответы RETRY_STATUSES, остальные 4xx - сразу ошибка."""
+        async def attempt() -> httpx.Response:
+            async with OSRM_SEMAPHORE:
+                response = await self.client.get(url)
+            if response.status_code in RETRY_STATUSES:
+                response.raise_for_status()
+            return response
+
+        response = await retry_async(attempt, HTTP_RETRY_ATTEMPTS, HTTP_RETRY_BASE_DELAY, HTTP_RETRY_MAX_DELAY,
+                                     retry_on=(httpx.TransportError, httpx.HTTPStatusError),
+                                     breaker=self.breaker, name="OSRM")
+        response.raise_for_status()
+        return response.json()
+
+
+# Общий для всех запросов кэш времени в пути
+TRAVEL_TIME_CACHE = TravelTimeCache(
+    maxsize=OSRM_CACHE_SIZE,
+    ttl_s=OSRM_CACHE_TTL,
+    store=SqliteTravelTimeStore(OSRM_CACHE_PATH, OSRM_CACHE_TTL) if OSRM_CACHE_PATH else None
+)
+
+
+# Сессии пользователей: запрос из handle_text_query до прихода геолокации в handle_location
+SESSION_STORE = create_session_store(SESSION_STORE_URL, ttl_s=SESSION_TTL, maxsize=SESSION_MAX_SIZE)
+
+# Предрассчитанные матрицы открываются через memory-map и общие для всех процессов
+POI_MATRIX_STORE = MatrixStore.open(MATRIX_STORE_DIR)
+
+TRACE_RECORDER = TraceRecorder(TRACE_RECORD_PATH, TRACE_RECORD_SAMPLE) if TRACE_RECORD_PATH else None
+
+# Фоновый разбор запросов: задачи живут в памяти процесса рядом с сессией
+SPECULATIVE_PARSES = SpeculativeTasks(ttl_s=SPECULATIVE_PARSE_TTL, maxsize=SESSION_MAX_SIZE)
+
+# Решатель маршрутов в отдельных процессах (None - в потоке процесса бота)
+SOLVER_POOL = SolverPool(SOLVER_PROCESSES, SOLVER_DEADLINE_GRACE_MS / 1000) if SOLVER_PROCESSES > 0 else None
+
+# Допуск запросов маршрута: пул исполнителей, очередь и лимиты на пользователя
+ROUTE_SCHEDULER = RouteScheduler(ROUTE_WORKERS, ROUTE_QUEUE_SIZE, USER_RATE_PER_MIN, USER_BURST, DUPLICATE_RADIUS_M)
+
+# Кэш разобранных запросов и локальный парсер перед обращением к LLM
+QUERY_PARSER = QueryParser(
+    maxsize=QUERY_CACHE_SIZE,
+    ttl_s=QUERY_CACHE_TTL,
+    local_parser_enabled=LOCAL_QUERY_PARSER_ENABLED
+)
+
+
 # --- ИНИЦИАЛИЗАЦИЯ КЛИЕНТА YANDEX CLOUD ---
+def import_llm_sdk():
+    """SDK LLM (импорт при первом вызове; дальше - готовый модуль из sys.modules)."""
+    import openai
+    return openai
+
+
 def create_yandex_client():
+    openai = import_llm_sdk()
     client = openai.OpenAI(
         api_key=API_KEY,
-        base_url="https://rest-assistant.api.cloud.yandex.net/v1",
+        base_url=LLM_BASE_URL,
         project=FOLDER_ID
     )
     return client
 
 
+def create_async_yandex_client(http_client: Optional[httpx.AsyncClient] = None):
+    # Повторы выполняет encode_query_async (вместе с предохранителем), поэтому у SDK они выключены
+    openai = import_llm_sdk()
+    return openai.AsyncOpenAI(
+        api_key=API_KEY,
+        base_url=LLM_BASE_URL,
+        project=FOLDER_ID,
+        http_client=http_client,
+        max_retries=0
+    )
+
+
+def llm_retry_errors() -> tuple:
+    """Временные ошибки LLM, которые имеет смысл повторить (APITimeoutError - подкласс APIConnectionError)."""
+    openai = import_llm_sdk()
+    return openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError
+
+
+LLM_BREAKER = CircuitBreaker("LLM", BREAKER_FAILURES, BREAKER_RESET_S)
+LLM_SINGLE_FLIGHT = SingleFlight()
+# Токены LLM по видам обращений: tokens / запросы, разобранные через LLM - стоимость разбора
+LLM_TOKENS = REGISTRY.register(Counter(
+    "ai_travel_llm_tokens_total", "Токены LLM на разбор запросов", ["kind", "mode"]))
+
+
+def _record_llm_usage(response, mode: str) -> None:
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(getattr(usage, "input_tokens", 0) or 0, kind="input", mode=mode)
+        LLM_TOKENS.inc(getattr(usage, "output_tokens", 0) or 0, kind="output", mode=mode)
+
+# Долгоживущие клиенты внешних сервисов. Создаются при первом запросе, то есть уже внутри
+# event loop бота, и закрываются при остановке приложения (close_http_clients)
+_LLM_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+_LLM_CLIENT: Optional["openai.AsyncOpenAI"] = None
+_OSRM_CLIENT: Optional[AsyncOSRMClient] = None
+
+
+def get_llm_client() -> "openai.AsyncOpenAI":
+    global _LLM_HTTP_CLIENT, _LLM_CLIENT
+    if _LLM_CLIENT is None:
+        _LLM_HTTP_CLIENT = create_http_client(LLM_TIMEOUT, HTTP_CONNECT_TIMEOUT, HTTP_MAX_CONNECTIONS,
+                                              HTTP_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY)
+        _LLM_CLIENT = create_async_yandex_client(_LLM_HTTP_CLIENT)
+    return _LLM_CLIENT
+
+
+def get_osrm_client() -> AsyncOSRMClient:
+    global _OSRM_CLIENT
+    if _OSRM_CLIENT is None:
+        _OSRM_CLIENT = AsyncOSRMClient(cache=TRAVEL_TIME_CACHE, matrix_store=POI_MATRIX_STORE)
+    return _OSRM_CLIENT
+
+
+async def close_http_clients(application=None) -> None:
+    global _LLM_HTTP_CLIENT, _LLM_CLIENT, _OSRM_CLIENT
+    if _LLM_CLIENT is not None:
+        await _LLM_CLIENT.close()
+        await _LLM_HTTP_CLIENT.aclose()
+    if _OSRM_CLIENT is not None:
+        await _OSRM_CLIENT.close()
+    _LLM_HTTP_CLIENT = _LLM_CLIENT = _OSRM_CLIENT = None
+
+
+async def shutdown_services(application=None) -> None:
+    """Остановка бота: сначала исполнители маршрутов, затем HTTP-клиенты, хранилище сессий и процессы решателя."""
+    await ROUTE_SCHEDULER.close()
+    await close_http_clients(application)
+    await SESSION_STORE.close()
+    if SOLVER_POOL is not None:
+        await asyncio.to_thread(SOLVER_POOL.close)
+    if TRACE_RECORDER is not None:
+        TRACE_RECORDER.close()
+
+
+# --- ПРОГРЕВ ПРИ СТАРТЕ ---
+# Фоновые шаги прогрева (запускаются в main, их дожидается warm_up_services)
+_WARMUP_FUTURES: Dict[str, Any] = {}
+
+
+def warm_up_db_pool() -> int:
+    opened = DB_POOL.warm_up()
+    if DB_POOL.minconn and not opened:
+        raise RuntimeError("не удалось открыть ни одного соединения с БД")
+    return opened
+
+
+def load_poi_data() -> int:
+    """POI-индекс и начальная калибровка модели времени в пути по предрассчитанным матрицам."""
+    if not POI_INDEX.reload():
+        raise RuntimeError("POI-индекс не загружен, объекты будут искаться в PostGIS")
+    if POI_MATRIX_STORE is not None:
+        observed = calibrate_from_matrix_store(TRAVEL_MODELS, POI_MATRIX_STORE, POI_INDEX.records())
+        logger.info(f"Модель времени в пути откалибрована по предрассчитанным матрицам: {observed}")
+    return len(POI_INDEX)
+
+
+def preload_travel_times() -> int:
+    """Свежие пары из SQLite-кэша - в память, страницы предрассчитанных матриц - в page cache."""
+    loaded = TRAVEL_TIME_CACHE.preload(TRAVEL_CACHE_PRELOAD) if TRAVEL_CACHE_PRELOAD > 0 else 0
+    if POI_MATRIX_STORE is not None:
+        POI_MATRIX_STORE.prefault()
+    logger.info(f"Кэш времени в пути: загружено {loaded} пар")
+    return loaded
+
+
+async def _open_connection(client: httpx.AsyncClient, url: str) -> None:
+    """Один запрос, чтобы в пуле осталось открытое соединение (TCP + TLS); код ответа не важен."""
+    await client.get(url)
+
+
+async def warm_up_osrm_http() -> None:
+    osrm_client = get_osrm_client()
+    await _open_connection(osrm_client.client, osrm_client.base_url)
+
+
+async def warm_up_llm_http() -> None:
+    # SDK мог ещё импортироваться в фоне - ждём его в потоке, не блокируя event loop
+    await asyncio.to_thread(import_llm_sdk)
+    get_llm_client()
+    await _open_connection(_LLM_HTTP_CLIENT, LLM_BASE_URL)
+
+
+async def warm_up_services(application=None) -> None:
+    """
+    post_init бота (до приёма обновлений): соединения с OSRM и LLM открываются в event loop,
+    параллельно с ещё идущими фоновыми шагами; после них процесс помечается готовым (/readyz).
+    """
+    if WARMUP_HTTP:
+        await warmup.run_async({"osrm_http": warm_up_osrm_http, "llm_http": warm_up_llm_http}, WARMUP_TIMEOUT_S)
+    await warmup.finish(_WARMUP_FUTURES, WARMUP_TIMEOUT_S, import_ms=IMPORT_MS)
+
+
+def llm_http_stats() -> Dict[str, int]:
+    return {**pool_stats(_LLM_HTTP_CLIENT), **LLM_BREAKER.stats(), **LLM_SINGLE_FLIGHT.stats()}
+
+
+def osrm_http_stats() -> Dict[str, int]:
+    return _OSRM_CLIENT.stats() if _OSRM_CLIENT is not None else {}
+
+
 # --- СОЕДИНЕНИЕ С БД ---
-def get_db_connection():
-    """Устанавливает соединение с базой данных."""
-    try:
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
+# Пул соединений: соединения переиспользуются между запросами вместо psycopg2.connect на каждый маршрут
+DB_POOL = DatabasePool(
+    minconn=int(os.environ.get("DB_POOL_MIN", "1")),
+    maxconn=int(os.environ.get("DB_POOL_MAX", "10")),
+    acquire_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "5")),
+    host=DB_HOST,
+    database=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD
+)
+
+# Подготовленный запрос поиска объектов. Категории передаются массивом,
+# поэтому план запроса не зависит от их набора и не перестраивается.
+# Фильтр идёт по хранимому столбцу geog (GEOGRAPHY): ST_DWithin использует его GIST-индекс,
+# а приведение geom::geography в WHERE сделало бы индекс бесполезным (см. init_bd.sql).
+FIND_SUITABLE_OBJECTS_PARAM_TYPES = "float8, float8, int[], float8, int"
+FIND_SUITABLE_OBJECTS_SQL = """
+    SELECT
+        id, title, category_id, address,
+        ST_X(geom) AS longitude,
+        ST_Y(geom) AS latitude,
+        -- ST_Distance: точное расстояние от точки старта до объекта (в метрах)
+        ST_Distance(
+            geog,
+            ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography
+        ) AS distance_m
+    FROM
+        cultural_objects
+    WHERE
+        -- Фильтрация по интересам (индекс cultural_objects_category_idx)
+        category_id = ANY($3)
+        AND
+        -- ST_DWithin: гео-фильтрация в пределах max_distance_m (индекс cultural_objects_geog_idx)
+        ST_DWithin(
+            geog,
+            ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography,
+            $4
         )
-        return conn
-    except psycopg2.Error as e:
-        print(f"Ошибка подключения к БД: {e}")
-        return None
+    ORDER BY
+        distance_m ASC
+    LIMIT $5
+"""
+DB_POOL.register_statement(
+    "find_suitable_objects",
+    f"PREPARE find_suitable_objects ({FIND_SUITABLE_OBJECTS_PARAM_TYPES}) AS {FIND_SUITABLE_OBJECTS_SQL}"
+)
 
 
-# Функция для создания prompt для LLM
-def create_prompt(query):
-    prompt_template = """
+def fetch_all_objects() -> List[Dict[str, Any]]:
+    """Загружает все объекты из cultural_objects (для in-memory индекса), без описаний."""
+    with DB_POOL.connection() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute("""
+                SELECT id, title, category_id, address,
+                       ST_X(geom) AS longitude,
+                       ST_Y(geom) AS latitude
+                FROM cultural_objects
+                WHERE geom IS NOT NULL
+            """)
+            return [dict(row) for row in cursor.fetchall()]
+
+
+def fetch_descriptions(ids: List[int]) -> Dict[int, str]:
+    """Описания объектов по id (одним запросом)."""
+    with DB_POOL.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id, description FROM cultural_objects WHERE id = ANY(%s)", (list(ids),))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+POI_INDEX = PoiIndex(fetch_all_objects)
+POI_DESCRIPTIONS = DescriptionCache(fetch_descriptions, POI_DESCRIPTION_CACHE_SIZE)
+POI_INDEX.on_reload(POI_DESCRIPTIONS.clear)
+
+# Готовые маршруты зависят от набора объектов, поэтому сбрасываются при перезагрузке индекса
+# (без индекса - по SIGHUP, см. clear_object_caches)
+ROUTE_CACHE = RouteResultCache(ROUTE_CACHE_SIZE, OFFLINE_DETOUR_FACTOR) if ROUTE_CACHE_SIZE > 0 else None
+if ROUTE_CACHE is not None:
+    POI_INDEX.on_reload(ROUTE_CACHE.clear)
+
+
+def clear_object_caches() -> None:
+    """Сбрасывает кэши, зависящие от cultural_objects, когда in-memory индекс выключен и не перезагружается."""
+    POI_DESCRIPTIONS.clear()
+    if ROUTE_CACHE is not None:
+        ROUTE_CACHE.clear()
+    logger.info("Кэши готовых маршрутов и описаний объектов сброшены после обновления объектов")
+
+
+# Общая часть prompt для LLM: роль, структура JSON, правила и примеры
+PROMPT_INSTRUCTIONS = """
         Твоя роль — AI-аналитик, который преобразует неструктурированные запросы пользователей в структурированные данные в формате JSON.
 
         ## ЗАДАЧА
@@ -212,7 +943,12 @@ def create_prompt(query):
             "travel_mode": "велосипед",
             "interests": "историческая достопримечательность"
         }}
+"""
+
 
+# Функция для создания prompt для LLM
+def create_prompt(query):
+    prompt_template = PROMPT_INSTRUCTIONS + """
         ## ЗАПРОС ПОЛЬЗОВАТЕЛЯ
         <query>
         {query}
@@ -221,6 +957,21 @@ def create_prompt(query):
     return prompt_template.format(query=query)
 
 
+def create_batch_prompt(items: List[Tuple[int, str]]) -> str:
+    """Prompt для нескольких запросов сразу: общая часть одна, ответ - JSON-массив объектов с полем id."""
+    queries = "\n".join(f'        <query id="{item_id}">\n        {query}\n        </query>' for item_id, query in items)
+    return PROMPT_INSTRUCTIONS.format() + """
+        ## НЕСКОЛЬКО ЗАПРОСОВ
+        Ниже несколько независимых запросов разных пользователей, у каждого свой id.
+        Разбери каждый запрос отдельно по тем же правилам, но вместо одного объекта ответь
+        только валидным JSON-массивом: по одному объекту на каждый запрос, с полем "id"
+        (число из запроса) и всеми полями структуры. Например:
+        [{"id": 1, "start_location": null, "distance_km": null, "duration_minutes": 60, "travel_mode": "пеший", "interests": "парки и природа"}]
+
+        ## ЗАПРОСЫ ПОЛЬЗОВАТЕЛЕЙ
+""" + queries + "\n        "
+
+
 # Функция для формирования json-ответа от LLM
 # to use response.output[0].content[0].text
 def encode_query(client, query):
@@ -235,6 +986,116 @@ def encode_query(client, query):
     return response  # to use response.output[0].content[0].text
 
 
+async def encode_query_async(client, query):
+    """
+    Асинхронный вариант encode_query для AsyncOpenAI-клиента. Одинаковые одновременные
+    запросы выполняются одним обращением к LLM; временные ошибки повторяются,
+    после серии ошибок предохранитель сразу бросает CircuitOpenError.
+    """
+    prompt = create_prompt(query)
+
+    async def request():
+        async with LLM_SEMAPHORE:
+            response = await client.responses.create(
+                model=f"gpt://{FOLDER_ID}/{YANDEX_CLOUD_MODEL}",
+                input=prompt,
+                temperature=0.2,
+                max_output_tokens=1500
+            )
+        _record_llm_usage(response, "single")
+        return response
+
+    response = await LLM_SINGLE_FLIGHT.do(prompt, lambda: retry_async(
+        request, HTTP_RETRY_ATTEMPTS, HTTP_RETRY_BASE_DELAY, HTTP_RETRY_MAX_DELAY,
+        retry_on=llm_retry_errors(), breaker=LLM_BREAKER, name="LLM"))
+    return response  # to use response.output[0].content[0].text
+
+
+async def encode_batch_async(client, items: List[Tuple[int, str]]):
+    """Один запрос к LLM на пакет запросов (create_batch_prompt) с теми же повторами и предохранителем."""
+    prompt = create_batch_prompt(items)
+
+    async def request():
+        async with LLM_SEMAPHORE:
+            response = await client.responses.create(
+                model=f"gpt://{FOLDER_ID}/{YANDEX_CLOUD_MODEL}",
+                input=prompt,
+                temperature=0.2,
+                max_output_tokens=max(1500, 150 * len(items))
+            )
+        _record_llm_usage(response, "batch")
+        return response
+
+    return await retry_async(request, HTTP_RETRY_ATTEMPTS, HTTP_RETRY_BASE_DELAY, HTTP_RETRY_MAX_DELAY,
+                             retry_on=llm_retry_errors(), breaker=LLM_BREAKER, name="LLM (пакет)")
+
+
+async def _llm_parse_batch(items: List[Tuple[int, str]]) -> str:
+    response = await encode_batch_async(get_llm_client(), items)
+    return response.output[0].content[0].text
+
+
+async def _llm_parse_single(query: str) -> str:
+    response = await encode_query_async(get_llm_client(), query)
+    return response.output[0].content[0].text
+
+
+LLM_BATCHER = LLMBatcher(_llm_parse_batch, _llm_parse_single, is_valid_params, LLM_BATCH_WINDOW_MS / 1000,
+                         LLM_BATCH_MAX) if LLM_BATCH_WINDOW_MS > 0 else None
+
+
+def clean_llm_output(text):
+    """Очистка вывода LLM от Markdown форматирования."""
+    # Удаляем блоки с бэктиками
+    if text.startswith('```') and text.endswith('```'):
+        # Удаляем первые и последние бэктики
+        lines = text.split('\n')
+        # Пропускаем первую строку (```) и последнюю (```)
+        cleaned_lines = lines[1:-1]
+        return '\n'.join(cleaned_lines)
+    elif text.startswith('```'):
+        # Если формат неполный, удаляем только начальные бэктики
+        return text.replace('```', '', 1)
+    else:
+        return text.strip()
+
+
+async def parse_query_async(client, query: str) -> Tuple[str, Dict[str, Any], bool]:
+    """
+    Разбирает текстовый запрос: сначала кэш и локальный разбор, затем LLM.
+    Возвращает (очищенный JSON, параметры, разобран ли запрос через LLM).
+    """
+    llm_output_text = QUERY_PARSER.lookup(query)
+    from_llm = llm_output_text is None
+    if from_llm:
+        if LLM_BATCHER is not None:
+            llm_output_text = await LLM_BATCHER.submit(query)
+        else:
+            response = await encode_query_async(client, query)
+            llm_output_text = response.output[0].content[0].text
+        logger.info(f"ПОЛНЫЙ ОТВЕТ ОТ LLM: {llm_output_text}")
+    else:
+        logger.info(f"Запрос разобран без LLM: {llm_output_text} (статистика: {QUERY_PARSER.stats()})")
+
+    cleaned_llm_output = clean_llm_output(llm_output_text)
+    logger.info(f"ОЧИЩЕННЫЙ ОТВЕТ ОТ LLM: {cleaned_llm_output}")
+
+    try:
+        llm_params = json.loads(cleaned_llm_output)
+    except json.JSONDecodeError:
+        logger.error(f"Сырой вывод LLM: {llm_output_text}")
+        raise
+    if from_llm:
+        if is_valid_params(llm_params):
+            QUERY_PARSER.store(query, cleaned_llm_output)
+        else:
+            # Валидный JSON не той структуры не кэшируем, иначе повторный запрос упадёт так же, не доходя до LLM
+            logger.warning(f"Ответ LLM не в формате параметров, в кэш не сохраняем: {cleaned_llm_output}")
+    if TRACE_RECORDER is not None:
+        TRACE_RECORDER.record_parse(query, llm_params)
+    return cleaned_llm_output, llm_params, from_llm
+
+
 def prepare_query_params(llm_output_json, start_lat, start_lon):
     """
     Обрабатывает JSON от LLM и координаты старта для подготовки SQL-параметров.
@@ -309,67 +1170,82 @@ def find_suitable_objects(llm_json_input, start_lat, start_lon):
         prepare_query_params(llm_json_input, start_lat, start_lon)
 
     if not category_ids:
-        print("Ошибка: Не удалось определить категории интересов.")
+        logger.debug("Не удалось определить категории интересов")
         return []
 
-    category_list_sql = ', '.join(map(str, category_ids))
-    conn = get_db_connection()
-    if not conn: return []
-    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
-    # 2. Основной SQL-запрос с PostGIS
-    sql_query = f"""
-    SELECT
-        id, title, description, category_id, address,
-        ST_X(geom) AS longitude,
-        ST_Y(geom) AS latitude,
-        -- ST_Distance: точное расстояние от точки старта до объекта (в метрах)
-        ST_Distance(
-            geom::geography, 
-            ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography 
-        ) AS distance_m 
-    FROM
-        cultural_objects
-    WHERE
-        -- Фильтрация по интересам
-        category_id IN ({category_list_sql})
-        AND
-        -- ST_DWithin: быстрая гео-фильтрация в пределах max_distance_m
-        ST_DWithin(
-            geom::geography,
-            ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
-            %s 
-        )
-    ORDER BY
-        distance_m ASC
-    LIMIT 20; -- Берем до 20 ближайших объектов для дальнейшей оптимизации маршрута
-    """
-
-    # 3. Передача параметров
-    # Здесь создается кортеж со всеми значениями, которые нужно подставить в SQL-запрос вместо знаков %s.
-    #  Обратите внимание, что координаты пользователя (user_lon, user_lat) используются дважды, так как они нужны и в ST_Distance,
-    #  и в ST_DWithin.
-    params = (
-        user_lon, user_lat,
-        user_lon, user_lat, max_distance_m
-    )
+    # Быстрый путь: поиск по in-memory индексу без обращения к БД
+    if POI_INDEX_ENABLED and POI_INDEX.is_loaded:
+        suitable_objects = POI_INDEX.query(user_lat, user_lon, category_ids, max_distance_m, limit=CANDIDATES_LIMIT)
+        logger.debug(f"Радиус поиска: {max_distance_m:.0f} м (in-memory индекс)")
+        return suitable_objects
 
+    # 2. Подготовленный PostGIS-запрос из пула соединений (без повторного планирования)
     try:
-        cursor.execute(sql_query, params)
-        # Результат (до 20 строк) сохраняется на стороне сервера и становится
-        # доступен через объект cursor.
-        suitable_objects = [dict(row) for row in cursor.fetchall()]
-        # Эта команда забирает все строки результата, которые нашел cursor,
-        # и передает их в Python в виде списка. Каждый элемент списка — это тот самый DictRow объект (похожий на словарь).
-
-        print(f"Радиус поиска: {max_distance_m:.0f} м")
-        return suitable_objects
+        suitable_objects = DB_POOL.execute_prepared(
+            "find_suitable_objects",
+            (user_lon, user_lat, list(category_ids), max_distance_m, CANDIDATES_LIMIT)
+        )
+        logger.debug(f"Радиус поиска: {max_distance_m:.0f} м (PostGIS)")
+        return to_poi_records(suitable_objects)
     except psycopg2.Error as e:
-        print(f"Ошибка выполнения SQL-запроса: {e}")
+        logger.error(f"Ошибка выполнения SQL-запроса: {e}")
         return []
-    finally:
-        cursor.close()
-        conn.close()
+
+
+async def find_suitable_objects_async(llm_json_input, start_lat, start_lon):
+    """Запускает find_suitable_objects в пуле потоков, чтобы не блокировать event loop."""
+    async with DB_SEMAPHORE:
+        return await asyncio.to_thread(find_suitable_objects, llm_json_input, start_lat, start_lon)
+
+
+def _route_params(llm_params: Dict[str, Any]) -> Tuple[str, float, float]:
+    """Извлекает из вывода LLM способ передвижения, лимит времени и время на посещение (в секундах)."""
+    mode = llm_params.get("travel_mode", "пеший")
+    max_time_s = (llm_params.get("duration_minutes") or 60) * 60  # Если время не задано, берем 60 минут
+    visit_time_s = VISIT_TIME_MINUTES * 60
+    return mode, max_time_s, visit_time_s
+
+
+def _to_route_pois(candidate_objects: List[Any]) -> List[PoiRecord]:
+    """Адаптирует формат объектов из БД для алгоритма (записи из индекса передаются как есть)."""
+    return to_poi_records(candidate_objects)
+
+
+def prune_unreachable(start_point: Tuple[float, float], pois: List[PoiRecord], mode: str, max_time_s: float,
+                      visit_time_s: float) -> List[PoiRecord]:
+    """
+    Отсеивает кандидатов, до которых не успеть даже по оптимистичной оценке модели
+    (дорога туда, осмотр и, если учитывается, обратно): их нет смысла отправлять в OSRM.
+    """
+    if not TRAVEL_MODEL_PRUNE or not pois:
+        return pois
+    profile = OSRM_PROFILE_MAP.get(mode, "foot")
+    lats = np.array([p["lat"] for p in pois])
+    lons = np.array([p["lon"] for p in pois])
+    seconds = TRAVEL_MODELS.get(profile).estimate(start_point[0], start_point[1], lats, lons, optimistic=True)
+    seconds = seconds * _mode_coefficient(mode)
+    needed = seconds * (2 if ROUTE_INCLUDE_RETURN else 1) + visit_time_s
+    reachable = (needed <= max_time_s).tolist()
+    kept = [poi for poi, ok in zip(pois, reachable) if ok]
+    if len(kept) < len(pois):
+        CANDIDATES_PRUNED.inc(len(pois) - len(kept), profile=profile)
+        logger.info(f"Модель времени в пути отсеяла {len(pois) - len(kept)} из {len(pois)} кандидатов")
+    return kept
+
+
+def _calibrate_or_estimate(travel_time_matrix, coordinates: List[Tuple[float, float]], mode: str):
+    """
+    Матрица от OSRM калибрует модель профиля; если матрицы нет совсем (OSRM недоступен
+    и в кэше не хватает данных), она целиком оценивается моделью - при OSRM_OFFLINE_FALLBACK.
+    """
+    profile = OSRM_PROFILE_MAP.get(mode, "foot")
+    if travel_time_matrix is not None and len(travel_time_matrix) > 0:
+        TRAVEL_MODELS.observe(profile, coordinates, travel_time_matrix)
+        return travel_time_matrix
+    if not OSRM_OFFLINE_FALLBACK:
+        return None
+    logger.warning("OSRM недоступен: матрица времени целиком оценена по расстоянию моделью профиля.")
+    return TRAVEL_MODELS.get(profile).matrix(coordinates)
 
 
 def build_route(start_point: Tuple[float, float], candidate_objects: List[Dict[str, Any]], llm_params: Dict[str, Any],
@@ -378,24 +1254,13 @@ def build_route(start_point: Tuple[float, float], candidate_objects: List[Dict[s
     Основная функция для построения маршрута, использует оптимизированный алгоритм.
     """
     # 1. Извлекаем параметры из вывода LLM
-    mode = llm_params.get("travel_mode", "пеший")
-    max_time_s = (llm_params.get("duration_minutes") or 60) * 60  # Если время не задано, берем 60 минут
-    visit_time_s = VISIT_TIME_MINUTES * 60
+    mode, max_time_s, visit_time_s = _route_params(llm_params)
 
-    # 2. Адаптируем формат объектов для алгоритма
-    pois = [
-        {
-            "id": obj["id"],
-            "name": obj["title"],
-            "lat": obj["latitude"],
-            "lon": obj["longitude"],
-            "address": obj.get("address"),
-            "category_id": obj.get("category_id")
-        } for obj in candidate_objects
-    ]
+    # 2. Адаптируем формат объектов для алгоритма и отсеиваем заведомо недостижимые
+    pois = prune_unreachable(start_point, _to_route_pois(candidate_objects), mode, max_time_s, visit_time_s)
 
-    # 3. Запускаем ОПТИМИЗИРОВАННЫЙ "жадный" алгоритм с матрицей
-    route_chain, total_travel_time = _greedy_route_with_matrix(
+    # 3. Запускаем решатель задачи ориентирования по матрице времени
+    route_chain, total_travel_time = _route_with_matrix(
         start_point, pois, mode, max_time_s, visit_time_s, osrm_client
     )
 
@@ -403,14 +1268,167 @@ def build_route(start_point: Tuple[float, float], candidate_objects: List[Dict[s
     return _format_result(route_chain, total_travel_time, visit_time_s)
 
 
-def _greedy_route_with_matrix(start: Tuple[float, float], pois: List[Dict[str, Any]], mode: str, max_time_s: float,
-                              visit_time_s: float, osrm_client: OSRMClient) -> Tuple[List[Dict[str, Any]], float]:
+def _trace_stage(trace: Optional[RequestTrace], name: str):
+    """Замер этапа, если запрос трассируется."""
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+async def build_route_async(start_point: Tuple[float, float], candidate_objects: List[Dict[str, Any]],
+                            llm_params: Dict[str, Any], osrm_client: AsyncOSRMClient,
+                            trace: Optional[RequestTrace] = None,
+                            on_progress: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+                            ) -> Dict[str, Any]:
     """
-    [НОВЫЙ ОПТИМИЗИРОВАННЫЙ АЛГОРИТМ]
-    Использует полную матрицу времени OSRM, чтобы свести все расчеты времени к ОДНОМУ внешнему запросу.
+    Асинхронный вариант build_route: матрица запрашивается через AsyncOSRMClient,
+    сам поиск маршрута идёт в памяти. С on_progress (anytime-режим) промежуточные
+    маршруты передаются в него по мере нахождения, а решатель работает в отдельном потоке.
     """
-    coefficient = SPEED_MAPPINGS["автомобиль"] / SPEED_MAPPINGS[mode]
+    mode, max_time_s, visit_time_s = _route_params(llm_params)
+    pois = prune_unreachable(start_point, _to_route_pois(candidate_objects), mode, max_time_s, visit_time_s)
+    if trace is not None:
+        trace.fields["pruned_candidates"] = len(candidate_objects) - len(pois)
+    if not pois:
+        return _format_result([], 0.0, visit_time_s)
+
+    all_coords = [start_point] + [(p["lat"], p["lon"]) for p in pois]
+    all_ids = [None] + [p["id"] for p in pois]
+    with _trace_stage(trace, "osrm_table"):
+        if use_sparse_matrix(len(pois)):
+            travel_time_matrix = await osrm_client.get_sparse_travel_time_matrix(all_coords, mode, all_ids)
+        else:
+            travel_time_matrix = await osrm_client.get_full_travel_time_matrix(all_coords, mode, all_ids)
+    travel_time_matrix = _calibrate_or_estimate(travel_time_matrix, all_coords, mode)
+    if travel_time_matrix is None or len(travel_time_matrix) == 0:
+        logger.error("Не удалось получить матрицу времени от OSRM. Маршрут не построен.")
+        return _format_result([], 0.0, visit_time_s)
+
+    with _trace_stage(trace, "solver"):
+        if on_progress is not None:
+            route_chain, total_travel_time = await _solve_route_anytime(
+                travel_time_matrix, pois, mode, max_time_s, visit_time_s, on_progress)
+        elif SOLVER_POOL is not None:
+            route_chain, total_travel_time = await _solve_route_in_pool(
+                travel_time_matrix, pois, mode, max_time_s, visit_time_s)
+        else:
+            # Без пула процессов решатель работает в потоке, чтобы не занимать event loop бота
+            route_chain, total_travel_time = await asyncio.to_thread(
+                _solve_route_on_matrix, travel_time_matrix, pois, mode, max_time_s, visit_time_s)
+    return _format_result(route_chain, total_travel_time, visit_time_s)
+
 
+async def _solve_route_in_pool(travel_time_matrix, pois: List[Dict[str, Any]], mode: str, max_time_s: float,
+                               visit_time_s: float) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Решение в процессе SOLVER_POOL. Если процесс не уложился в дедлайн или упал,
+    маршрут строится жадно прямо здесь (это быстро), чтобы пользователь всё равно получил ответ.
+    """
+    matrix = prepare_matrix(travel_time_matrix, _mode_coefficient(mode), return_to_start=ROUTE_INCLUDE_RETURN)
+    try:
+        route_indices, total_travel_time = await SOLVER_POOL.solve(
+            matrix, visit_time_s, max_time_s, solver=ROUTE_SOLVER, time_budget_s=SOLVER_TIME_BUDGET_MS / 1000)
+    except SolverError as e:
+        logger.warning(f"Решатель в пуле процессов: {e}. Строим жадный маршрут.")
+        route_indices = solve_greedy(matrix, visit_time_s, max_time_s)
+        total_travel_time = tour_cost(matrix, route_indices)
+    return [pois[i - 1] for i in route_indices], total_travel_time
+
+
+async def _solve_route_anytime(travel_time_matrix: List[List[Optional[float]]], pois: List[Dict[str, Any]],
+                               mode: str, max_time_s: float, visit_time_s: float,
+                               on_progress: Callable[[Dict[str, Any]], Awaitable[None]]
+                               ) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Anytime-решение: жадный маршрут отдаётся сразу, затем решатель в отдельном потоке
+    ищет лучшие в пределах ANYTIME_DEADLINE_MS; новые лучшие маршруты передаются
+    в on_progress не чаще раза в ANYTIME_EDIT_INTERVAL_S.
+    """
+    matrix = prepare_matrix(travel_time_matrix, _mode_coefficient(mode), return_to_start=ROUTE_INCLUDE_RETURN)
+
+    def as_result(route: List[int]) -> Dict[str, Any]:
+        return _format_result([pois[i - 1] for i in route], tour_cost(matrix, route), visit_time_s)
+
+    first = solve_greedy(matrix, visit_time_s, max_time_s)
+    if first:
+        await on_progress(as_result(first))
+
+    # Решатель вызывает on_improvement из своего потока; забираем последнюю версию по таймеру
+    latest: Dict[str, Any] = {"route": None, "version": 0}
+
+    def on_improvement(route: List[int]) -> None:
+        latest["route"], latest["version"] = route, latest["version"] + 1
+
+    if SOLVER_POOL is not None:
+        solver_task = asyncio.ensure_future(SOLVER_POOL.solve(
+            matrix, visit_time_s, max_time_s,
+            solver=ROUTE_SOLVER, time_budget_s=ANYTIME_DEADLINE_MS / 1000, on_improvement=on_improvement))
+    else:
+        solver_task = asyncio.ensure_future(asyncio.to_thread(
+            solve_route, matrix, visit_time_s, max_time_s,
+            solver=ROUTE_SOLVER, time_budget_s=ANYTIME_DEADLINE_MS / 1000, on_improvement=on_improvement))
+    shown_version = 0
+    shown_key = (len(first), tour_cost(matrix, first))
+    try:
+        while not solver_task.done():
+            await asyncio.wait({solver_task}, timeout=ANYTIME_EDIT_INTERVAL_S)
+            route = latest["route"]
+            if solver_task.done() or latest["version"] == shown_version or route is None:
+                continue
+            shown_version = latest["version"]
+            # Показываем только маршруты лучше уже показанного (больше точек или короче)
+            key = (len(route), tour_cost(matrix, route))
+            if key[0] > shown_key[0] or (key[0] == shown_key[0] and key[1] < shown_key[1]):
+                shown_key = key
+                await on_progress(as_result(route))
+    finally:
+        # Запрос отменён (остановка бота) или показ промежуточного маршрута упал: задача решателя
+        # снимается, а её результат или ошибка забирается, чтобы не остаться без наблюдения
+        if not solver_task.done():
+            solver_task.cancel()
+            solver_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    try:
+        route_indices, total_travel_time = solver_task.result()
+    except SolverError as e:
+        # Процесс решателя не уложился в дедлайн: остаётся лучший из уже найденных маршрутов
+        logger.warning(f"Решатель в пуле процессов: {e}. Оставляем лучший найденный маршрут.")
+        route_indices = latest["route"] or first
+        total_travel_time = tour_cost(matrix, route_indices)
+    return [pois[i - 1] for i in route_indices], total_travel_time
+
+
+def lookup_cached_route(llm_json: str, llm_params: Dict[str, Any],
+                        start_point: Tuple[float, float]) -> Tuple[Optional[tuple], Optional[Dict[str, Any]]]:
+    """
+    Ключ кэша маршрутов и готовый маршрут из кэша (None - промах, маршрут не укладывается
+    во время от новой точки старта или кэш выключен).
+    """
+    if ROUTE_CACHE is None:
+        return None, None
+    mode, max_time_s, visit_time_s = _route_params(llm_params)
+    _, _, category_ids, _ = prepare_query_params(llm_json, start_point[0], start_point[1])
+    key = route_cache_key(start_point[0], start_point[1], mode, max_time_s / 60, category_ids,
+                          precision=ROUTE_CACHE_PRECISION, bucket_minutes=ROUTE_CACHE_BUCKET_MIN,
+                          extra=llm_params.get("distance_km"))
+    speed_m_s = SPEED_MAPPINGS.get(mode, SPEED_MAPPINGS["пеший"]) / 60
+    cached = ROUTE_CACHE.get(key, start_point, max_time_s, visit_time_s, speed_m_s)
+    if cached is None:
+        return key, None
+    route_chain, total_travel_time = cached
+    return key, _format_result(route_chain, total_travel_time, visit_time_s)
+
+
+def store_cached_route(key: Optional[tuple], start_point: Tuple[float, float], final_route: Dict[str, Any]) -> None:
+    if ROUTE_CACHE is None or key is None or not final_route.get("success"):
+        return
+    ROUTE_CACHE.put(key, start_point, final_route["pois"], final_route["total_travel_time_min"] * 60,
+                    with_return=ROUTE_INCLUDE_RETURN)
+
+
+def _route_with_matrix(start: Tuple[float, float], pois: List[Dict[str, Any]], mode: str, max_time_s: float,
+                       visit_time_s: float, osrm_client: OSRMClient) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Использует полную матрицу времени OSRM, чтобы свести все расчеты времени к ОДНОМУ внешнему запросу.
+    """
     if not pois:
         return [], 0.0
 
@@ -418,60 +1436,38 @@ def _greedy_route_with_matrix(start: Tuple[float, float], pois: List[Dict[str, A
     # Индекс 0 - это Старт. Индексы 1..N - это POI.
     all_coords = [start] + [(p["lat"], p["lon"]) for p in pois]
 
-    # Создаем маппинг Индекс -> Исходный Объект POI
-    poi_index_to_object = {i + 1: pois[i] for i in range(len(pois))}
+    # 2. ОДИН ЗАПРОС к OSRM за ПОЛНОЙ МАТРИЦЕЙ (при наличии кэша - только за недостающими строками/столбцами);
+    # для большого набора кандидатов - разреженная матрица по k ближайшим соседям
+    all_ids = [None] + [p["id"] for p in pois]
+    if use_sparse_matrix(len(pois)):
+        travel_time_matrix = osrm_client.get_sparse_travel_time_matrix(all_coords, mode, all_ids)
+    else:
+        travel_time_matrix = osrm_client.get_full_travel_time_matrix(all_coords, mode, all_ids)
+    travel_time_matrix = _calibrate_or_estimate(travel_time_matrix, all_coords, mode)
 
-    # 2. ОДИН ЗАПРОС к OSRM за ПОЛНОЙ МАТРИЦЕЙ
-    travel_time_matrix = osrm_client.get_full_travel_time_matrix(all_coords, mode)
-
-    if not travel_time_matrix:
+    if travel_time_matrix is None or len(travel_time_matrix) == 0:
         logger.error("Не удалось получить матрицу времени от OSRM. Маршрут не построен.")
         return [], 0.0
 
-    # 3. Инициализация алгоритма
-    current_index = 0  # Начинаем со Старта (индекс 0)
-    remaining_indices = set(range(1, len(all_coords)))  # Индексы POI (1 до N)
-    route_indices = []
-    total_time = 0
-    total_travel_time = 0
-
-    # 4. "Жадный" поиск в памяти (мгновенно)
-    while remaining_indices and total_time < max_time_s:
-        nearest_poi_index = None
-        min_travel_duration = float('inf')
-
-        # Перебираем все оставшиеся POI
-        for next_index in remaining_indices:
-            # Получаем время из матрицы: travel_time_matrix[от_кого][до_кого]
-            travel_duration = travel_time_matrix[current_index][next_index] * coefficient
-
-            if travel_duration is not None and travel_duration < min_travel_duration:
-                min_travel_duration = travel_duration
-                nearest_poi_index = next_index
-
-        # Если ближайшая точка найдена
-        if nearest_poi_index is not None:
-            # Проверяем, укладываемся ли во время
-            if total_time + min_travel_duration + visit_time_s <= max_time_s:
-                # Обновляем маршрут и время
-                route_indices.append(nearest_poi_index)
-                total_time += min_travel_duration + visit_time_s
-                total_travel_time += min_travel_duration
-
-                # Переходим к следующей точке
-                current_index = nearest_poi_index
-                remaining_indices.remove(nearest_poi_index)
-            else:
-                # Времени на следующую точку не хватает
-                break
-        else:
-            # Если не удалось найти маршрут ни до одной из оставшихся точек
-            break
+    return _solve_route_on_matrix(travel_time_matrix, pois, mode, max_time_s, visit_time_s)
 
-    # 5. Формирование финального результата
-    final_route_chain = [poi_index_to_object[i] for i in route_indices]
 
-    return final_route_chain, total_travel_time
+def _solve_route_on_matrix(travel_time_matrix: List[List[Optional[float]]], pois: List[Dict[str, Any]], mode: str,
+                           max_time_s: float, visit_time_s: float) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Решает задачу ориентирования по уже полученной матрице решателем из ROUTE_SOLVER.
+    Индекс 0 - Старт, индексы 1..N - POI. null-ячейки OSRM считаются недоступными парами.
+    """
+    # Публичный OSRM считает время для автомобиля, поэтому пересчитываем его под скорость выбранного способа
+    matrix = prepare_matrix(travel_time_matrix, _mode_coefficient(mode), return_to_start=ROUTE_INCLUDE_RETURN)
+
+    route_indices, total_travel_time = solve_route(
+        matrix, visit_time_s, max_time_s,
+        solver=ROUTE_SOLVER,
+        time_budget_s=SOLVER_TIME_BUDGET_MS / 1000
+    )
+    return [pois[i - 1] for i in route_indices], total_travel_time
+
 
 def _format_result(route_chain: List[Dict[str, Any]], total_travel_time: float, visit_time_s: float) -> Dict[str, Any]:
     """
@@ -514,6 +1510,67 @@ def generate_yandex_route_url(coordinates, transport_type):
 
 # ----- ТЕЛЕГРАМ ОБРАБОТЧИКИ -----
 
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def description_snippet(description: Optional[str], limit: int = POI_DESCRIPTION_CHARS) -> str:
+    """Начало описания объекта без HTML-разметки, не длиннее limit символов."""
+    if not description:
+        return ""
+    text = " ".join(html.unescape(_HTML_TAG_RE.sub(" ", description)).split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0].rstrip(",.;:") + "…"
+
+
+async def load_descriptions_async(pois: List[PoiRecord]) -> Dict[int, str]:
+    """Описания объектов маршрута для ответа (из кэша или одним запросом к БД); {} при ошибке."""
+    if not ROUTE_SHOW_DESCRIPTIONS or not pois:
+        return {}
+    try:
+        async with DB_SEMAPHORE:
+            return await asyncio.to_thread(POI_DESCRIPTIONS.get_many, [poi["id"] for poi in pois])
+    except Exception as e:
+        logger.warning(f"Не удалось загрузить описания объектов: {e}")
+        return {}
+
+
+def format_route_message(final_route: Dict[str, Any], start_point: Tuple[float, float], travel_mode: str,
+                         preliminary: bool = False, descriptions: Optional[Dict[int, str]] = None) -> str:
+    """
+    Текст сообщения с маршрутом (Markdown). preliminary - маршрут ещё улучшается;
+    descriptions - описания объектов по id (см. load_descriptions_async).
+    """
+    # Собираем полный список координат: Старт -> Точки -> Старт
+    all_points_coords = [start_point]
+    poi_coords = [(poi['lat'], poi['lon']) for poi in final_route['pois']]
+    all_points_coords.extend(poi_coords)
+    all_points_coords.append(start_point)
+
+    yandex_transport_type = YANDEX_TRANSPORT_MAPPING.get(travel_mode, "pedestrian")
+
+    route_url = generate_yandex_route_url(all_points_coords, yandex_transport_type)
+
+    header = "⏳ **Предварительный маршрут, ищу лучше...**" if preliminary else "✅ **Маршрут построен!**"
+    route_text = (
+        f"{header}\n\n"
+        f"🚶 Способ передвижения: {travel_mode.capitalize()}\n"
+        f"⏱ Общее время маршрута: **{final_route['total_duration_min']:.1f} мин.**\n"
+        f"📍 Количество посещений: {final_route['total_pois']}\n\n"
+    )
+
+    poi_lines = []
+    for i, poi in enumerate(final_route['pois']):
+        poi_lines.append(f"{i+1}. [{poi['name']}]({route_url})")
+        snippet = description_snippet((descriptions or {}).get(poi['id']))
+        if snippet:
+            poi_lines.append(f"    {escape_markdown(snippet)}")
+    poi_list = "\n".join(poi_lines)
+
+    return (route_text + f"**Объекты для посещения:**\n{poi_list}\n\n"
+            f"🗺 [Открыть маршрут на Яндекс Картах]({route_url})")
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # ... (Весь код функции start из примера) ...
     keyboard = [
@@ -538,8 +1595,18 @@ async def handle_text_query(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     query = update.message.text
     
-    USER_QUERY_CACHE[user_id] = query
+    await SESSION_STORE.set(user_id, {"query": query})
     logger.info(f"Кэширован запрос от {user_id}: {query}")
+    if TRACE_RECORDER is not None:
+        TRACE_RECORDER.record_query(user_id, query)
+
+    # Пока пользователь отправляет геолокацию, запрос уже разбирается в фоне
+    if SPECULATIVE_PARSE_ENABLED:
+        try:
+            llm_client = get_llm_client()
+            SPECULATIVE_PARSES.start(user_id, query, lambda: parse_query_async(llm_client, query))
+        except Exception as e:
+            logger.warning(f"Не удалось запустить фоновый разбор запроса: {e}")
 
     keyboard = [
         [
@@ -557,121 +1624,234 @@ async def handle_text_query(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+def _rejection_message(admission: Admission) -> str:
+    if admission.status == DUPLICATE:
+        return "Маршрут от этой точки уже строится - пришлю его, как только он будет готов."
+    if admission.status == RATE_LIMITED:
+        return (f"Слишком много запросов подряд. Попробуйте снова через "
+                f"{max(1, math.ceil(admission.retry_after_s))} с.")
+    return "Сейчас бот перегружен запросами. Попробуйте отправить геолокацию через пару минут."
+
+
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Принимает координаты, выполняет LLM-анализ и строит маршрут."""
+    """Принимает координаты и ставит построение маршрута в очередь планировщика."""
     
     user_id = update.effective_user.id
     user_location = update.message.location
     latitude = user_location.latitude
     longitude = user_location.longitude
 
-    logger.info(f"Получены координаты от {user_id}: LAT={latitude}, LON={longitude}")
-    await update.message.reply_text("Получил координаты. Запускаю анализ запроса и построение маршрута, это может занять минуту...")
+    trace = RequestTrace(user_id)
+    logger.info(f"[{trace.correlation_id}] Получены координаты от {user_id}: LAT={latitude}, LON={longitude}")
+    if TRACE_RECORDER is not None:
+        TRACE_RECORDER.record_location(user_id, latitude, longitude)
+
+    # 1. Извлекаем текстовый запрос (сессия удаляется, только если маршрут принят в очередь)
+    session = await SESSION_STORE.get(user_id) or {}
+    query = session.get("query") or "Хочу пешком 90 минут по историческим местам"
+
+    # Построение начинается после ответа о приёме, чтобы сообщения шли по порядку
+    acknowledged = asyncio.Event()
+
+    async def run(queue_wait_s: float) -> None:
+        await acknowledged.wait()
+        trace.fields["queue_wait_ms"] = round(queue_wait_s * 1000, 1)
+        await build_and_send_route(update, trace, query)
+
+    admission = ROUTE_SCHEDULER.submit(user_id, (latitude, longitude), session.get("query"), run)
+    if not admission.accepted:
+        logger.info(f"[{trace.correlation_id}] Запрос маршрута от {user_id} не принят: {admission.status}")
+        trace.result = admission.status
+        trace.finish()
+        await update.message.reply_text(_rejection_message(admission))
+        return
+
+    try:
+        if session:
+            await SESSION_STORE.delete(user_id)
+        if admission.position > 0:
+            trace.fields["queue_position"] = admission.position
+            await update.message.reply_text(
+                f"Получил координаты. Сейчас строится много маршрутов - вы в очереди, позиция {admission.position}. "
+                f"Маршрут придёт автоматически.")
+        else:
+            await update.message.reply_text("Получил координаты. Запускаю анализ запроса и построение маршрута, это может занять минуту...")
+    finally:
+        acknowledged.set()
+
+
+async def build_and_send_route(update: Update, trace: RequestTrace, query: str) -> None:
+    """Выполняет LLM-анализ запроса, строит маршрут и отправляет его (в исполнителе планировщика)."""
+    user_id = update.effective_user.id
+    latitude = update.message.location.latitude
+    longitude = update.message.location.longitude
 
     # --- ИНТЕГРАЦИЯ ВАШЕЙ ЛОГИКИ МАРШРУТИЗАЦИИ ---
 
-    # 1. Извлекаем текстовый запрос
-    query = USER_QUERY_CACHE.pop(user_id, "Хочу пешком 90 минут по историческим местам")
-    
     try:
-        yandex_client = create_yandex_client()
-        osrm_client = OSRMClient()
+        yandex_client = get_llm_client()
+        osrm_client = get_osrm_client()
     except Exception as e:
         logger.error(f"Ошибка инициализации клиентов: {e}")
         await update.message.reply_text("Извините, внутренняя ошибка при инициализации сервисов.")
+        trace.result = "error"
+        trace.finish()
         return
 
     try:
-        # 2. LLM: Парсим запрос
-        response = encode_query(yandex_client, query)
-        llm_output_text = response.output[0].content[0].text
-        logger.info(f"ПОЛНЫЙ ОТВЕТ ОТ LLM: {llm_output_text}")
-        
-        # ОЧИСТКА ВЫВОДА ОТ MARKDOWN ФОРМАТИРОВАНИЯ
-        def clean_llm_output(text):
-            # Удаляем блоки с бэктиками
-            if text.startswith('```') and text.endswith('```'):
-                # Удаляем первые и последние бэктики
-                lines = text.split('\n')
-                # Пропускаем первую строку (```) и последнюю (```)
-                cleaned_lines = lines[1:-1]
-                return '\n'.join(cleaned_lines)
-            elif text.startswith('```'):
-                # Если формат неполный, удаляем только начальные бэктики
-                return text.replace('```', '', 1)
+        # 2. LLM: Парсим запрос (сначала кэш и локальный разбор, затем LLM)
+        with trace.stage("llm_parse"):
+            parse_task = SPECULATIVE_PARSES.take(user_id, query)
+            trace.fields["speculative_parse"] = parse_task is not None
+            if parse_task is not None:
+                # Разбор запущен ещё в handle_text_query; ошибка разбора пробрасывается отсюда
+                trace.fields["speculative_ready"] = parse_task.done()
+                cleaned_llm_output, llm_params, from_llm = await parse_task
             else:
-                return text.strip()
-        
-        cleaned_llm_output = clean_llm_output(llm_output_text)
-        logger.info(f"ОЧИЩЕННЫЙ ОТВЕТ ОТ LLM: {cleaned_llm_output}")
-        
-        llm_params = json.loads(cleaned_llm_output)
+                cleaned_llm_output, llm_params, from_llm = await parse_query_async(yandex_client, query)
+            trace.fields["parsed_by_llm"] = from_llm
 
-        # 3. DB: Ищем подходящие объекты
-        candidate_objects = find_suitable_objects(cleaned_llm_output, latitude, longitude)
-        
-        if not candidate_objects:
-             await update.message.reply_text("Не удалось найти подходящие объекты в заданном радиусе и по интересам. Попробуйте другой запрос.")
-             return
-        
-        # 4. OSRM: Строим маршрут
+        # 2a. Кэш готовых маршрутов: похожий запрос из той же части города - без OSRM и решателя
         start_point = (latitude, longitude)
-        final_route = build_route(start_point, candidate_objects, llm_params, osrm_client)
+        route_key, final_route = lookup_cached_route(cleaned_llm_output, llm_params, start_point)
+        travel_mode = llm_params.get("travel_mode", "пеший")
+        progress = ProgressMessage(update.message, ANYTIME_EDIT_INTERVAL_S,
+                                   parse_mode='Markdown', disable_web_page_preview=False)
+        trace.fields["route_cache_hit"] = final_route is not None
+
+        if final_route is None:
+            # 3. DB: Ищем подходящие объекты
+            with trace.stage("find_objects"):
+                candidate_objects = await find_suitable_objects_async(cleaned_llm_output, latitude, longitude)
+            trace.fields["candidates"] = len(candidate_objects)
+
+            if not candidate_objects:
+                 trace.result = "no_candidates"
+                 await update.message.reply_text("Не удалось найти подходящие объекты в заданном радиусе и по интересам. Попробуйте другой запрос.")
+                 return
+
+            # 4. OSRM: Строим маршрут (в anytime-режиме первый маршрут показывается сразу)
+            on_progress = None
+            if ANYTIME_ROUTING:
+                async def on_progress(preliminary_route: Dict[str, Any]) -> None:
+                    trace.fields.setdefault("first_route_ms",
+                                            round((time.perf_counter() - trace.started) * 1000, 1))
+                    await progress.show(format_route_message(preliminary_route, start_point, travel_mode,
+                                                             preliminary=True))
+
+            final_route = await build_route_async(start_point, candidate_objects, llm_params, osrm_client, trace,
+                                                  on_progress=on_progress)
+            store_cached_route(route_key, start_point, final_route)
 
         # 5. Форматируем и отправляем ответ
         if final_route.get("success"):
-            # Собираем полный список координат: Старт -> Точки -> Старт
-            all_points_coords = [start_point]
-            poi_coords = [(poi['lat'], poi['lon']) for poi in final_route['pois']]
-            all_points_coords.extend(poi_coords)
-            all_points_coords.append(start_point)
-
-            travel_mode = llm_params.get("travel_mode", "пеший")
-            yandex_transport_type = YANDEX_TRANSPORT_MAPPING.get(travel_mode, "pedestrian")
-
-            route_url = generate_yandex_route_url(all_points_coords, yandex_transport_type)
-            
-            route_text = (
-                f"✅ **Маршрут построен!**\n\n"
-                f"🚶 Способ передвижения: {travel_mode.capitalize()}\n"
-                f"⏱ Общее время маршрута: **{final_route['total_duration_min']:.1f} мин.**\n"
-                f"📍 Количество посещений: {final_route['total_pois']}\n\n"
-            )
-            
-            poi_list = "\n".join([
-                f"{i+1}. [{poi['name']}]({route_url})"
-                for i, poi in enumerate(final_route['pois'])
-            ])
-            
-            await update.message.reply_text(
-                route_text + f"**Объекты для посещения:**\n{poi_list}\n\n"
-                f"🗺 [Открыть маршрут на Яндекс Картах]({route_url})",
-                parse_mode='Markdown',
-                disable_web_page_preview=False
-            )
+            with trace.stage("reply"):
+                # Описания нужны только итоговому сообщению - читаем их из БД лишь здесь
+                descriptions = await load_descriptions_async(final_route["pois"])
+                # Если предварительный маршрут уже показан - редактируем то же сообщение
+                await progress.finish(format_route_message(final_route, start_point, travel_mode,
+                                                           descriptions=descriptions))
+            trace.result = "success"
+            trace.fields["route_pois"] = final_route["total_pois"]
         else:
-            await update.message.reply_text(f"Не удалось построить оптимальный маршрут: {final_route.get('message', 'Неизвестная ошибка')}")
+            trace.result = "empty_route"
+            with trace.stage("reply"):
+                await update.message.reply_text(f"Не удалось построить оптимальный маршрут: {final_route.get('message', 'Неизвестная ошибка')}")
 
     except json.JSONDecodeError as e:
-        logger.error(f"Ошибка парсинга JSON от LLM: {e}")
-        logger.error(f"Сырой вывод LLM: {llm_output_text}")
+        trace.result = "llm_error"
+        logger.error(f"[{trace.correlation_id}] Ошибка парсинга JSON от LLM: {e}")
         await update.message.reply_text("Ошибка при анализе вашего запроса. Попробуйте сформулировать его более четко.")
     except Exception as e:
-        logger.error(f"Критическая ошибка при обработке маршрута: {e}", exc_info=True)
+        trace.result = "error"
+        logger.error(f"[{trace.correlation_id}] Критическая ошибка при обработке маршрута: {e}", exc_info=True)
         await update.message.reply_text("К сожалению, произошла непредвиденная ошибка при расчете маршрута.")
+    finally:
+        trace.finish()
+
+
+def run_webhook(application) -> None:
+    """Принимает обновления через вебхук: Telegram сам присылает их на локальный HTTP(S)-сервер."""
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для BOT_MODE=webhook задайте WEBHOOK_URL (публичный https-адрес бота)")
+    logger.info(f"Бот запущен в режиме вебхука: {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH} <- {WEBHOOK_URL}")
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET or None,
+        cert=WEBHOOK_CERT or None,
+        key=WEBHOOK_KEY or None,
+        allowed_updates=ALLOWED_UPDATES,
+    )
 
 
 # -------------------------------------------------------------
 # 5. ОСНОВНАЯ ФУНКЦИЯ ЗАПУСКА
 # -------------------------------------------------------------
+IMPORT_MS = (time.perf_counter() - _IMPORT_STARTED) * 1000
+
+
 def main() -> None:
     """Запускает бота."""
+    logger.info(f"Импорт и инициализация модулей: {IMPORT_MS:.0f} мс")
     
     if not TOKEN:
          logger.error("Токен Telegram-бота не установлен. Проверьте переменную TG_BOT_TOKEN в .env.")
          return
 
-    application = ApplicationBuilder().token(TOKEN).build()
+    # Прогрев в фоне, параллельно: пул БД, объекты в память (при ошибке работаем через PostGIS),
+    # SDK LLM и кэши. Обновления начнут приниматься после warm_up_services
+    steps = {"db_pool": warm_up_db_pool, "llm_sdk": import_llm_sdk, "travel_cache": preload_travel_times}
+    if POI_INDEX_ENABLED:
+        steps["poi_index"] = load_poi_data
+    if SOLVER_POOL is not None:
+        steps["solver_pool"] = SOLVER_POOL.start
+    _WARMUP_FUTURES.update(warmup.start_background(steps))
+
+    # Метрики: этапы запросов + текущее состояние пулов и кэшей
+    REGISTRY.register_gauges("ai_travel_db_pool", "Статистика пула соединений с БД", DB_POOL.stats)
+    REGISTRY.register_gauges("ai_travel_osrm_cache", "Статистика кэша времени в пути", TRAVEL_TIME_CACHE.stats)
+    REGISTRY.register_gauges("ai_travel_sessions", "Статистика хранилища сессий", SESSION_STORE.stats)
+    REGISTRY.register_gauges("ai_travel_query_parser", "Статистика кэша и локального разбора запросов",
+                             QUERY_PARSER.stats)
+    if ROUTE_CACHE is not None:
+        REGISTRY.register_gauges("ai_travel_route_cache", "Статистика кэша готовых маршрутов", ROUTE_CACHE.stats)
+    REGISTRY.register_gauges("ai_travel_poi_descriptions", "Кэш описаний объектов для ответа",
+                             POI_DESCRIPTIONS.stats)
+    REGISTRY.register_gauges("ai_travel_speculative_parse", "Фоновый разбор запросов до прихода геолокации",
+                             SPECULATIVE_PARSES.stats)
+    REGISTRY.register_gauges("ai_travel_osrm_http", "Пул соединений, предохранитель и объединение запросов OSRM",
+                             osrm_http_stats)
+    REGISTRY.register_gauges("ai_travel_llm_http", "Пул соединений, предохранитель и объединение запросов LLM",
+                             llm_http_stats)
+    REGISTRY.register_gauges("ai_travel_travel_model", "Калибровка и ошибка модели времени в пути по профилям",
+                             TRAVEL_MODELS.stats)
+    if TRACE_RECORDER is not None:
+        REGISTRY.register_gauges("ai_travel_trace_recorder", "Запись трасс для нагрузочного теста",
+                                 TRACE_RECORDER.stats)
+    if LLM_BATCHER is not None:
+        REGISTRY.register_gauges("ai_travel_llm_batch", "Пакетный разбор запросов через LLM", LLM_BATCHER.stats)
+    if SOLVER_POOL is not None:
+        REGISTRY.register_gauges("ai_travel_solver_pool", "Пул процессов решателя маршрутов", SOLVER_POOL.stats)
+    REGISTRY.register_gauges("ai_travel_startup", "Прогрев процесса: готовность и длительность шагов (мс)",
+                             HEALTH.stats)
+    start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    # После обновления cultural_objects: kill -HUP <pid>. С индексом - перезагрузка индекса (его слушатели
+    # сбрасывают кэши), без индекса кандидаты и так читаются из БД - сбрасываются только кэши маршрутов и описаний
+    if hasattr(signal, "SIGHUP"):
+        on_objects_changed = POI_INDEX.reload if POI_INDEX_ENABLED else clear_object_caches
+        signal.signal(signal.SIGHUP,
+                      lambda signum, frame: threading.Thread(target=on_objects_changed, daemon=True).start())
+
+    # Обновления разных пользователей обрабатываются параллельно, одного пользователя - по порядку
+    update_processor = PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING)
+    REGISTRY.register_gauges("ai_travel_updates", "Обработка обновлений Telegram", update_processor.stats)
+    REGISTRY.register_gauges("ai_travel_route_scheduler", "Очередь построения маршрутов", ROUTE_SCHEDULER.stats)
+    application = (ApplicationBuilder().token(TOKEN).concurrent_updates(update_processor)
+                   .post_init(warm_up_services).post_shutdown(shutdown_services).build())
 
     # Регистрация обработчиков
     application.add_handler(CommandHandler("start", start))
@@ -683,8 +1863,14 @@ def main() -> None:
     application.add_handler(MessageHandler(filters.LOCATION, handle_location))
 
     # Запуск
-    logger.info("Бот запущен и ожидает сообщений...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BOT_MODE == "webhook":
+        run_webhook(application)
+    else:
+        logger.info("Бот запущен и ожидает сообщений...")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+    logger.info(f"Статистика пула соединений с БД: {DB_POOL.stats()}")
+    DB_POOL.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,113 @@
+"""
+Предрассчитанные матрицы времени POI-POI для каждого профиля OSRM.
+
+Набор объектов статичен, поэтому матрицы строятся один раз (build_matrices.py)
+и хранятся как float32 .npy-файлы:
+    <dir>/ids.npy         - id объектов в порядке строк/столбцов (int64)
+    <dir>/<profile>.npy   - матрица NxN, секунды, NaN - нет маршрута
+Бот открывает их через memory-map: страницы файла общие для всех процессов,
+строки читаются без копирования.
+"""
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("AI_Travel")
+
+IDS_FILE = "ids.npy"
+
+
+class MatrixStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.ids = np.load(os.path.join(directory, IDS_FILE))
+        self.position: Dict[int, int] = {int(poi_id): i for i, poi_id in enumerate(self.ids.tolist())}
+        self.matrices: Dict[str, np.ndarray] = {}
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".npy") and name != IDS_FILE:
+                profile = name[:-len(".npy")]
+                self.matrices[profile] = np.load(os.path.join(directory, name), mmap_mode="r")
+        logger.info(f"Загружены предрассчитанные матрицы: {sorted(self.matrices)} для {len(self.ids)} объектов")
+
+    @classmethod
+    def open(cls, directory: str) -> Optional["MatrixStore"]:
+        """Открывает хранилище; если файлов нет или они повреждены - None (работаем без него)."""
+        if not directory or not os.path.exists(os.path.join(directory, IDS_FILE)):
+            return None
+        try:
+            return cls(directory)
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось открыть предрассчитанные матрицы в {directory}: {e}")
+            return None
+
+    def prefault(self) -> int:
+        """
+        Читает матрицы целиком, чтобы страницы memory-map попали в память до первых запросов.
+        Возвращает число прочитанных байт.
+        """
+        total = 0
+        for matrix in self.matrices.values():
+            np.isnan(matrix).any()
+            total += matrix.nbytes
+        return total
+
+    def has_profile(self, profile: str) -> bool:
+        return profile in self.matrices
+
+    def row(self, profile: str, poi_id: int) -> Optional[np.ndarray]:
+        """Строка времени от объекта до всех остальных (view на memory-map, без копирования)."""
+        position = self.position.get(poi_id)
+        if position is None or profile not in self.matrices:
+            return None
+        return self.matrices[profile][position]
+
+    def get_pairs(self, profile: str, pairs: Sequence[Tuple[int, int]]) -> Dict[Tuple[int, int], float]:
+        """Время для отдельных пар id объектов (разреженная матрица); пары без данных пропускаются."""
+        stored = self.matrices.get(profile)
+        known = [(src, dst) for src, dst in pairs if src in self.position and dst in self.position]
+        if stored is None or not known:
+            return {}
+        rows = np.fromiter((self.position[src] for src, _ in known), dtype=np.int64, count=len(known))
+        cols = np.fromiter((self.position[dst] for _, dst in known), dtype=np.int64, count=len(known))
+        values = stored[rows, cols].astype(np.float64)
+        return {pair: float(value) for pair, value in zip(known, values.tolist()) if not np.isnan(value)}
+
+    def fill(self, profile: str, ids: Sequence[Optional[int]], matrix: List[List[Optional[float]]]) -> None:
+        """Заполняет в matrix все пары объектов, которые есть в хранилище (None - точки без id)."""
+        stored = self.matrices.get(profile)
+        if stored is None:
+            return
+        known = [(i, self.position[poi_id]) for i, poi_id in enumerate(ids)
+                 if poi_id is not None and poi_id in self.position]
+        if len(known) < 2:
+            return
+        local = [i for i, _ in known]
+        block = stored[np.ix_([p for _, p in known], [p for _, p in known])].astype(np.float64)
+        for a, i in enumerate(local):
+            row = matrix[i]
+            for b, j in enumerate(local):
+                value = block[a, b]
+                if i != j and not np.isnan(value):
+                    row[j] = float(value)
+
+
+def _save_atomically(path: str, array: np.ndarray) -> None:
+    # Пишем во временный файл и подменяем, чтобы работающий бот не увидел недописанный файл
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def save_matrices(directory: str, ids: Sequence[int], matrices: Dict[str, np.ndarray]) -> None:
+    """
+    Сохраняет матрицы профилей и ids (используется build_matrices.py). ids подменяются
+    последними: бот, открывающий хранилище во время пересборки, не получит новые ids
+    со старыми матрицами.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for profile, matrix in matrices.items():
+        _save_atomically(os.path.join(directory, f"{profile}.npy"), np.asarray(matrix, dtype=np.float32))
+    _save_atomically(os.path.join(directory, IDS_FILE), np.asarray(ids, dtype=np.int64))
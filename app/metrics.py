@@ -0,0 +1,270 @@
+"""
+Метрики в формате Prometheus и замеры времени по этапам обработки запроса.
+
+- Counter / Histogram - потокобезопасные метрики с метками;
+- RequestTrace - correlation id и время этапов одного запроса
+  (LLM, БД, OSRM, решатель, ответ), пишется в гистограмму и в одну
+  структурированную строку лога;
+- HealthState - прогрев процесса для проб /healthz (жив) и /readyz (прогрет);
+- start_metrics_server - HTTP-эндпоинты /metrics, /healthz и /readyz в отдельном потоке.
+
+Накладные расходы - perf_counter и захват блокировки на этап, поэтому
+метрики можно держать включёнными в продакшене.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("AI_Travel")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (последняя +Inf), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(entry[0]), entry[1], entry[2]) for key, entry in sorted(self._values.items())]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        # Функции, возвращающие текущие значения (статистика пулов и кэшей) -> gauge
+        self._gauge_callbacks: List[Tuple[str, str, Callable[[], Dict[str, float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_gauges(self, prefix: str, documentation: str, callback: Callable[[], Dict[str, float]]) -> None:
+        """Каждое числовое поле словаря из callback публикуется как gauge <prefix>_<поле>."""
+        self._gauge_callbacks.append((prefix, documentation, callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, documentation, callback in self._gauge_callbacks:
+            try:
+                values = callback()
+            except Exception as e:
+                logger.warning(f"Не удалось получить метрики {prefix}: {e}")
+                continue
+            for field, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"{prefix}_{field}"
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} gauge")
+                    lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ai_travel_stage_seconds", "Длительность этапов обработки запроса маршрута", ["stage"]))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ai_travel_request_seconds", "Полное время обработки запроса маршрута", ["result"]))
+REQUESTS_TOTAL = REGISTRY.register(Counter(
+    "ai_travel_requests_total", "Запросы маршрута по результату", ["result"]))
+STAGE_FAILURES_TOTAL = REGISTRY.register(Counter(
+    "ai_travel_stage_failures_total", "Ошибки на этапах обработки запроса", ["stage"]))
+
+
+# Подписчики на завершённые запросы (нагрузочный тест собирает по ним перцентили этапов)
+TRACE_LISTENERS: List[Callable[["RequestTrace"], None]] = []
+
+
+class RequestTrace:
+    """Замеры одного запроса маршрута. result выставляет обработчик перед finish()."""
+
+    def __init__(self, user_id: Optional[int] = None, correlation_id: Optional[str] = None):
+        self.correlation_id = correlation_id or uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.stages_ms: Dict[str, float] = {}
+        self.result = "unknown"
+        self.fields: Dict[str, object] = {}
+        self.total_ms: Optional[float] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            STAGE_FAILURES_TOTAL.inc(stage=name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            STAGE_SECONDS.observe(elapsed, stage=name)
+            self.stages_ms[name] = round(self.stages_ms.get(name, 0.0) + elapsed * 1000, 1)
+
+    def finish(self) -> None:
+        """Пишет итоговые метрики и одну структурированную строку лога."""
+        elapsed = time.perf_counter() - self.started
+        self.total_ms = round(elapsed * 1000, 1)
+        REQUEST_SECONDS.observe(elapsed, result=self.result)
+        REQUESTS_TOTAL.inc(result=self.result)
+        logger.info(json.dumps({
+            "event": "route_request",
+            "correlation_id": self.correlation_id,
+            "user_id": self.user_id,
+            "result": self.result,
+            "total_ms": self.total_ms,
+            "stages_ms": self.stages_ms,
+            **self.fields,
+        }, ensure_ascii=False))
+        for listener in TRACE_LISTENERS:
+            listener(self)
+
+
+class HealthState:
+    """
+    Состояние процесса для проб. Живость - HTTP-сервер отвечает; готовность - завершён
+    прогрев (пулы открыты, данные загружены). Шаги прогрева записываются с длительностью
+    и ошибкой: неудачный шаг не блокирует готовность, но виден в /readyz и в логе.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.ready = False
+        self.warmup_ms: Optional[float] = None
+        self.steps: Dict[str, Dict[str, object]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration_s: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.steps[name] = {"ok": error is None, "ms": round(duration_s * 1000, 1), "error": error}
+
+    def mark_ready(self) -> None:
+        with self._lock:
+            self.ready = True
+            self.warmup_ms = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {"ready": self.ready, "warmup_ms": self.warmup_ms,
+                    "steps": {name: dict(step) for name, step in self.steps.items()}}
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            values: Dict[str, float] = {"ready": int(self.ready), "warmup_ms": self.warmup_ms or 0.0}
+            for name, step in self.steps.items():
+                values[f"{name}_ms"] = step["ms"]
+                values[f"{name}_ok"] = int(step["ok"])
+            return values
+
+
+HEALTH = HealthState()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+    health: HealthState = HEALTH
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self._send(200, self.registry.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/healthz":
+            self._send(200, json.dumps({"alive": True}), "application/json")
+        elif path == "/readyz":
+            snapshot = self.health.snapshot()
+            self._send(200 if snapshot["ready"] else 503, json.dumps(snapshot, ensure_ascii=False),
+                       "application/json; charset=utf-8")
+        else:
+            self.send_error(404)
+
+    def _send(self, status: int, text: str, content_type: str) -> None:
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем лог бота запросами Prometheus
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> Optional[ThreadingHTTPServer]:
+    """Запускает HTTP-сервер /metrics, /healthz, /readyz в фоновом потоке. port=0 - сервер не запускается."""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик на {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics, пробы - /healthz и /readyz")
+    return server
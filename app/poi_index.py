@@ -0,0 +1,148 @@
+"""
+In-memory индекс культурных объектов.
+
+Таблица cultural_objects маленькая (несколько сотен строк), поэтому держим её
+целиком в памяти в виде NumPy-массивов и равномерной сетки по координатам.
+PostGIS остаётся источником истины: индекс загружается из БД при старте и
+перезагружается через reload(). Объекты хранятся как PoiRecord и отдаются
+запросам без копирования.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from poi_record import PoiRecord
+
+logger = logging.getLogger("AI_Travel")
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320.0
+
+
+def haversine_m(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Векторизованное расстояние (в метрах) от точки до массива точек."""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons - lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _Snapshot:
+    """Неизменяемый снимок данных индекса. Подменяется целиком при перезагрузке."""
+    __slots__ = ("ids", "lats", "lons", "category_ids", "records", "cells", "loaded_at")
+
+    def __init__(self, records: List[PoiRecord], cell_size_deg: float):
+        self.records = records
+        self.ids = np.array([r.id for r in records], dtype=np.int64)
+        self.lats = np.array([r.lat for r in records], dtype=np.float64)
+        self.lons = np.array([r.lon for r in records], dtype=np.float64)
+        self.category_ids = np.array([r.category_id if r.category_id is not None else -1 for r in records],
+                                     dtype=np.int64)
+        self.loaded_at = time.time()
+
+        # Сетка: (ячейка по широте, ячейка по долготе) -> индексы объектов
+        buckets: Dict[tuple, List[int]] = {}
+        cell_lat = np.floor(self.lats / cell_size_deg).astype(np.int64)
+        cell_lon = np.floor(self.lons / cell_size_deg).astype(np.int64)
+        for i, key in enumerate(zip(cell_lat.tolist(), cell_lon.tolist())):
+            buckets.setdefault(key, []).append(i)
+        self.cells = {key: np.array(idx, dtype=np.int64) for key, idx in buckets.items()}
+
+
+class PoiIndex:
+    """
+    Пространственный индекс объектов: фильтр по радиусу и категориям + k ближайших.
+    loader отдаёт строки БД (title/latitude/longitude), запросы возвращают PoiRecord.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Dict[str, Any]]], cell_size_deg: float = 0.01):
+        self._loader = loader
+        self._cell_size_deg = cell_size_deg
+        self._snapshot: Optional[_Snapshot] = None
+        self._reload_lock = threading.Lock()
+        self._reload_listeners: List[Callable[[], None]] = []
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    def __len__(self) -> int:
+        return len(self._snapshot.records) if self._snapshot else 0
+
+    def records(self) -> List[PoiRecord]:
+        """Все объекты текущего снимка."""
+        return self._snapshot.records if self._snapshot else []
+
+    def reload(self, rows: Optional[Iterable[Dict[str, Any]]] = None) -> bool:
+        """
+        Перечитывает объекты из источника (или берёт готовые строки rows - например, синтетические
+        объекты нагрузочного теста). Старый снимок продолжает работать до подмены.
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+            try:
+                records = [PoiRecord.from_row(r) for r in (self._loader() if rows is None else rows)
+                           if r.get("latitude") is not None and r.get("longitude") is not None]
+            except Exception as e:
+                logger.error(f"Не удалось загрузить POI-индекс: {e}")
+                return False
+            self._snapshot = _Snapshot(records, self._cell_size_deg)
+            logger.info(f"POI-индекс загружен: {len(records)} объектов за {(time.perf_counter() - started) * 1000:.1f} мс")
+        for callback in self._reload_listeners:
+            callback()
+        return True
+
+    def on_reload(self, callback: Callable[[], None]) -> None:
+        """Регистрирует функцию, вызываемую после каждой успешной перезагрузки (сброс зависимых кэшей)."""
+        self._reload_listeners.append(callback)
+
+    def _candidate_indices(self, snap: _Snapshot, lat: float, lon: float, max_distance_m: float) -> np.ndarray:
+        """Индексы объектов из ячеек сетки, пересекающих bounding box радиуса."""
+        dlat = max_distance_m / METERS_PER_DEG_LAT
+        dlon = max_distance_m / (METERS_PER_DEG_LAT * max(np.cos(np.radians(lat)), 1e-6))
+        lat_from = int(np.floor((lat - dlat) / self._cell_size_deg))
+        lat_to = int(np.floor((lat + dlat) / self._cell_size_deg))
+        lon_from = int(np.floor((lon - dlon) / self._cell_size_deg))
+        lon_to = int(np.floor((lon + dlon) / self._cell_size_deg))
+
+        # Если радиус покрывает больше ячеек, чем есть непустых, дешевле проверить всё
+        if (lat_to - lat_from + 1) * (lon_to - lon_from + 1) >= len(snap.cells):
+            return np.arange(len(snap.records))
+
+        parts = [snap.cells[(i, j)]
+                 for i in range(lat_from, lat_to + 1)
+                 for j in range(lon_from, lon_to + 1)
+                 if (i, j) in snap.cells]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def query(self, start_lat: float, start_lon: float, category_ids: List[int], max_distance_m: float,
+              limit: int = 20) -> List[PoiRecord]:
+        """Возвращает до limit ближайших объектов нужных категорий в пределах max_distance_m."""
+        snap = self._snapshot
+        if snap is None or not snap.records:
+            return []
+
+        idx = self._candidate_indices(snap, start_lat, start_lon, max_distance_m)
+        if idx.size == 0:
+            return []
+        idx = idx[np.isin(snap.category_ids[idx], np.asarray(category_ids, dtype=np.int64))]
+        if idx.size == 0:
+            return []
+
+        distances = haversine_m(start_lat, start_lon, snap.lats[idx], snap.lons[idx])
+        within = distances <= max_distance_m
+        idx, distances = idx[within], distances[within]
+
+        if idx.size > limit:
+            nearest = np.argpartition(distances, limit - 1)[:limit]
+            idx, distances = idx[nearest], distances[nearest]
+        order = np.argsort(distances, kind="stable")
+
+        return [snap.records[i] for i in idx[order].tolist()]
@@ -0,0 +1,100 @@
+"""
+Компактное представление объекта для построения маршрута и ленивые описания.
+
+PoiRecord хранит только то, что нужно решателю и ответу: id, название, координаты,
+категорию и адрес. Записи создаются один раз при загрузке POI-индекса и дальше
+переиспользуются всеми запросами (без копирования словарей на каждый запрос).
+HTML-описания (несколько КБ на объект) из БД на пути поиска не читаются:
+DescriptionCache подгружает их по id, только когда ответ их показывает.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+
+class PoiRecord:
+    __slots__ = ("id", "name", "lat", "lon", "category_id", "address")
+
+    def __init__(self, id: int, name: str, lat: float, lon: float, category_id: Optional[int] = None,
+                 address: Optional[str] = None):
+        self.id = id
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.category_id = category_id
+        self.address = address
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> "PoiRecord":
+        """Из строки БД (title/latitude/longitude)."""
+        return cls(row["id"], row["title"], row["latitude"], row["longitude"],
+                   row.get("category_id"), row.get("address"))
+
+    # Доступ как к словарю: poi["lat"], poi.get("address") - формат прежних dict-объектов маршрута
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"PoiRecord(id={self.id}, name={self.name!r}, lat={self.lat}, lon={self.lon})"
+
+
+def to_poi_records(objects: Iterable[Any]) -> List[PoiRecord]:
+    """Строки БД или уже готовые записи -> список PoiRecord."""
+    return [obj if isinstance(obj, PoiRecord) else PoiRecord.from_row(obj) for obj in objects]
+
+
+class DescriptionCache:
+    """
+    LRU-кэш описаний объектов. loader(ids) -> {id: описание} вызывается только
+    для отсутствующих в кэше id, одним запросом на ответ.
+    """
+
+    def __init__(self, loader: Callable[[List[int]], Dict[int, str]], maxsize: int = 1000):
+        self._loader = loader
+        self.maxsize = maxsize
+        self._data: "OrderedDict[int, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, str]:
+        ids = list(dict.fromkeys(ids))
+        result: Dict[int, str] = {}
+        with self._lock:
+            for poi_id in ids:
+                if poi_id in self._data:
+                    self._data.move_to_end(poi_id)
+                    result[poi_id] = self._data[poi_id]
+            missing = [poi_id for poi_id in ids if poi_id not in result]
+            self.hits += len(result)
+            self.misses += len(missing)
+        if not missing:
+            return result
+
+        loaded = self._loader(missing)
+        with self._lock:
+            for poi_id in missing:
+                # Пустое описание тоже кэшируем, чтобы не спрашивать БД повторно
+                description = loaded.get(poi_id) or ""
+                result[poi_id] = description
+                self._data[poi_id] = description
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,79 @@
+"""
+Сообщение Telegram, которое обновляется по мере улучшения маршрута.
+
+Первый вызов show() отправляет сообщение, следующие - редактируют его, но не чаще
+одного раза за min_interval_s (Telegram ограничивает частоту редактирования).
+Промежуточные версии, пришедшие слишком рано, пропускаются; finish() дожидается
+конца интервала и гарантированно показывает итоговый текст.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger("AI_Travel")
+
+
+class ProgressMessage:
+    def __init__(self, source_message, min_interval_s: float = 1.5, **send_kwargs: Any):
+        self.source_message = source_message
+        self.min_interval_s = min_interval_s
+        self.send_kwargs: Dict[str, Any] = send_kwargs
+        self.message = None
+        self.text: Optional[str] = None
+        self.sent_at = 0.0
+        self.edits = 0
+
+    @property
+    def is_sent(self) -> bool:
+        return self.message is not None
+
+    async def show(self, text: str) -> None:
+        """Промежуточная версия: отправляется или редактируется, если интервал уже прошёл."""
+        if self.message is None:
+            self.message = await self.source_message.reply_text(text, **self.send_kwargs)
+            self.text, self.sent_at = text, time.monotonic()
+            return
+        if text == self.text or time.monotonic() - self.sent_at < self.min_interval_s:
+            return
+        await self._edit(text)
+
+    async def finish(self, text: str) -> None:
+        """Итоговая версия: при необходимости ждёт окончания интервала."""
+        if self.message is None:
+            await self.show(text)
+            return
+        if text == self.text:
+            return
+        for _ in range(2):
+            wait_s = self.min_interval_s - (time.monotonic() - self.sent_at)
+            if wait_s > 0:
+                await asyncio.sleep(wait_s)
+            if await self._edit(text):
+                return
+        # Отредактировать не удалось - отправляем итог отдельным сообщением
+        self.message = None
+        await self.show(text)
+
+    async def _edit(self, text: str) -> bool:
+        try:
+            await self.message.edit_text(text, **self.send_kwargs)
+        except RetryAfter as e:
+            # Превысили лимит: промежуточные версии пропускаем, пока Telegram не разрешит снова
+            retry_s = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            logger.warning(f"Telegram ограничил редактирование сообщения на {retry_s} с")
+            # Следующая попытка - не раньше, чем через retry_s
+            self.sent_at = time.monotonic() + retry_s - self.min_interval_s
+            return False
+        except BadRequest as e:
+            # "Message is not modified" - текст на экране уже актуален; остальное - неудача
+            logger.info(f"Сообщение не отредактировано: {e}")
+            return "not modified" in str(e).lower()
+        except TelegramError as e:
+            logger.warning(f"Не удалось отредактировать сообщение: {e}")
+            return False
+        self.text, self.sent_at = text, time.monotonic()
+        self.edits += 1
+        return True
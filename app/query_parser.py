@@ -0,0 +1,193 @@
+"""
+Быстрый разбор текстовых запросов без обращения к LLM.
+
+QueryParser сначала ищет запрос в кэше (по нормализованному тексту), затем
+пробует локальный разбор по правилам. Если локальный разбор не уверен,
+вызывающий код идёт в LLM и сохраняет её ответ в кэш через store().
+Результат всегда в том же JSON-формате, что и ответ LLM из create_prompt.
+"""
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Ключевые слова для способов передвижения: основы (совпадение с начала слова) или регулярные
+# выражения. Короткие основы, которые являются началом других слов ("авто" - "автобус",
+# "сад" - "садик"), заданы с перечнем окончаний и границей слова.
+TRAVEL_MODE_KEYWORDS = {
+    "пеший": ("пешком", "пеший", "пешая", "пешочком", "прогул", "погулять", "гулять", "пройтись"),
+    "автомобиль": ("машин", "автомобил", r"авто\b", "на тачке"),
+    "велосипед": ("велосипед", r"велик(?:а|е|у|ом|и)?\b", "вело"),
+    "электросамокат": ("самокат",),
+}
+
+# Ключевые слова для интересов (в том же формате); значения совпадают с допустимыми в create_prompt
+INTEREST_KEYWORDS = {
+    "парки и природа": (r"парк(?:а|у|е|ом|и|ов|ам|ами|ах)?\b", "сквер", "природ",
+                        r"лес(?:а|у|е|ом|ов|ам|ами|ах|н\w*)?\b", r"сад(?:а|у|е|ом|ы|ов|ам|ами|ах)?\b",
+                        "набережн", "зелен"),
+    "историческая достопримечательность": ("истор", "старин", "кремл", "усадьб", "достопримечат", "архитектур"),
+    "искусство": ("искусств", "музе", "галере", "театр", "выставк"),
+    "религия": ("церк", "храм", "собор", "монастыр", "религ", "мечет"),
+    "памятники": ("памятник", "монумент", "скульптур", "мемориал"),
+    "город": (r"город(?:а|у|е|ом|ов|ам|ами|ах|ск\w*)?\b",),
+}
+
+NUMBER_WORDS = {
+    "один": 1, "одну": 1, "два": 2, "две": 2, "три": 3, "четыре": 4, "пять": 5, "шесть": 6,
+    "десять": 10, "пятнадцать": 15, "двадцать": 20, "тридцать": 30, "сорок": 40, "пятьдесят": 50,
+}
+
+_NUMBER = r"(\d+(?:[.,]\d+)?|" + "|".join(NUMBER_WORDS) + r")"
+_HOURS_RE = re.compile(_NUMBER + r"\s*(?:час|ч\b)")
+_MINUTES_RE = re.compile(_NUMBER + r"\s*(?:минут|мин\b)")
+_KM_RE = re.compile(_NUMBER + r"\s*(?:км|килом)")
+# Признаки, при которых локальный разбор не уверен: отрицания и точка старта в тексте
+_UNSURE_RE = re.compile(r"\b(?:не|без|кроме|от|из|возле|около|рядом)\b")
+# Транспорт, которого нет среди способов передвижения: решать, на что его заменить, оставляем LLM
+_UNKNOWN_TRANSPORT_RE = re.compile(r"\b(?:автобус|метро|такси|трамва|троллейбус|маршрутк|электричк|поезд)")
+
+
+# Поля ответа LLM (структура JSON из create_prompt): числовые и строковые
+NUMBER_FIELDS = ("distance_km", "duration_minutes")
+TEXT_FIELDS = ("start_location", "travel_mode", "interests")
+
+
+def normalize_query(query: str) -> str:
+    """Нормализует текст запроса для ключа кэша."""
+    text = query.lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s.,]", " ", text)
+    return re.sub(r"\s+", " ", text).strip(" .,")
+
+
+def _to_number(token: str) -> float:
+    if token in NUMBER_WORDS:
+        return NUMBER_WORDS[token]
+    return float(token.replace(",", "."))
+
+
+def _parse_duration(text: str) -> Optional[int]:
+    minutes = 0.0
+    found = False
+    match = _HOURS_RE.search(text)
+    if match:
+        minutes += _to_number(match.group(1)) * 60
+        found = True
+    elif "полтора час" in text:
+        minutes += 90
+        found = True
+    elif "полчаса" in text:
+        minutes += 30
+        found = True
+    elif re.search(r"\b(?:час|часик|часок)\b", text):
+        minutes += 60
+        found = True
+    match = _MINUTES_RE.search(text)
+    if match:
+        minutes += _to_number(match.group(1))
+        found = True
+    return int(round(minutes)) if found and minutes > 0 else None
+
+
+def _parse_distance(text: str) -> Optional[int]:
+    match = _KM_RE.search(text)
+    if not match:
+        return None
+    return int(round(_to_number(match.group(1))))
+
+
+def _find_keywords(text: str, mapping: Dict[str, tuple]) -> List[str]:
+    return [name for name, stems in mapping.items()
+            if any(re.search(r"\b" + stem, text) for stem in stems)]
+
+
+def parse_query_locally(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Разбирает запрос по правилам. Возвращает словарь в формате ответа LLM,
+    если однозначно определены способ передвижения, время или расстояние и интересы;
+    иначе None (нужен LLM).
+    """
+    text = normalize_query(query)
+    if not text or _UNSURE_RE.search(text) or _UNKNOWN_TRANSPORT_RE.search(text):
+        return None
+
+    modes = _find_keywords(text, TRAVEL_MODE_KEYWORDS)
+    interests = _find_keywords(text, INTEREST_KEYWORDS)
+    duration = _parse_duration(text)
+    distance = _parse_distance(text)
+
+    if len(modes) != 1 or not interests or (duration is None and distance is None):
+        return None
+
+    return {
+        "start_location": None,
+        "distance_km": distance,
+        "duration_minutes": duration,
+        "travel_mode": modes[0],
+        "interests": ", ".join(interests),
+    }
+
+
+def is_valid_params(params: Any) -> bool:
+    """Объект в формате ответа LLM: все поля на месте, числа неотрицательны, остальное - строки или null."""
+    if not isinstance(params, dict) or any(field not in params for field in NUMBER_FIELDS + TEXT_FIELDS):
+        return False
+    for field in NUMBER_FIELDS:
+        value = params[field]
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            return False
+    return all(params[field] is None or isinstance(params[field], str) for field in TEXT_FIELDS)
+
+
+class QueryParser:
+    """Кэш разобранных запросов (LRU + TTL) и локальный разбор перед обращением к LLM."""
+
+    def __init__(self, maxsize: int = 10_000, ttl_s: float = 24 * 3600, local_parser_enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.local_parser_enabled = local_parser_enabled
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"cache_hits": 0, "cache_misses": 0, "local_hits": 0, "llm_fallbacks": 0}
+
+    def lookup(self, query: str) -> Optional[str]:
+        """JSON-ответ из кэша или локального разбора; None - нужно обратиться к LLM."""
+        key = normalize_query(query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                self._data.move_to_end(key)
+                self.counters["cache_hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.counters["cache_misses"] += 1
+
+        if self.local_parser_enabled:
+            parsed = parse_query_locally(query)
+            if parsed is not None:
+                result = json.dumps(parsed, ensure_ascii=False)
+                self.store(query, result)
+                with self._lock:
+                    self.counters["local_hits"] += 1
+                return result
+
+        with self._lock:
+            self.counters["llm_fallbacks"] += 1
+        return None
+
+    def store(self, query: str, llm_output_json: str) -> None:
+        """Сохраняет (уже очищенный и проверенный) JSON-ответ для запроса."""
+        key = normalize_query(query)
+        with self._lock:
+            self._data[key] = (llm_output_json, time.monotonic() + self.ttl_s)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters, size=len(self._data))
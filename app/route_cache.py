@@ -0,0 +1,114 @@
+"""
+Кэш готовых маршрутов для похожих запросов из одного места города.
+
+Ключ: ячейка geohash точки старта, способ передвижения, корзина длительности
+и отсортированный набор категорий. Попадание проверяется: путь от новой точки
+старта до первого объекта (и обратно) оценивается сверху как закэшированный
+участок плюс расстояние между точками старта с коэффициентом извилистости
+(неравенство треугольника), без обращения к OSRM;
+если маршрут перестаёт укладываться во время пользователя, это промах.
+
+Вытеснение - LRU; clear() вызывается при перезагрузке объектов (POI-индекс).
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+_EARTH_RADIUS_M = 6_371_000
+
+
+def geohash(lat: float, lon: float, precision: int = 7) -> str:
+    """Geohash точки; precision=7 - ячейка около 150x150 м."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            rng[0] = middle
+        else:
+            rng[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+
+def route_cache_key(lat: float, lon: float, mode: str, duration_minutes: float, category_ids: Sequence[int],
+                    precision: int = 7, bucket_minutes: int = 15, extra: Hashable = None) -> Tuple:
+    return (geohash(lat, lon, precision), mode, int(duration_minutes // bucket_minutes),
+            tuple(sorted(set(category_ids))), extra)
+
+
+class RouteResultCache:
+    def __init__(self, maxsize: int = 5000, detour_factor: float = 1.3):
+        self.maxsize = maxsize
+        self.detour_factor = detour_factor
+        # ключ -> (старт, POI маршрута, время в пути, учтён ли путь обратно в старт)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, start: Tuple[float, float], max_time_s: float, visit_time_s: float,
+            speed_m_s: float) -> Optional[Tuple[List[Dict[str, Any]], float]]:
+        """
+        Возвращает (POI маршрута, время в пути в сек) для нового старта или None.
+        None - маршрута нет в кэше или маршрут от нового старта не укладывается в max_time_s.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+
+        cached_start, pois, travel_s, with_return = entry
+        shift_s = _distance_m(start, cached_start) * self.detour_factor / speed_m_s
+        new_travel_s = travel_s + shift_s * (2 if with_return else 1)
+        if new_travel_s + len(pois) * visit_time_s > max_time_s:
+            with self._lock:
+                self.rejected += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return list(pois), new_travel_s
+
+    def put(self, key: Hashable, start: Tuple[float, float], pois: List[Dict[str, Any]], travel_s: float,
+            with_return: bool = True) -> None:
+        if not pois:
+            return
+        with self._lock:
+            self._data[key] = (start, list(pois), travel_s, with_return)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                    "rejected": self.rejected, "invalidations": self.invalidations}
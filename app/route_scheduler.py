@@ -0,0 +1,222 @@
+"""
+Планировщик построения маршрутов: допуск запросов перед LLM, БД и OSRM.
+
+- ограниченный пул исполнителей: одновременно строится не больше workers маршрутов,
+  остальные ждут в очереди (FIFO) длиной не больше max_queue;
+- лимит на пользователя (token bucket): rate_per_min запросов в минуту, всплеск до burst;
+- повторная геолокация того же пользователя рядом с уже ожидающей или строящейся
+  (в пределах duplicate_radius_m, с тем же запросом) не ставится в очередь второй раз;
+- submit() сразу сообщает позицию в очереди, чтобы бот мог ответить "вы в очереди, позиция N".
+
+Время ожидания в очереди и отказы публикуются в метриках.
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from metrics import REGISTRY, Counter, Histogram
+
+logger = logging.getLogger("AI_Travel")
+
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "ai_travel_route_queue_wait_seconds", "Ожидание в очереди на построение маршрута"))
+REJECTIONS_TOTAL = REGISTRY.register(Counter(
+    "ai_travel_route_rejections_total", "Запросы маршрута, не допущенные в очередь", ["reason"]))
+
+# Результаты submit()
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+RATE_LIMITED = "rate_limited"
+QUEUE_FULL = "queue_full"
+
+
+def _distance_m(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6_371_000 * math.asin(math.sqrt(h))
+
+
+class TokenBucket:
+    """rate_per_s токенов в секунду, не больше capacity; один запрос - один токен."""
+    __slots__ = ("rate_per_s", "capacity", "tokens", "updated")
+
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_s)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after_s(self) -> float:
+        """Через сколько секунд появится следующий токен."""
+        return max(0.0, (1 - self.tokens) / self.rate_per_s) if self.rate_per_s > 0 else math.inf
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Admission:
+    """Решение о допуске: status - одна из констант выше; position - 0, если маршрут строится сразу."""
+    __slots__ = ("status", "position", "retry_after_s")
+
+    def __init__(self, status: str, position: int = 0, retry_after_s: float = 0.0):
+        self.status = status
+        self.position = position
+        self.retry_after_s = retry_after_s
+
+    @property
+    def accepted(self) -> bool:
+        return self.status == ACCEPTED
+
+
+class _Job:
+    __slots__ = ("user_id", "location", "query", "run", "enqueued_at")
+
+    def __init__(self, user_id: Hashable, location: Tuple[float, float], query: Optional[str],
+                 run: Callable[[float], Awaitable[None]]):
+        self.user_id = user_id
+        self.location = location
+        self.query = query
+        self.run = run
+        self.enqueued_at = time.perf_counter()
+
+
+class RouteScheduler:
+    def __init__(self, workers: int = 8, max_queue: int = 100, rate_per_min: float = 3.0, burst: int = 3,
+                 duplicate_radius_m: float = 100.0, max_tracked_users: int = 10_000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rate_per_s = rate_per_min / 60
+        self.burst = burst
+        self.duplicate_radius_m = duplicate_radius_m
+        self.max_tracked_users = max_tracked_users
+        self._queue: Optional["asyncio.Queue[_Job]"] = None
+        self._tasks: List[asyncio.Task] = []
+        self._idle = 0
+        self._buckets: Dict[Hashable, TokenBucket] = {}
+        # пользователь -> его ожидающие и строящиеся запросы (для отсева повторов)
+        self._active: Dict[Hashable, List[_Job]] = {}
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected: Dict[str, int] = {DUPLICATE: 0, RATE_LIMITED: 0, QUEUE_FULL: 0}
+
+    def _ensure_started(self) -> None:
+        # Исполнители создаются в работающем event loop при первом запросе
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._idle = self.workers
+        self._tasks = [asyncio.create_task(self._worker(i), name=f"route-worker-{i}") for i in range(self.workers)]
+
+    async def close(self) -> None:
+        """Останавливает исполнителей; запросы, оставшиеся в очереди, отбрасываются."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._idle = 0
+        if self._queue is not None and self._queue.qsize():
+            logger.warning(f"Остановка планировщика: отброшено {self._queue.qsize()} запросов из очереди")
+        self._queue = None
+        self._active.clear()
+
+    def _reject(self, reason: str, retry_after_s: float = 0.0) -> Admission:
+        self.rejected[reason] += 1
+        REJECTIONS_TOTAL.inc(reason=reason)
+        return Admission(reason, retry_after_s=retry_after_s)
+
+    def _is_duplicate(self, user_id: Hashable, location: Tuple[float, float], query: Optional[str]) -> bool:
+        for job in self._active.get(user_id, ()):
+            if (query is None or query == job.query) and \
+                    _distance_m(location, job.location) <= self.duplicate_radius_m:
+                return True
+        return False
+
+    def _bucket(self, user_id: Hashable) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_tracked_users:
+                # Полные корзины ничем не отличаются от новых - их можно забыть
+                now = time.monotonic()
+                self._buckets = {key: b for key, b in self._buckets.items() if not b.is_full(now)}
+            bucket = self._buckets[user_id] = TokenBucket(self.rate_per_s, self.burst)
+        return bucket
+
+    def submit(self, user_id: Hashable, location: Tuple[float, float], query: Optional[str],
+               run: Callable[[float], Awaitable[None]]) -> Admission:
+        """
+        Ставит построение маршрута в очередь. run(queue_wait_s) выполняется исполнителем.
+        query=None - запрос не известен (повтором считается любая близкая геолокация).
+        Вызывается из event loop; проверки и постановка в очередь выполняются без await.
+        """
+        self._ensure_started()
+        if self._is_duplicate(user_id, location, query):
+            return self._reject(DUPLICATE)
+        if self._waiting() >= self.max_queue:
+            return self._reject(QUEUE_FULL)
+        bucket = self._bucket(user_id)
+        if not bucket.take():
+            return self._reject(RATE_LIMITED, bucket.retry_after_s())
+
+        job = _Job(user_id, location, query, run)
+        self._queue.put_nowait(job)
+        self._active.setdefault(user_id, []).append(job)
+        self.submitted += 1
+        return Admission(ACCEPTED, self._waiting())
+
+    def _waiting(self) -> int:
+        # Свободные исполнители разберут первые задачи очереди сразу - они уже не ждут
+        return max(0, self._queue.qsize() - self._idle)
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            job = await self._queue.get()
+            self._idle -= 1
+
+            wait_s = time.perf_counter() - job.enqueued_at
+            QUEUE_WAIT_SECONDS.observe(wait_s)
+            self.running += 1
+            try:
+                await job.run(wait_s)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка построения маршрута в исполнителе {number}: {e}", exc_info=True)
+            finally:
+                self.running -= 1
+                self._idle += 1
+                jobs = self._active.get(job.user_id)
+                if jobs is not None:
+                    jobs.remove(job)
+                    if not jobs:
+                        del self._active[job.user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._waiting() if self._queue is not None else 0,
+            "running": self.running,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected_duplicate": self.rejected[DUPLICATE],
+            "rejected_rate_limited": self.rejected[RATE_LIMITED],
+            "rejected_queue_full": self.rejected[QUEUE_FULL],
+        }
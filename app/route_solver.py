@@ -0,0 +1,281 @@
+"""
+Решатели задачи ориентирования (orienteering problem) с ограничением по времени.
+
+Задача: из точки старта (индекс 0 матрицы) посетить как можно больше POI
+(индексы 1..N) так, чтобы время в пути + время на посещения не превышало
+бюджет. При равном числе точек лучше маршрут с меньшим временем в пути.
+
+Все решатели работают с NumPy-матрицей времени в секундах; недоступные
+пары (null от OSRM) задаются как inf.
+
+Доступные решатели (SOLVERS):
+- "greedy"    - ближайший сосед (как прежний _greedy_route_with_matrix, но без падений на null);
+- "insertion" - жадная вставка с минимальным приростом времени + 2-opt / or-opt;
+- "ils"       - iterated local search поверх "insertion" с ограничением по wall-clock времени.
+"""
+import random
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def prepare_matrix(raw_matrix: Sequence[Sequence[Optional[float]]], coefficient: float = 1.0,
+                   return_to_start: bool = True) -> np.ndarray:
+    """
+    Переводит матрицу OSRM (списки, null для недоступных пар) в float64 NumPy-матрицу.
+    Готовая NumPy-матрица (разреженная, inf - нет ребра) копируется.
+    Если возвращаться в старт не нужно, обратный путь в точку 0 считается бесплатным.
+    """
+    if isinstance(raw_matrix, np.ndarray):
+        matrix = raw_matrix.astype(np.float64, copy=True)
+    else:
+        matrix = np.array([[np.inf if v is None else v for v in row] for row in raw_matrix], dtype=np.float64)
+    matrix *= coefficient
+    np.fill_diagonal(matrix, 0.0)
+    if not return_to_start:
+        matrix[:, 0] = 0.0
+    return matrix
+
+
+def tour_cost(matrix: np.ndarray, route: Sequence[int]) -> float:
+    """Время в пути по замкнутому туру 0 -> route -> 0."""
+    if not route:
+        return 0.0
+    tour = np.fromiter((0, *route, 0), dtype=np.int64)
+    return float(matrix[tour[:-1], tour[1:]].sum())
+
+
+def _is_better(count_a: int, cost_a: float, count_b: int, cost_b: float) -> bool:
+    return count_a > count_b or (count_a == count_b and cost_a < cost_b - 1e-9)
+
+
+# --- Построение начального маршрута ---
+
+def solve_greedy(matrix: np.ndarray, visit_time_s: float, max_time_s: float) -> List[int]:
+    """Ближайший сосед: идём в ближайшую точку, пока с возвратом укладываемся в бюджет."""
+    n = matrix.shape[0]
+    remaining = np.ones(n, dtype=bool)
+    remaining[0] = False
+    route: List[int] = []
+    current, spent = 0, 0.0
+    while remaining.any():
+        candidates = np.flatnonzero(remaining)
+        travel = matrix[current, candidates]
+        total = spent + travel + visit_time_s + matrix[candidates, 0]
+        feasible = np.isfinite(total) & (total <= max_time_s)
+        if not feasible.any():
+            break
+        choice = candidates[feasible][np.argmin(travel[feasible])]
+        spent += matrix[current, choice] + visit_time_s
+        route.append(int(choice))
+        remaining[choice] = False
+        current = int(choice)
+    return route
+
+
+def insert_greedily(matrix: np.ndarray, route: List[int], visit_time_s: float, max_time_s: float,
+                    allowed: Optional[np.ndarray] = None) -> List[int]:
+    """
+    Вставляет непосещённые точки по одной в позицию с минимальным приростом времени,
+    пока это возможно в рамках бюджета.
+    """
+    n = matrix.shape[0]
+    route = list(route)
+    unvisited = np.ones(n, dtype=bool) if allowed is None else allowed.copy()
+    unvisited[0] = False
+    unvisited[route] = False
+    cost = tour_cost(matrix, route)
+
+    while unvisited.any():
+        budget_left = max_time_s - cost - (len(route) + 1) * visit_time_s
+        if budget_left < 0:
+            break
+        candidates = np.flatnonzero(unvisited)
+        tour = np.array([0, *route, 0], dtype=np.int64)
+        prev_nodes, next_nodes = tour[:-1], tour[1:]
+        # delta[позиция, кандидат] = T[a, p] + T[p, b] - T[a, b]
+        delta = (matrix[np.ix_(prev_nodes, candidates)] + matrix[np.ix_(candidates, next_nodes)].T
+                 - matrix[prev_nodes, next_nodes][:, None])
+        delta = np.where(np.isfinite(delta), delta, np.inf)
+        position, k = np.unravel_index(np.argmin(delta), delta.shape)
+        if not np.isfinite(delta[position, k]) or delta[position, k] > budget_left:
+            break
+        poi = int(candidates[k])
+        route.insert(int(position), poi)
+        cost += float(delta[position, k])
+        unvisited[poi] = False
+    return route
+
+
+# --- Локальный поиск ---
+
+def two_opt(matrix: np.ndarray, route: List[int]) -> List[int]:
+    """2-opt для асимметричной матрицы: разворот отрезка, если это сокращает тур."""
+    route = list(route)
+    if len(route) < 2:
+        return route
+    while True:
+        tour = np.array([0, *route, 0], dtype=np.int64)
+        m = len(tour)
+        forward = matrix[tour[:-1], tour[1:]]
+        backward = matrix[tour[1:], tour[:-1]]
+        # Недоступные рёбра считаем отдельно, чтобы inf не портил префиксные суммы
+        pf = np.concatenate(([0.0], np.cumsum(np.where(np.isfinite(forward), forward, 0.0))))
+        pb = np.concatenate(([0.0], np.cumsum(np.where(np.isfinite(backward), backward, 0.0))))
+        pb_inf = np.concatenate(([0], np.cumsum(~np.isfinite(backward))))
+        # Разворачиваем tour[i..j], 1 <= i < j <= m - 2
+        i_idx, j_idx = np.triu_indices(m - 1, k=1)
+        mask = i_idx >= 1
+        i_idx, j_idx = i_idx[mask], j_idx[mask]
+        if i_idx.size == 0:
+            return route
+        old = forward[i_idx - 1] + forward[j_idx] + (pf[j_idx] - pf[i_idx])
+        new = matrix[tour[i_idx - 1], tour[j_idx]] + matrix[tour[i_idx], tour[j_idx + 1]] + (pb[j_idx] - pb[i_idx])
+        new = np.where(pb_inf[j_idx] - pb_inf[i_idx] > 0, np.inf, new)
+        with np.errstate(invalid="ignore"):
+            gain = old - new
+        gain = np.where(np.isfinite(gain), gain, -np.inf)
+        best = int(np.argmax(gain))
+        if gain[best] <= 1e-9:
+            return route
+        i, j = int(i_idx[best]), int(j_idx[best])
+        # Позиции в туре сдвинуты на 1 относительно route
+        route[i - 1:j] = route[i - 1:j][::-1]
+
+
+def or_opt(matrix: np.ndarray, route: List[int], max_segment: int = 3) -> List[int]:
+    """Or-opt: перенос отрезка из 1..max_segment точек в другую позицию без разворота."""
+    if len(route) < 2:
+        return list(route)
+    # Работаем с подматрицей только по точкам маршрута (локальные индексы, 0 - старт)
+    nodes = [0, *route]
+    t = matrix[np.ix_(nodes, nodes)].tolist()
+    route = list(range(1, len(nodes)))
+    improved = True
+    while improved:
+        improved = False
+        tour = [0, *route, 0]
+        m = len(tour)
+        for seg_len in range(1, min(max_segment, len(route) - 1) + 1):
+            for i in range(1, m - seg_len):
+                j = i + seg_len - 1
+                prev_node, next_node, first, last = tour[i - 1], tour[j + 1], tour[i], tour[j]
+                removal_gain = t[prev_node][first] + t[last][next_node] - t[prev_node][next_node]
+                for k in range(m - 1):
+                    if i - 1 <= k <= j:
+                        continue
+                    a, b = tour[k], tour[k + 1]
+                    insertion_cost = t[a][first] + t[last][b] - t[a][b]
+                    if insertion_cost < removal_gain - 1e-9:
+                        segment = tour[i:j + 1]
+                        rest = tour[:i] + tour[j + 1:]
+                        pos = k + 1 if k < i else k + 1 - seg_len
+                        tour = rest[:pos] + segment + rest[pos:]
+                        route = tour[1:-1]
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return [nodes[i] for i in route]
+
+
+def local_search(matrix: np.ndarray, route: List[int]) -> List[int]:
+    route = two_opt(matrix, route)
+    route = or_opt(matrix, route)
+    return route
+
+
+def _feasible(matrix: np.ndarray, route: Sequence[int], visit_time_s: float, max_time_s: float) -> bool:
+    return tour_cost(matrix, route) + len(route) * visit_time_s <= max_time_s + 1e-6
+
+
+def solve_insertion(matrix: np.ndarray, visit_time_s: float, max_time_s: float) -> List[int]:
+    """Жадная вставка, затем локальный поиск и повторная попытка вставки на освободившееся время."""
+    route = insert_greedily(matrix, [], visit_time_s, max_time_s)
+    while True:
+        improved = local_search(matrix, route)
+        extended = insert_greedily(matrix, improved, visit_time_s, max_time_s)
+        if len(extended) == len(route):
+            return improved
+        route = extended
+
+
+def solve_ils(matrix: np.ndarray, visit_time_s: float, max_time_s: float, time_budget_s: float = 0.05,
+              seed: int = 0, on_improvement: Optional[Callable[[List[int]], None]] = None,
+              max_stall: int = 200) -> List[int]:
+    """
+    Iterated local search: стартуем с лучшего из "greedy" и "insertion", затем в пределах
+    time_budget_s удаляем случайные точки, снова вставляем и улучшаем локальным поиском.
+    Поиск останавливается раньше, если за max_stall итераций лучший маршрут не улучшился
+    (0 - только по бюджету): большой бюджет anytime-режима не тратится на застрявший поиск.
+    """
+    deadline = time.perf_counter() + time_budget_s
+    rng = random.Random(seed)
+
+    candidates = [solve_greedy(matrix, visit_time_s, max_time_s), solve_insertion(matrix, visit_time_s, max_time_s)]
+    candidates = [local_search(matrix, r) for r in candidates]
+    best = max(candidates, key=lambda r: (len(r), -tour_cost(matrix, r)))
+    best_cost = tour_cost(matrix, best)
+    if on_improvement is not None:
+        on_improvement(list(best))
+
+    current, current_cost = list(best), best_cost
+    n_pois = matrix.shape[0] - 1
+    stall = 0
+    while time.perf_counter() < deadline and current and len(best) < n_pois:
+        if max_stall and stall >= max_stall:
+            break
+        stall += 1
+        # Возмущение: убираем 1..3 случайные точки (или отрезок) и заново заполняем маршрут
+        perturbed = list(current)
+        k = rng.randint(1, min(3, len(perturbed)))
+        if rng.random() < 0.5:
+            for _ in range(k):
+                perturbed.pop(rng.randrange(len(perturbed)))
+        else:
+            start = rng.randrange(len(perturbed) - k + 1)
+            del perturbed[start:start + k]
+        banned = set(current) - set(perturbed)
+        allowed = np.ones(matrix.shape[0], dtype=bool)
+        allowed[list(banned)] = False
+        perturbed = insert_greedily(matrix, local_search(matrix, perturbed), visit_time_s, max_time_s, allowed)
+        perturbed = insert_greedily(matrix, local_search(matrix, perturbed), visit_time_s, max_time_s)
+        perturbed = local_search(matrix, perturbed)
+        if not _feasible(matrix, perturbed, visit_time_s, max_time_s):
+            continue
+        cost = tour_cost(matrix, perturbed)
+
+        if _is_better(len(perturbed), cost, len(current), current_cost) or rng.random() < 0.05:
+            current, current_cost = perturbed, cost
+        if _is_better(len(current), current_cost, len(best), best_cost):
+            best, best_cost = list(current), current_cost
+            stall = 0
+            if on_improvement is not None:
+                on_improvement(list(best))
+    return best
+
+
+SOLVERS: Dict[str, Callable[..., List[int]]] = {
+    "greedy": solve_greedy,
+    "insertion": solve_insertion,
+    "ils": solve_ils,
+}
+
+
+def solve(matrix: np.ndarray, visit_time_s: float, max_time_s: float, solver: str = "ils",
+          time_budget_s: float = 0.05, **kwargs) -> Tuple[List[int], float]:
+    """
+    Решает задачу выбранным решателем.
+    Возвращает индексы POI в матрице (1..N) в порядке обхода и время в пути (сек).
+    """
+    if matrix.shape[0] <= 1:
+        return [], 0.0
+    solver_fn = SOLVERS.get(solver, solve_ils)
+    if solver_fn is solve_ils:
+        route = solve_ils(matrix, visit_time_s, max_time_s, time_budget_s=time_budget_s, **kwargs)
+    else:
+        route = solver_fn(matrix, visit_time_s, max_time_s)
+    return route, tour_cost(matrix, route)
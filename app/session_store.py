@@ -0,0 +1,151 @@
+"""
+Хранилище сессий пользователей (текстовый запрос между сообщением и геолокацией).
+
+Один интерфейс SessionStore и две реализации:
+- InMemorySessionStore - LRU + TTL в памяти процесса (по умолчанию);
+- RedisSessionStore    - Redis-совместимый сервер, общий для нескольких реплик бота.
+  Принимает любой асинхронный клиент с методами get/set/getdel/delete
+  (redis.asyncio.Redis или локальная заглушка в тестах).
+
+Значения сессий - JSON-сериализуемые словари.
+"""
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class SessionStore(ABC):
+    @abstractmethod
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def set(self, user_id: int, session: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def pop(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Возвращает и удаляет сессию."""
+
+    @abstractmethod
+    async def delete(self, user_id: int) -> None:
+        ...
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Ограниченное по размеру хранилище: самые старые сессии вытесняются, просроченные удаляются."""
+
+    def __init__(self, maxsize: int = 100_000, ttl_s: float = 3600):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def _get_alive(self, user_id: int, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._data.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._data[user_id]
+            self.expired += 1
+            return None
+        return entry[0]
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get_alive(user_id, time.monotonic())
+
+    async def set(self, user_id: int, session: Dict[str, Any]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._data[user_id] = (session, now + self.ttl_s)
+            self._data.move_to_end(user_id)
+            # Сначала выбрасываем просроченные с "хвоста", затем - самые старые сверх лимита
+            while self._data:
+                oldest_id, (_, expires_at) = next(iter(self._data.items()))
+                if expires_at > now:
+                    break
+                del self._data[oldest_id]
+                self.expired += 1
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evicted += 1
+
+    async def pop(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._get_alive(user_id, time.monotonic())
+            if session is not None:
+                del self._data[user_id]
+            return session
+
+    async def delete(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "evicted": self.evicted, "expired": self.expired}
+
+
+class RedisSessionStore(SessionStore):
+    """Сессии в Redis: TTL задаётся самим Redis (SET ... EX)."""
+
+    def __init__(self, client, ttl_s: float = 3600, prefix: str = "ai_travel:session:"):
+        self.client = client
+        self.ttl_s = int(ttl_s)
+        self.prefix = prefix
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    @staticmethod
+    def _decode(raw) -> Optional[Dict[str, Any]]:
+        if raw is None:
+            return None
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        return json.loads(raw)
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self._decode(await self.client.get(self._key(user_id)))
+
+    async def set(self, user_id: int, session: Dict[str, Any]) -> None:
+        await self.client.set(self._key(user_id), json.dumps(session, ensure_ascii=False), ex=self.ttl_s)
+
+    async def pop(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return self._decode(await self.client.getdel(self._key(user_id)))
+
+    async def delete(self, user_id: int) -> None:
+        await self.client.delete(self._key(user_id))
+
+    async def close(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+
+def create_session_store(url: str, ttl_s: float, maxsize: int) -> SessionStore:
+    """
+    Создаёт хранилище по URL: пусто или "memory://" - в памяти процесса,
+    "redis://..." - Redis (нужен пакет redis: pip install redis).
+    """
+    if not url or url.startswith("memory://"):
+        return InMemorySessionStore(maxsize=maxsize, ttl_s=ttl_s)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("Для SESSION_STORE_URL=redis://... установите пакет redis") from e
+        return RedisSessionStore(redis_asyncio.from_url(url), ttl_s=ttl_s)
+    raise ValueError(f"Неизвестный тип хранилища сессий: {url}")
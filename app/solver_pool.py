@@ -0,0 +1,253 @@
+"""
+Пул процессов для решателя маршрутов.
+
+Решатель - чистая работа CPU (NumPy и циклы Python): в event loop бота он задерживает
+все чаты, а потоки упираются в GIL. SolverPool держит workers долгоживущих процессов,
+поэтому пропускная способность решателя растёт с числом ядер.
+
+- Матрица передаётся через shared memory: родитель копирует её в сегмент один раз,
+  процесс читает её без копирования; по каналу уходят только имя сегмента, форма и параметры.
+- У каждой задачи есть дедлайн (бюджет решателя + запас): если процесс не ответил вовремя
+  или задача отменена, процесс завершается и при следующей задаче заменяется новым,
+  а вызывающий получает SolverTimeout / CancelledError.
+- Промежуточные маршруты (anytime-режим) передаются из процесса по тому же каналу.
+
+Процессы создаются через forkserver (spawn там, где его нет): fork из процесса с event loop
+и потоками небезопасен. Модуль запуска бота при этом импортируется в каждом процессе
+заново (как __mp_main__), поэтому процессы лучше запускать заранее - start() при прогреве.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from route_solver import solve
+
+logger = logging.getLogger("AI_Travel")
+
+
+class SolverError(RuntimeError):
+    """Задача не решена в процессе пула (процесс упал или решатель бросил исключение)."""
+
+
+class SolverTimeout(SolverError):
+    """Задача не уложилась в дедлайн (включая ожидание свободного процесса)."""
+
+
+# --- Процесс пула ---
+
+def _worker_main(conn) -> None:
+    # Ctrl+C получает родитель и сам останавливает пул
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    conn.send(("ready", os.getpid()))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        name, shape, visit_time_s, max_time_s, solver, time_budget_s, progress = job
+        # Сегментом владеет родитель и сам его удаляет; resource_tracker у процессов пула общий с ним
+        shm = SharedMemory(name=name)
+        try:
+            matrix = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            kwargs = {"on_improvement": lambda route: conn.send(("progress", route))} if progress else {}
+            route, cost = solve(matrix, visit_time_s, max_time_s, solver=solver, time_budget_s=time_budget_s,
+                                **kwargs)
+            del matrix
+            conn.send(("done", route, cost))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+        finally:
+            shm.close()
+
+
+class _Worker:
+    __slots__ = ("process", "conn")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def stop(self) -> None:
+        """Немедленно завершает процесс (задача могла зависнуть - ждать её нельзя)."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+# --- Пул ---
+
+class SolverPool:
+    def __init__(self, workers: int, deadline_grace_s: float = 1.0, start_method: Optional[str] = None):
+        self.workers = workers
+        self.deadline_grace_s = deadline_grace_s
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(start_method)
+        # None - место процесса, который ещё не запущен или был завершён по дедлайну
+        self._idle: Deque[Optional[_Worker]] = deque([None] * workers)
+        self._lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.busy = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.restarts = 0
+        self.started_processes = 0
+
+    def _spawn(self) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker_main, args=(child_conn,), name="route-solver", daemon=True)
+        process.start()
+        child_conn.close()
+        with self._lock:
+            self.started_processes += 1
+        return _Worker(process, parent_conn)
+
+    @staticmethod
+    def _await_ready(worker: _Worker, timeout_s: float = 60.0) -> None:
+        try:
+            if worker.conn.poll(timeout_s):
+                worker.conn.recv()
+                return
+        except (EOFError, OSError):
+            pass
+        worker.stop()
+        raise SolverError("процесс решателя не запустился")
+
+    def start(self) -> int:
+        """Заранее запускает все процессы (они стартуют параллельно). Возвращает число запущенных."""
+        with self._lock:
+            missing = sum(1 for worker in self._idle if worker is None)
+            self._idle = deque(worker for worker in self._idle if worker is not None)
+        started = [self._spawn() for _ in range(missing)]
+        for worker in started:
+            self._await_ready(worker)
+        with self._lock:
+            self._idle.extend(started)
+        return len(started)
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            worker = self._idle.popleft()
+        if worker is None or not worker.process.is_alive():
+            if worker is not None:
+                worker.stop()
+            try:
+                worker = self._spawn()
+                self._await_ready(worker)
+            except Exception:
+                with self._lock:
+                    self._idle.append(None)
+                raise
+        return worker
+
+    def _checkin(self, worker: _Worker, healthy: bool) -> None:
+        if not healthy:
+            worker.stop()
+        with self._lock:
+            self._idle.append(worker if healthy else None)
+            if not healthy:
+                self.restarts += 1
+
+    @staticmethod
+    def _run_job(worker: _Worker, job: tuple, deadline: float,
+                 on_improvement: Optional[Callable[[List[int]], None]]) -> Tuple[List[int], float]:
+        """Выполняется в потоке: отправляет задачу и ждёт ответа процесса не дольше дедлайна."""
+        worker.conn.send(job)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not worker.conn.poll(remaining):
+                raise SolverTimeout("решатель не уложился в дедлайн")
+            message = worker.conn.recv()
+            if message[0] == "progress":
+                if on_improvement is not None:
+                    on_improvement(message[1])
+            elif message[0] == "done":
+                return message[1], message[2]
+            else:
+                raise SolverError(message[1])
+
+    async def solve(self, matrix: np.ndarray, visit_time_s: float, max_time_s: float, solver: str = "ils",
+                    time_budget_s: float = 0.05, deadline_s: Optional[float] = None,
+                    on_improvement: Optional[Callable[[List[int]], None]] = None) -> Tuple[List[int], float]:
+        """
+        Решает задачу в процессе пула (см. route_solver.solve). deadline_s - сколько ждать
+        всего, включая очередь к процессам (по умолчанию time_budget_s + deadline_grace_s).
+        on_improvement вызывается из служебного потока, как и при решении в потоке.
+        """
+        deadline = time.monotonic() + (time_budget_s + self.deadline_grace_s if deadline_s is None else deadline_s)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise SolverTimeout("нет свободного процесса решателя") from None
+
+        self.busy += 1
+        try:
+            worker = await asyncio.to_thread(self._checkout)
+            matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+            shm = SharedMemory(create=True, size=max(1, matrix.nbytes))
+            healthy = False
+            try:
+                np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf)[:] = matrix
+                job = (shm.name, matrix.shape, visit_time_s, max_time_s, solver, time_budget_s,
+                       on_improvement is not None)
+                result = await asyncio.to_thread(self._run_job, worker, job, deadline, on_improvement)
+                healthy = True
+                self.completed += 1
+                return result
+            except SolverTimeout:
+                self.timeouts += 1
+                raise
+            except (SolverError, EOFError, OSError) as e:
+                self.failures += 1
+                raise SolverError(f"процесс решателя завершился с ошибкой: {e}") from e
+            finally:
+                # Процесс с незавершённой задачей (дедлайн, отмена, ошибка) заменяется новым
+                self._checkin(worker, healthy)
+                shm.close()
+                shm.unlink()
+        finally:
+            self.busy -= 1
+            self._slots.release()
+
+    def close(self) -> None:
+        """Останавливает процессы пула."""
+        with self._lock:
+            workers = [worker for worker in self._idle if worker is not None]
+            self._idle = deque([None] * self.workers)
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+            worker.process.join(timeout=1)
+            worker.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            alive = sum(1 for worker in self._idle if worker is not None)
+        return {
+            "workers": self.workers,
+            "idle_processes": alive,
+            "busy": self.busy,
+            "completed": self.completed,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "restarts": self.restarts,
+            "started_processes": self.started_processes,
+        }
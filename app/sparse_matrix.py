@@ -0,0 +1,179 @@
+"""
+Разреженная матрица времени для больших наборов кандидатов (100-300 POI).
+
+Полная матрица растёт как N^2 и по запросам к OSRM, и по кэшу. В разреженном режиме
+для каждого POI известно время только до его k ближайших соседей (по прямой,
+в обе стороны), плюс полные строка и столбец точки старта. Остальные пары
+считаются недоступными (inf) - решатели route_solver с такими матрицами уже умеют работать:
+маршрут идёт по рёбрам "соседнего" графа.
+
+Запросы к OSRM Table собираются блоками: соседние по пространству POI объединяются
+в группу, и одним запросом (sources = группа, destinations = их соседи) забираются
+все нужные рёбра группы; в запрос попадают только координаты группы и соседей,
+поэтому размер запроса не превышает max_points независимо от N.
+"""
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from poi_index import haversine_m
+
+PairKey = Tuple[int, int]
+
+
+class TableRequest:
+    """Блок OSRM Table: points - глобальные индексы точек запроса, sources/destinations - локальные."""
+    __slots__ = ("points", "sources", "destinations", "start_only")
+
+    def __init__(self, points: List[int], sources: List[int], destinations: List[int], start_only: bool):
+        self.points = points
+        self.sources = sources
+        self.destinations = destinations
+        # Блок только со строкой/столбцом старта (его можно оценить по расстоянию, если OSRM недоступен)
+        self.start_only = start_only
+
+
+def nearest_neighbours(coordinates: Sequence[Tuple[float, float]], k: int) -> List[List[int]]:
+    """Для каждой точки 1..N - индексы k ближайших других POI (индекс 0 - старт, в соседи не входит)."""
+    n = len(coordinates)
+    if n <= 2:
+        return [[] for _ in range(n)]
+    lats = np.array([lat for lat, _ in coordinates])
+    lons = np.array([lon for _, lon in coordinates])
+    k = min(k, n - 2)
+    neighbours: List[List[int]] = [[]]
+    for i in range(1, n):
+        distances = haversine_m(lats[i], lons[i], lats[1:], lons[1:])
+        distances[i - 1] = np.inf
+        nearest = np.argpartition(distances, k - 1)[:k] if k < n - 1 else np.arange(n - 1)
+        neighbours.append(sorted(int(j) + 1 for j in nearest))
+    return neighbours
+
+
+def sparse_pairs(neighbours: Sequence[Sequence[int]]) -> Set[PairKey]:
+    """Рёбра POI-POI разреженного графа; симметричны, чтобы 2-opt мог разворачивать отрезки."""
+    pairs: Set[PairKey] = set()
+    for i, row in enumerate(neighbours):
+        for j in row:
+            pairs.add((i, j))
+            pairs.add((j, i))
+    return pairs
+
+
+def known_edges(profile: str, ids: Sequence[Optional[int]], pairs: Set[PairKey], cache=None,
+                store=None) -> Dict[PairKey, float]:
+    """
+    Рёбра из предрассчитанных матриц (store, см. matrix_store.MatrixStore) и кэша
+    (travel_cache.TravelTimeCache). pairs - индексы точек, ids[i] - id объекта.
+    """
+    by_ids = {(ids[i], ids[j]): (i, j) for i, j in pairs if ids[i] is not None and ids[j] is not None}
+    found: Dict[PairKey, float] = {}
+    if store is not None:
+        found.update(store.get_pairs(profile, list(by_ids)))
+    if cache is not None:
+        rest = [pair for pair in by_ids if pair not in found]
+        if rest:
+            found.update(cache.get_pairs(profile, rest))
+    return {by_ids[pair]: value for pair, value in found.items()}
+
+
+def store_edges(cache, profile: str, ids: Sequence[Optional[int]], edges: Dict[PairKey, float],
+                fetched: Set[PairKey]) -> None:
+    """Кладёт в кэш полученные от OSRM рёбра POI-POI (fetched - пары, пришедшие в ответах)."""
+    values = {(ids[i], ids[j]): edges[(i, j)] for i, j in fetched
+              if ids[i] is not None and ids[j] is not None}
+    cache.put_many(profile, values)
+
+
+def plan_sparse_requests(coordinates: Sequence[Tuple[float, float]], missing: Set[PairKey],
+                         max_points: int = 100, max_sources: int = 100) -> List[TableRequest]:
+    """
+    Запросы к OSRM для недостающих рёбер POI-POI (missing) и строки/столбца старта.
+    Источники обходятся в пространственном порядке (полосы по широте), и в группу
+    добавляются, пока группа вместе с нужными ей назначениями помещается в max_points
+    и в ней не больше max_sources источников (меньше группа - меньше лишних пар в ответе,
+    но больше запросов).
+    """
+    n = len(coordinates)
+    requests: List[TableRequest] = []
+
+    # Старт -> все и все -> старт: двумя узкими запросами на блок из max_points - 1 POI
+    pois = list(range(1, n))
+    for offset in range(0, len(pois), max_points - 1):
+        chunk = pois[offset:offset + max_points - 1]
+        points = [0] + chunk
+        rest = list(range(1, len(points)))
+        requests.append(TableRequest(points, [0], rest, True))
+        requests.append(TableRequest(points, rest, [0], True))
+
+    targets: Dict[int, Set[int]] = {}
+    for i, j in missing:
+        targets.setdefault(i, set()).add(j)
+    if not targets:
+        return requests
+
+    # Группы - компактные кучки источников: к первой ещё не распределённой точке (в порядке полос
+    # по широте) добавляются ближайшие к ней источники, пока хватает лимитов
+    remaining = sorted(targets, key=lambda i: (round(coordinates[i][0] / 0.01), coordinates[i][1]))
+    lats = np.array([coordinates[i][0] for i in remaining])
+    lons = np.array([coordinates[i][1] for i in remaining])
+    free = np.ones(len(remaining), dtype=bool)
+    for seed in range(len(remaining)):
+        if not free[seed]:
+            continue
+        distances = haversine_m(lats[seed], lons[seed], lats, lons)
+        distances[~free] = np.inf
+        group: List[int] = []
+        group_targets: Set[int] = set()
+        for position in np.argsort(distances, kind="stable").tolist():
+            if not np.isfinite(distances[position]) or len(group) >= max_sources:
+                break
+            i = remaining[position]
+            merged = group_targets | targets[i]
+            if group and len(set(group) | merged | {i}) > max_points:
+                break
+            group.append(i)
+            group_targets = merged
+            free[position] = False
+        requests.append(_block_request(group, group_targets))
+    return requests
+
+
+def _block_request(sources: List[int], destinations: Set[int]) -> TableRequest:
+    points = sorted(set(sources) | destinations)
+    local = {p: idx for idx, p in enumerate(points)}
+    return TableRequest(points, [local[p] for p in sources], [local[p] for p in sorted(destinations)], False)
+
+
+def collect_block(edges: Dict[PairKey, float], request: TableRequest,
+                  durations: List[List[Optional[float]]]) -> List[PairKey]:
+    """
+    Добавляет в edges все пары ответа OSRM (в том числе не запрошенные явно - они бесплатны).
+    Возвращает добавленные пары; null (нет маршрута) не добавляется.
+    """
+    added: List[PairKey] = []
+    for row, source in zip(durations, request.sources):
+        i = request.points[source]
+        for value, destination in zip(row, request.destinations):
+            j = request.points[destination]
+            if value is not None and i != j:
+                edges[(i, j)] = value
+                added.append((i, j))
+    return added
+
+
+def estimate_start_edges(edges: Dict[PairKey, float], seconds: Sequence[float]) -> None:
+    """Недостающие рёбра старта - оценкой seconds[j] времени между стартом и точкой j (OSRM недоступен)."""
+    for j in range(1, len(seconds)):
+        edges.setdefault((0, j), float(seconds[j]))
+        edges.setdefault((j, 0), float(seconds[j]))
+
+
+def sparse_to_matrix(n: int, edges: Dict[PairKey, float]) -> np.ndarray:
+    """Матрица NxN для решателя: известные рёбра, 0 на диагонали, inf - нет ребра."""
+    matrix = np.full((n, n), np.inf, dtype=np.float64)
+    if edges:
+        index = np.array(list(edges.keys()), dtype=np.int64)
+        matrix[index[:, 0], index[:, 1]] = np.fromiter(edges.values(), dtype=np.float64, count=len(edges))
+    np.fill_diagonal(matrix, 0.0)
+    return matrix
@@ -0,0 +1,95 @@
+"""
+Фоновые (спекулятивные) задачи, запущенные до того, как понадобится их результат.
+
+Разбор текстового запроса через LLM стартует сразу в handle_text_query, а
+handle_location забирает уже готовый (или почти готовый) результат.
+Задачи asyncio нельзя положить в Redis, поэтому они хранятся в памяти процесса
+рядом с сессией; если геолокация придёт в другую реплику, запрос просто
+разбирается заново.
+
+- новая задача пользователя отменяет предыдущую;
+- задача выдаётся только для того же текста запроса и пока не истёк ttl_s
+  (запрос с другим текстом задачу не трогает);
+- невостребованные задачи отменяются при истечении срока или вытеснении;
+- ошибка задачи пробрасывается тому, кто её забрал (await).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger("AI_Travel")
+
+
+class SpeculativeTasks:
+    def __init__(self, ttl_s: float = 600, maxsize: int = 10_000):
+        self.ttl_s = ttl_s
+        self.maxsize = maxsize
+        # ключ -> (текст запроса, задача, момент истечения)
+        self._tasks: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.failed = 0
+
+    def start(self, key: Hashable, query: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        self.cancel(key)
+        now = time.monotonic()
+        task = asyncio.ensure_future(factory())
+        task.add_done_callback(self._log_failure)
+        self._tasks[key] = (query, task, now + self.ttl_s)
+        self.started += 1
+
+        while self._tasks:
+            oldest_key, (_, _, expires_at) = next(iter(self._tasks.items()))
+            if expires_at > now and len(self._tasks) <= self.maxsize:
+                break
+            self.cancel(oldest_key)
+        return task
+
+    def take(self, key: Hashable, query: str) -> Optional[asyncio.Task]:
+        """
+        Забирает задачу для этого запроса. Просроченная задача отменяется; задача другого
+        (более нового) запроса остаётся на месте - её заберёт геолокация для него.
+        """
+        entry = self._tasks.get(key)
+        if entry is None:
+            return None
+        stored_query, task, expires_at = entry
+        if expires_at <= time.monotonic():
+            self.cancel(key)
+            return None
+        if stored_query != query:
+            return None
+        del self._tasks[key]
+        self.used += 1
+        return task
+
+    def cancel(self, key: Hashable) -> None:
+        entry = self._tasks.pop(key, None)
+        if entry is not None:
+            self._cancel_task(entry[1])
+
+    def _cancel_task(self, task: asyncio.Task) -> None:
+        if not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    def _log_failure(self, task: asyncio.Task) -> None:
+        # Забираем исключение сразу: задачу могут так и не востребовать
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.failed += 1
+            logger.warning(f"Фоновый разбор запроса завершился ошибкой: {error!r}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._tasks),
+            "started": self.started,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+        }
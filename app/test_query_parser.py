@@ -0,0 +1,45 @@
+"""Проверки локального разбора запросов: запуск - python -m pytest из каталога app."""
+import pytest
+
+from query_parser import parse_query_locally
+
+
+@pytest.mark.parametrize("query, travel_mode, interests", [
+    ("Хочу пешком 2 часа по паркам", "пеший", "парки и природа"),
+    ("на авто 3 часа по музеям", "автомобиль", "искусство"),
+    ("на машине 2 часа в ботанический сад", "автомобиль", "парки и природа"),
+    ("на велике час по лесу", "велосипед", "парки и природа"),
+    ("пешком 2 часа по городу", "пеший", "город"),
+])
+def test_local_parse(query, travel_mode, interests):
+    params = parse_query_locally(query)
+    assert params is not None
+    assert params["travel_mode"] == travel_mode
+    assert params["interests"] == interests
+
+
+@pytest.mark.parametrize("query", [
+    "на автобусе в музей на 2 часа",
+    "на метро 2 часа по музеям",
+    "на такси в храм на час",
+    "на трамвае 2 часа по паркам",
+])
+def test_unknown_transport_goes_to_llm(query):
+    assert parse_query_locally(query) is None
+
+
+@pytest.mark.parametrize("query", [
+    "на машине 2 часа в садик",
+    "пешком 2 часа на парковку",
+    "пешком час до лестницы",
+    "на машине 2 часа в огород",
+])
+def test_short_stems_do_not_match_other_words(query):
+    # Интересы не определены - локальный разбор не уверен
+    assert parse_query_locally(query) is None
+
+
+def test_velik_does_not_match_velikiy():
+    params = parse_query_locally("пешком 3 часа по музеям великого города")
+    assert params is not None
+    assert params["travel_mode"] == "пеший"
@@ -0,0 +1,96 @@
+"""
+Запись обезличенных трасс запросов для нагрузочного теста (load_test.py).
+
+Трасса - JSONL, по событию на строку, с временем от начала записи (t, сек):
+    {"t": 0.0,  "type": "text",     "user": "3f2a9c01b7d4", "query": "Хочу пешком 2 часа по паркам"}
+    {"t": 0.02, "type": "parse",    "query": "...", "params": {...}}
+    {"t": 4.1,  "type": "location", "user": "3f2a9c01b7d4", "lat": 56.327, "lon": 44.006}
+    {"t": 4.3,  "type": "osrm",     "profile": "driving", "coordinates": [[56.327, 44.006], ...],
+                                    "sources": null, "destinations": [1, 2], "durations": [[...]]}
+
+Обезличивание: id пользователя заменяется хэшем с солью (соль своя у каждой записи, если не
+задана явно, поэтому трассы разных записей не связываются), координаты округляются до
+precision знаков (3 - около 100 м) - и в геолокации, и в запросах к OSRM, чтобы при
+воспроизведении округлённые точки старта находили свои ответы. Текст запроса сохраняется
+как есть - по нему разбирается маршрут. Пользователи отбираются целиком (sample_rate по хэшу),
+чтобы текст и геолокация одного пользователя попадали в трассу вместе; разбор пишется только
+для запросов отобранных пользователей. Ответы OSRM не содержат id пользователя и пишутся все.
+"""
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+
+def round_coordinates(coordinates: Sequence[Tuple[float, float]], precision: int) -> List[List[float]]:
+    return [[round(lat, precision), round(lon, precision)] for lat, lon in coordinates]
+
+
+class TraceRecorder:
+    def __init__(self, path: str, sample_rate: float = 1.0, precision: int = 3, salt: Optional[str] = None):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.precision = precision
+        self._salt = salt or secrets.token_hex(16)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # Тексты недавних запросов отобранных пользователей - для записи их разбора
+        self._queries: "OrderedDict[str, None]" = OrderedDict()
+        self.events = 0
+        self.skipped = 0
+
+    def _user(self, user_id: Hashable) -> Optional[str]:
+        """Обезличенный id пользователя или None, если пользователь не попал в выборку."""
+        digest = hashlib.sha256(f"{self._salt}:{user_id}".encode()).hexdigest()
+        if int(digest[:8], 16) / 0xFFFFFFFF >= self.sample_rate:
+            self.skipped += 1
+            return None
+        return digest[:12]
+
+    def _write(self, event: Dict[str, Any]) -> None:
+        line = json.dumps({"t": round(time.monotonic() - self._started, 3), **event}, ensure_ascii=False)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.events += 1
+
+    def record_query(self, user_id: Hashable, query: str) -> None:
+        user = self._user(user_id)
+        if user is not None:
+            with self._lock:
+                self._queries[query] = None
+                self._queries.move_to_end(query)
+                if len(self._queries) > 10_000:
+                    self._queries.popitem(last=False)
+            self._write({"type": "text", "user": user, "query": query})
+
+    def record_location(self, user_id: Hashable, lat: float, lon: float) -> None:
+        user = self._user(user_id)
+        if user is not None:
+            self._write({"type": "location", "user": user,
+                         "lat": round(lat, self.precision), "lon": round(lon, self.precision)})
+
+    def record_parse(self, query: str, params: Dict[str, Any]) -> None:
+        with self._lock:
+            if query not in self._queries:
+                return
+        self._write({"type": "parse", "query": query, "params": params})
+
+    def record_osrm(self, profile: str, coordinates: Sequence[Tuple[float, float]], sources: Optional[List[int]],
+                    destinations: Optional[List[int]], durations: List[List[Optional[float]]]) -> None:
+        self._write({"type": "osrm", "profile": profile,
+                     "coordinates": round_coordinates(coordinates, self.precision),
+                     "sources": sources, "destinations": destinations, "durations": durations})
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"events": self.events, "skipped_events": self.skipped}
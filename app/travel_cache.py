@@ -0,0 +1,260 @@
+"""
+Кэш времени в пути между объектами для OSRMClient.
+
+Время между двумя POI не меняется от запроса к запросу, поэтому храним его
+по ключу (профиль OSRM, id объекта-источника, id объекта-назначения).
+В памяти - LRU с TTL, опционально поверх него SQLite-файл, который
+переживает перезапуски и может использоваться несколькими процессами.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("AI_Travel")
+
+PairKey = Tuple[int, int]
+
+
+class SqliteTravelTimeStore:
+    """Хранилище на диске. WAL-режим позволяет читать его из нескольких процессов."""
+
+    def __init__(self, path: str, ttl_s: float):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS travel_times (
+                profile TEXT NOT NULL,
+                src INTEGER NOT NULL,
+                dst INTEGER NOT NULL,
+                duration REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (profile, src, dst)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    def get_many(self, profile: str, src_ids: Sequence[int], dst_ids: Sequence[int]) -> Dict[PairKey, float]:
+        if not src_ids or not dst_ids:
+            return {}
+        src_ph = ",".join("?" * len(src_ids))
+        dst_ph = ",".join("?" * len(dst_ids))
+        min_updated = time.time() - self.ttl_s
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT src, dst, duration FROM travel_times "
+                f"WHERE profile = ? AND src IN ({src_ph}) AND dst IN ({dst_ph}) AND updated_at >= ?",
+                (profile, *src_ids, *dst_ids, min_updated)
+            ).fetchall()
+        return {(src, dst): duration for src, dst, duration in rows}
+
+    def put_many(self, profile: str, values: Dict[PairKey, float]) -> None:
+        if not values:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO travel_times (profile, src, dst, duration, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(profile, src, dst, duration, now) for (src, dst), duration in values.items()]
+            )
+            self._conn.commit()
+
+    def load_recent(self, limit: int) -> Dict[str, Dict[PairKey, float]]:
+        """До limit самых свежих (не просроченных) пар по профилям - для прогрева кэша в памяти."""
+        min_updated = time.time() - self.ttl_s
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT profile, src, dst, duration FROM travel_times WHERE updated_at >= ? "
+                "ORDER BY updated_at DESC LIMIT ?",
+                (min_updated, limit)
+            ).fetchall()
+        result: Dict[str, Dict[PairKey, float]] = {}
+        # От старых к свежим: в LRU последними (самыми "свежими") окажутся последние обновлённые пары
+        for profile, src, dst, duration in reversed(rows):
+            result.setdefault(profile, {})[(src, dst)] = duration
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class TravelTimeCache:
+    """LRU-кэш с TTL в памяти, опционально с SQLite-хранилищем (read-through / write-through)."""
+
+    def __init__(self, maxsize: int = 200_000, ttl_s: float = 7 * 24 * 3600,
+                 store: Optional[SqliteTravelTimeStore] = None):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.store = store
+        self._data: "OrderedDict[Tuple[str, int, int], Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, profile: str, src_ids: Sequence[int], dst_ids: Sequence[int]) -> Dict[PairKey, float]:
+        """Возвращает известные времена для всех пар src x dst (без диагонали)."""
+        return self.get_pairs(profile, [(src, dst) for src in src_ids for dst in dst_ids if src != dst])
+
+    def get_pairs(self, profile: str, pairs: Sequence[PairKey]) -> Dict[PairKey, float]:
+        """Возвращает известные времена для отдельных пар (src, dst) - например, рёбер разреженной матрицы."""
+        now = time.monotonic()
+        found: Dict[PairKey, float] = {}
+        missing: List[PairKey] = []
+        with self._lock:
+            for src, dst in pairs:
+                key = (profile, src, dst)
+                entry = self._data.get(key)
+                if entry is not None and entry[1] > now:
+                    self._data.move_to_end(key)
+                    found[(src, dst)] = entry[0]
+                else:
+                    if entry is not None:
+                        del self._data[key]
+                    missing.append((src, dst))
+
+        if missing and self.store is not None:
+            from_store = self.store.get_many(profile, sorted({s for s, _ in missing}), sorted({d for _, d in missing}))
+            wanted = set(missing)
+            from_store = {pair: value for pair, value in from_store.items() if pair in wanted}
+            found.update(from_store)
+            self._put_memory(profile, from_store)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(pairs) - len(found)
+        return found
+
+    def preload(self, limit: Optional[int] = None) -> int:
+        """Загружает в память самые свежие пары из SQLite-хранилища (прогрев после перезапуска)."""
+        if self.store is None:
+            return 0
+        loaded = self.store.load_recent(self.maxsize if limit is None else min(limit, self.maxsize))
+        for profile, values in loaded.items():
+            self._put_memory(profile, values)
+        return sum(len(values) for values in loaded.values())
+
+    def put_many(self, profile: str, values: Dict[PairKey, float]) -> None:
+        self._put_memory(profile, values)
+        if self.store is not None:
+            self.store.put_many(profile, values)
+
+    def _put_memory(self, profile: str, values: Dict[PairKey, float]) -> None:
+        expires_at = time.monotonic() + self.ttl_s
+        with self._lock:
+            for (src, dst), duration in values.items():
+                key = (profile, src, dst)
+                self._data[key] = (duration, expires_at)
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# --- Сборка матрицы из кэша и недостающих блоков OSRM ---
+
+def matrix_from_cache(cache: Optional[TravelTimeCache], profile: str, ids: Sequence[Optional[int]],
+                      store=None) -> Tuple[List[List[Optional[float]]], List[int]]:
+    """
+    Заполняет матрицу NxN из предрассчитанных матриц (store, см. matrix_store.MatrixStore)
+    и кэша. ids[i] - id объекта или None для точки без id (например, старт пользователя).
+    Возвращает матрицу и индексы точек, строки и столбцы которых надо запросить у OSRM.
+    """
+    n = len(ids)
+    matrix: List[List[Optional[float]]] = [[None] * n for _ in range(n)]
+    for i in range(n):
+        matrix[i][i] = 0.0
+
+    if store is not None:
+        store.fill(profile, ids, matrix)
+
+    if cache is not None:
+        # Из кэша берём только то, чего нет в предрассчитанных матрицах
+        position = {poi_id: i for i, poi_id in enumerate(ids) if poi_id is not None}
+        unknown_ids = sorted({ids[i] for i in range(n) for j in range(n)
+                              if matrix[i][j] is None and ids[i] is not None and ids[j] is not None})
+        cached = cache.get_many(profile, unknown_ids, unknown_ids) if unknown_ids else {}
+        for (src, dst), duration in cached.items():
+            if matrix[position[src]][position[dst]] is None:
+                matrix[position[src]][position[dst]] = duration
+
+    # Недостающие ячейки покрываем строками/столбцами небольшого набора точек
+    # (жадное вершинное покрытие): обычно это только точка старта.
+    missing_cells = [(i, j) for i in range(n) for j in range(n) if matrix[i][j] is None]
+    if len(missing_cells) * 4 > n * n:
+        return matrix, list(range(n))
+    cover: List[int] = []
+    while missing_cells:
+        counts: Dict[int, int] = {}
+        for i, j in missing_cells:
+            counts[i] = counts.get(i, 0) + 1
+            counts[j] = counts.get(j, 0) + 1
+        best = max(counts, key=counts.get)
+        cover.append(best)
+        missing_cells = [(i, j) for i, j in missing_cells if i != best and j != best]
+    return matrix, sorted(cover)
+
+
+def plan_table_requests(n: int, missing: Sequence[int]) -> List[Tuple[Optional[List[int]], Optional[List[int]]]]:
+    """
+    Какие блоки матрицы запросить у OSRM: (sources, destinations), None - все точки.
+    Недостающие ячейки лежат в строках и столбцах точек missing: запрашиваем их двумя
+    узкими блоками, а если это не дешевле полной матрицы - одной полной таблицей.
+    """
+    if not missing:
+        return []
+    if 2 * len(missing) * n >= n * n:
+        return [(None, None)]
+    rows = list(missing)
+    return [(rows, None), (None, rows)]
+
+
+def fill_block(matrix: List[List[Optional[float]]], sources: Optional[Sequence[int]],
+               destinations: Optional[Sequence[int]], durations: List[List[Optional[float]]]) -> None:
+    n = len(matrix)
+    sources = range(n) if sources is None else sources
+    destinations = range(n) if destinations is None else destinations
+    for row, i in zip(durations, sources):
+        for value, j in zip(row, destinations):
+            matrix[i][j] = value
+
+
+def store_matrix(cache: TravelTimeCache, profile: str, ids: Sequence[Optional[int]],
+                 matrix: List[List[Optional[float]]], fetched: Sequence[int]) -> None:
+    """
+    Кладёт в кэш пары POI-POI из строк и столбцов fetched, полученных от OSRM.
+    null от OSRM (нет маршрута) не кэшируется.
+    """
+    fetched = set(fetched)
+    values = {}
+    for i, src in enumerate(ids):
+        if src is None:
+            continue
+        for j, dst in enumerate(ids):
+            if dst is None or i == j or (i not in fetched and j not in fetched):
+                continue
+            if matrix[i][j] is not None:
+                values[(src, dst)] = matrix[i][j]
+    cache.put_many(profile, values)
+
+
+def table_query_string(sources: Optional[Iterable[int]], destinations: Optional[Iterable[int]]) -> str:
+    params = []
+    if sources is not None:
+        params.append("sources=" + ";".join(map(str, sources)))
+    if destinations is not None:
+        params.append("destinations=" + ";".join(map(str, destinations)))
+    return ("?" + "&".join(params)) if params else ""
@@ -0,0 +1,189 @@
+"""
+Локальная оценка времени в пути без обращения к OSRM.
+
+TravelTimeModel - интерфейс оценщика: время (сек, в единицах профиля OSRM) от точки
+до массива точек и матрица NxN. HaversineTravelModel считает его по расстоянию
+по прямой (векторизованно): время = расстояние * темп (сек/м), где темп до калибровки -
+коэффициент извилистости / скорость профиля.
+
+Калибровка идёт по ответам OSRM и кэша: для пар POI-POI в скользящем окне хранятся
+отношения время / расстояние. Медиана окна - темп для оценок (запасной вариант при
+недоступном OSRM), нижний квантиль - оптимистичный темп для отсева заведомо
+недостижимых кандидатов. Перед обновлением окна на новых парах считается ошибка
+текущей модели (средняя относительная, MAPE) - она публикуется в метриках.
+"""
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from poi_index import haversine_m
+
+
+def _arrays(coordinates: Sequence[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+    return (np.array([lat for lat, _ in coordinates], dtype=np.float64),
+            np.array([lon for _, lon in coordinates], dtype=np.float64))
+
+
+class TravelTimeModel(ABC):
+    """Оценщик времени в пути; observe() - ответ OSRM для калибровки (по умолчанию не используется)."""
+
+    @abstractmethod
+    def estimate(self, lat: float, lon: float, lats: np.ndarray, lons: np.ndarray,
+                 optimistic: bool = False) -> np.ndarray:
+        """Время (сек) от точки до каждой из точек; optimistic - нижняя оценка для отсева кандидатов."""
+        ...
+
+    def matrix(self, coordinates: Sequence[Tuple[float, float]]) -> np.ndarray:
+        """Матрица NxN оценок (0 на диагонали) - в том же формате, что и матрица OSRM для решателя."""
+        lats, lons = _arrays(coordinates)
+        result = np.vstack([self.estimate(lat, lon, lats, lons) for lat, lon in zip(lats, lons)])
+        np.fill_diagonal(result, 0.0)
+        return result
+
+    def observe(self, coordinates: Sequence[Tuple[float, float]], durations) -> int:
+        return 0
+
+    def observe_pairs(self, distances_m: np.ndarray, seconds: np.ndarray) -> int:
+        return 0
+
+    def stats(self) -> Dict[str, float]:
+        return {}
+
+
+class HaversineTravelModel(TravelTimeModel):
+    def __init__(self, speed_m_s: float, detour_factor: float = 1.3, window: int = 5000,
+                 min_samples: int = 100, min_distance_m: float = 200.0, low_quantile: float = 0.1,
+                 max_samples_per_observation: int = 500, seed: Optional[int] = None):
+        self.speed_m_s = speed_m_s
+        self.prior_pace = detour_factor / speed_m_s
+        # До калибровки оптимистичная оценка - движение по прямой с номинальной скоростью
+        self.prior_pace_low = 1.0 / speed_m_s
+        self.pace = self.prior_pace
+        self.pace_low = self.prior_pace_low
+        self.min_samples = min_samples
+        self.min_distance_m = min_distance_m
+        self.low_quantile = low_quantile
+        self.max_samples_per_observation = max_samples_per_observation
+        self._ratios: "deque[float]" = deque(maxlen=window)
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.samples = 0
+        self._error_sum = 0.0
+        self.recent_error = 0.0
+
+    @property
+    def is_calibrated(self) -> bool:
+        return len(self._ratios) >= self.min_samples
+
+    def estimate(self, lat: float, lon: float, lats: np.ndarray, lons: np.ndarray,
+                 optimistic: bool = False) -> np.ndarray:
+        return haversine_m(lat, lon, lats, lons) * (self.pace_low if optimistic else self.pace)
+
+    def observe(self, coordinates: Sequence[Tuple[float, float]], durations) -> int:
+        """
+        Калибровка по матрице OSRM для тех же координат (None/inf - нет ребра).
+        Берутся только пары POI-POI (индексы от 1): строку и столбец старта при недоступном
+        OSRM могла заполнить сама модель. Возвращает число учтённых пар.
+        """
+        n = len(coordinates)
+        if n < 3:
+            return 0
+        matrix = np.asarray(durations, dtype=np.float64)[1:, 1:]
+        rows, cols = np.nonzero(np.isfinite(matrix) & (matrix > 0))
+        if rows.size > self.max_samples_per_observation:
+            chosen = self._rng.choice(rows.size, self.max_samples_per_observation, replace=False)
+            rows, cols = rows[chosen], cols[chosen]
+        if rows.size == 0:
+            return 0
+
+        lats, lons = _arrays(coordinates[1:])
+        return self.observe_pairs(haversine_m(lats[rows], lons[rows], lats[cols], lons[cols]), matrix[rows, cols])
+
+    def observe_pairs(self, distances_m: np.ndarray, seconds: np.ndarray) -> int:
+        """Калибровка по парам (расстояние по прямой, время OSRM) - например, из предрассчитанных матриц."""
+        far = (distances_m >= self.min_distance_m) & np.isfinite(seconds) & (seconds > 0)
+        distances, seconds = distances_m[far], seconds[far]
+        if distances.size == 0:
+            return 0
+
+        with self._lock:
+            # Ошибка модели на ещё не виденных ею парах
+            errors = np.abs(distances * self.pace - seconds) / seconds
+            self._error_sum += float(errors.sum())
+            self.samples += int(errors.size)
+            self.recent_error = float(errors.mean())
+
+            self._ratios.extend((seconds / distances).tolist())
+            if self.is_calibrated:
+                ratios = np.fromiter(self._ratios, dtype=np.float64, count=len(self._ratios))
+                self.pace = float(np.median(ratios))
+                self.pace_low = float(np.quantile(ratios, self.low_quantile))
+        return int(distances.size)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "pace_s_per_km": round(self.pace * 1000, 2),
+                "pace_low_s_per_km": round(self.pace_low * 1000, 2),
+                "detour_factor": round(self.pace * self.speed_m_s, 3),
+                "calibrated": int(self.is_calibrated),
+                "samples": self.samples,
+                "mape_pct": round(self._error_sum / self.samples * 100, 2) if self.samples else 0.0,
+                "recent_mape_pct": round(self.recent_error * 100, 2),
+            }
+
+
+class TravelTimeModels:
+    """Модели по профилям OSRM (создаются при первом обращении через factory)."""
+
+    def __init__(self, factory: Callable[[str], TravelTimeModel]):
+        self._factory = factory
+        self._models: Dict[str, TravelTimeModel] = {}
+        self._lock = threading.Lock()
+
+    def get(self, profile: str) -> TravelTimeModel:
+        model = self._models.get(profile)
+        if model is None:
+            with self._lock:
+                model = self._models.setdefault(profile, self._factory(profile))
+        return model
+
+    def observe(self, profile: str, coordinates: Sequence[Tuple[float, float]], durations) -> int:
+        return self.get(profile).observe(coordinates, durations)
+
+    def profiles(self) -> List[str]:
+        return sorted(self._models)
+
+    def stats(self) -> Dict[str, float]:
+        return {f"{profile}_{key}": value
+                for profile in self.profiles() for key, value in self.get(profile).stats().items()}
+
+
+def calibrate_from_matrix_store(models: TravelTimeModels, store, records: Sequence, max_pairs: int = 5000,
+                                seed: Optional[int] = None) -> Dict[str, int]:
+    """
+    Начальная калибровка по предрассчитанным матрицам (matrix_store.MatrixStore): для каждого
+    профиля - до max_pairs случайных пар объектов (records - PoiRecord с id и координатами).
+    Возвращает число учтённых пар по профилям.
+    """
+    known = [r for r in records if r.id in store.position]
+    if len(known) < 2:
+        return {}
+    rng = np.random.default_rng(seed)
+    src = rng.integers(0, len(known), max_pairs)
+    dst = rng.integers(0, len(known), max_pairs)
+    different = src != dst
+    src, dst = src[different], dst[different]
+    lats = np.array([r.lat for r in known], dtype=np.float64)
+    lons = np.array([r.lon for r in known], dtype=np.float64)
+    positions = np.array([store.position[r.id] for r in known], dtype=np.int64)
+    distances = haversine_m(lats[src], lons[src], lats[dst], lons[dst])
+
+    observed: Dict[str, int] = {}
+    for profile, matrix in store.matrices.items():
+        seconds = np.asarray(matrix[positions[src], positions[dst]], dtype=np.float64)
+        observed[profile] = models.get(profile).observe_pairs(distances, seconds)
+    return observed
@@ -0,0 +1,89 @@
+"""
+Параллельная обработка обновлений Telegram с сохранением порядка для каждого пользователя.
+
+Обновления разных пользователей обрабатываются одновременно (не больше max_concurrent),
+а обновления одного пользователя - строго по очереди, в порядке получения:
+текстовый запрос успевает сохраниться до того, как придёт его геолокация.
+"""
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def _ordering_key(update: object) -> Optional[Hashable]:
+    """Ключ очереди: пользователь, иначе чат; None - обновление без отправителя, порядок не важен."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    max_concurrent - сколько обновлений выполняется одновременно;
+    max_pending    - сколько обновлений может ждать своей очереди (ограничение базового класса).
+
+    Базовый класс берёт свой семафор до do_process_update, поэтому его лимит - это лимит
+    ожидающих, а реальный параллелизм ограничивается собственным семафором уже после
+    блокировки пользователя: иначе один пользователь с пачкой сообщений занял бы все слоты.
+    """
+
+    def __init__(self, max_concurrent: int, max_pending: int = 1024):
+        super().__init__(max(max_concurrent, max_pending))
+        self._limit = max_concurrent
+        self._semaphore_active: Optional[asyncio.Semaphore] = None
+        # ключ -> [блокировка, число обновлений пользователя в обработке и в ожидании]
+        self._user_locks: Dict[Hashable, List[Any]] = {}
+        self.active = 0
+        self.processed = 0
+
+    async def initialize(self) -> None:
+        self._semaphore_active = asyncio.Semaphore(self._limit)
+
+    async def shutdown(self) -> None:
+        self._user_locks.clear()
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        if self._semaphore_active is None:
+            await self.initialize()
+        key = _ordering_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        # До захвата блокировки нет ни одного await, поэтому задачи встают в очередь
+        # пользователя в том же порядке, в каком Application их создал (asyncio.Lock - FIFO)
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def _run(self, coroutine: "Awaitable[Any]") -> None:
+        async with self._semaphore_active:
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "in_flight": self.current_concurrent_updates,
+            "users_queued": len(self._user_locks),
+            "processed": self.processed,
+            "max_concurrent": self._limit,
+        }
@@ -0,0 +1,79 @@
+"""
+Прогрев процесса перед приёмом обновлений Telegram.
+
+После перезапуска контейнера первые пользователи платили бы за импорт SDK,
+первое подключение к БД, первые TLS-рукопожатия и загрузку данных. Поэтому:
+- синхронные шаги (пул БД, POI-индекс, импорт SDK, кэши) запускаются в потоках
+  параллельно сразу при старте - start_background();
+- асинхронные шаги (HTTP-пулы клиентов) выполняются в event loop бота до начала
+  приёма обновлений - run_async(), затем finish() дожидается фоновых шагов
+  и помечает процесс готовым (HEALTH, проба /readyz).
+Длительность каждого шага пишется в лог и в метрики.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import HEALTH, HealthState
+
+logger = logging.getLogger("AI_Travel")
+
+
+def _run_step(name: str, func: Callable[[], Any], health: HealthState) -> Any:
+    started = time.perf_counter()
+    try:
+        result = func()
+    except Exception as e:
+        health.record(name, time.perf_counter() - started, str(e))
+        logger.error(f"Прогрев: шаг {name} завершился ошибкой за {(time.perf_counter() - started) * 1000:.0f} мс: {e}")
+        return None
+    health.record(name, time.perf_counter() - started)
+    logger.info(f"Прогрев: {name} - {(time.perf_counter() - started) * 1000:.0f} мс")
+    return result
+
+
+def start_background(steps: Dict[str, Callable[[], Any]], health: HealthState = HEALTH) -> Dict[str, Future]:
+    """Запускает шаги параллельно в отдельных потоках и сразу возвращает их Future."""
+    if not steps:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="warmup")
+    futures = {name: executor.submit(_run_step, name, func, health) for name, func in steps.items()}
+    executor.shutdown(wait=False)
+    return futures
+
+
+async def run_async(steps: Dict[str, Callable[[], Awaitable[Any]]], timeout_s: float,
+                    health: HealthState = HEALTH) -> None:
+    """Асинхронные шаги - параллельно, каждый не дольше timeout_s."""
+    async def run(name: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(factory(), timeout_s)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            health.record(name, time.perf_counter() - started, error)
+            logger.warning(f"Прогрев: шаг {name} не выполнен за {(time.perf_counter() - started) * 1000:.0f} мс: {error}")
+            return
+        health.record(name, time.perf_counter() - started)
+        logger.info(f"Прогрев: {name} - {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    await asyncio.gather(*[run(name, factory) for name, factory in steps.items()])
+
+
+async def finish(futures: Dict[str, Future], timeout_s: float, health: HealthState = HEALTH,
+                 import_ms: Optional[float] = None) -> None:
+    """
+    Дожидается фоновых шагов (не дольше timeout_s) и помечает процесс готовым.
+    Незавершённые шаги продолжают работу в фоне - бот начинает принимать обновления без них.
+    """
+    pending = [asyncio.wrap_future(future) for future in futures.values()]
+    if pending:
+        done, not_done = await asyncio.wait(pending, timeout=timeout_s)
+        if not_done:
+            late = [name for name, future in futures.items() if not future.done()]
+            logger.warning(f"Прогрев: шаги {late} не завершились за {timeout_s:.0f} с, продолжаем без них")
+    health.mark_ready()
+    imports = f" (импорт модулей {import_ms:.0f} мс)" if import_ms is not None else ""
+    logger.info(f"Прогрев завершён: процесс готов через {health.warmup_ms:.0f} мс после старта{imports}")